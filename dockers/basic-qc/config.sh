@@ -1,4 +1,4 @@
-version="0.2.1"
+version="0.4.0"
 
 # docker related
 registry="quay.io/hisplan"
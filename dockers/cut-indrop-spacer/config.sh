@@ -1,4 +1,4 @@
-version="0.2.0"
+version="0.7.0"
 
 # docker related
 registry="quay.io/hisplan"
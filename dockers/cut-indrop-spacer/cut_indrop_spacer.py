@@ -1,10 +1,19 @@
 #!/usr/bin/env python
 
+import io
 import sys
+import json
 import gzip
+import shutil
 import argparse
 import logging
-from Bio import SeqIO
+import subprocess
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from read_structure import PRESETS, ReadStructure
+from read_qc import ReadQC
 
 
 logger = logging.getLogger("cut_indrop_spacer")
@@ -18,22 +27,275 @@ logging.basicConfig(
     ]
 )
 
+# number of bytes of FASTQ read per batch
+BUFFER_SIZE = 64 * 1024 * 1024
+
+# number of bytes of FASTQ per block in parallel mode
+BLOCK_SIZE = 16 * 1024 * 1024
+
+COMPRESS_LEVEL = 9
+
+
+def read_fastq(fin, buffer_size=BUFFER_SIZE):
+    """
+    Read a 4-line FASTQ in batches without parsing individual records.
+
+    Yields a tuple of lists (headers, sequences, qualities) per batch. Headers
+    are returned without the leading "@", all lines without trailing whitespace.
+
+    :param fin: binary file object (e.g. opened with gzip.open(path, "rb"))
+    """
+    leftover = []
+
+    while True:
+        lines = fin.readlines(buffer_size)
+        if not lines:
+            break
+
+        lines = leftover + lines
+        n = len(lines) - len(lines) % 4
+        leftover = lines[n:]
+
+        headers = lines[0:n:4]
+        if not all(header.startswith(b"@") for header in headers):
+            raise ValueError("Records in FASTQ files should start with '@' character")
+        if not all(plus.startswith(b"+") for plus in lines[2:n:4]):
+            raise ValueError("Expected a '+' line in FASTQ record")
+
+        yield (
+            [header[1:].rstrip() for header in headers],
+            [seq.rstrip() for seq in lines[1:n:4]],
+            [qual.rstrip() for qual in lines[3:n:4]]
+        )
+
+    if any(line.strip() for line in leftover):
+        raise ValueError("Truncated FASTQ record at the end of file")
+
+
+def format_fastq(headers, seqs, quals):
+    """
+    Format a batch of records as a single bytes chunk.
+    """
+    return b"".join(
+        b"@%s\n%s\n+\n%s\n" % record for record in zip(headers, seqs, quals)
+    )
+
+
+def trim_batch(headers, seqs, quals, read_structure, qc=None):
+    """
+    Trim a batch of records and format them as a single bytes chunk.
+
+    Returns the chunk and the number of reads shorter than the read structure.
+    If given, `qc` (ReadQC) is updated with the untrimmed reads.
+    """
+    lengths = list(map(len, seqs))
+    if lengths != list(map(len, quals)):
+        raise ValueError("Lengths of sequence and quality values differs")
+
+    if qc is not None:
+        qc.update(seqs, quals)
+
+    num_too_short = sum(length < read_structure.length for length in lengths)
+
+    chunk = format_fastq(
+        headers,
+        read_structure.extract(seqs),
+        read_structure.extract(quals)
+    )
+
+    return chunk, num_too_short
+
+
+def read_blocks(fin, block_size=BLOCK_SIZE):
+    """
+    Split a decompressed FASTQ stream into blocks of whole records.
+    """
+    leftover = b""
+
+    while True:
+        chunk = fin.read(block_size)
+        if not chunk:
+            break
+
+        chunk = leftover + chunk
+
+        # end of the last complete record (records are 4 lines)
+        pos = chunk.rfind(b"\n") + 1
+        for _ in range(chunk.count(b"\n", 0, pos) % 4):
+            pos = chunk.rfind(b"\n", 0, pos - 1) + 1
+
+        leftover = chunk[pos:]
+        if pos > 0:
+            yield chunk[:pos]
+
+    if leftover:
+        yield leftover
+
+
+def trim_block(block, read_structure, with_qc=False, compress_level=COMPRESS_LEVEL):
+    """
+    Trim a block of records and compress it into an independent gzip member.
+
+    Returns the gzip member, the number of reads, the number of reads shorter
+    than the read structure and the ReadQC of the block (None if not `with_qc`).
+    """
+    chunks = []
+    num_reads = 0
+    num_too_short = 0
+    qc = ReadQC(read_structure) if with_qc else None
+
+    for headers, seqs, quals in read_fastq(io.BytesIO(block)):
+        chunk, n = trim_batch(headers, seqs, quals, read_structure, qc)
+        chunks.append(chunk)
+        num_reads += len(headers)
+        num_too_short += n
+
+    member = gzip.compress(b"".join(chunks), compress_level)
+
+    return member, num_reads, num_too_short, qc
+
+
+@contextlib.contextmanager
+def open_fastq_gz(path):
+    """
+    Open a gzipped FASTQ for binary reading, decompressing with pigz if available.
+    """
+    pigz = shutil.which("pigz")
+
+    if pigz is None:
+        with gzip.open(path, "rb") as fin:
+            yield fin
+        return
+
+    proc = subprocess.Popen([pigz, "-dc", path], stdout=subprocess.PIPE)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+
+    if returncode != 0:
+        raise IOError("pigz failed to decompress {}".format(path))
+
+
+def cut_indrop_spacer_parallel(paths_in, path_out, read_structure, threads,
+                               block_size=BLOCK_SIZE, qc=None):
+    """
+    Trim record-aligned blocks in a pool of worker processes.
 
-def cut_indrop_spacer(path_in, path_out, assay_version):
+    The output is a multi-member gzip with one member per block, written in the
+    order of the input. Returns the number of reads and of too short reads.
+    If given, `qc` (ReadQC) is updated with the statistics of every block.
+    """
+    num_reads = 0
+    num_too_short = 0
 
-    #fixme: support different assay version
+    def blocks():
+        for path_in in paths_in:
+            with open_fastq_gz(path_in) as fin:
+                for block in read_blocks(fin, block_size):
+                    yield block
 
-    if assay_version == "in_drop_v4":
-        with gzip.open(path_in, "rt") as fin:
-            with gzip.open(path_out, "wt") as fout:
-                for record in SeqIO.parse(fin, "fastq"):
-                    # CB1: record[:8]
-                    # CB2: record[12:20]
-                    # UMI: record[20:28]
-                    trimmed_rec = record[:8] + record[12:20] + record[20:28]
-                    SeqIO.write(trimmed_rec, fout, "fastq")
+    with open(path_out, "wb") as fout:
+        with ProcessPoolExecutor(max_workers=threads) as executor:
+            # bound the number of blocks in flight to limit memory usage
+            pending = collections.deque()
+
+            def write_next():
+                member, n, n_short, block_qc = pending.popleft().result()
+                fout.write(member)
+                if qc is not None:
+                    qc.merge(block_qc)
+                return n, n_short
+
+            for block in blocks():
+                if len(pending) >= 2 * threads:
+                    n, n_short = write_next()
+                    num_reads += n
+                    num_too_short += n_short
+                pending.append(
+                    executor.submit(trim_block, block, read_structure, qc is not None)
+                )
+
+            while pending:
+                n, n_short = write_next()
+                num_reads += n
+                num_too_short += n_short
+
+    return num_reads, num_too_short
+
+
+def write_read_counts(path, num_reads, num_too_short):
+    """
+    Write the read counts as JSON (used to estimate the memory for counting).
+    """
+    with open(path, "wt") as fout:
+        json.dump({"num_reads": num_reads, "num_too_short": num_too_short}, fout)
+
+
+def cut_indrop_spacer(paths_in, path_out, read_structure, buffer_size=BUFFER_SIZE,
+                      threads=1, path_read_counts=None, path_qc_json=None,
+                      path_qc_html=None):
+    """
+    Trim gzipped FASTQs according to a read structure.
+
+    Multiple inputs (e.g. one per lane) are concatenated into a single output,
+    so there is no need to merge them first.
+
+    :param paths_in: path or list of paths to gzipped FASTQ
+    :param read_structure: ReadStructure, read structure string or preset name
+    :param path_read_counts: path to JSON file for the read counts (optional)
+    :param path_qc_json: path to JSON file for the read QC statistics (optional)
+    :param path_qc_html: path to HTML file for the read QC statistics (optional)
+    """
+    if isinstance(paths_in, str):
+        paths_in = [paths_in]
+
+    if not isinstance(read_structure, ReadStructure):
+        read_structure = ReadStructure(read_structure)
+
+    logger.info("Read structure: {}".format(read_structure.spec))
+
+    qc = ReadQC(read_structure) if path_qc_json or path_qc_html else None
+
+    if threads > 1:
+        num_reads, num_too_short = cut_indrop_spacer_parallel(
+            paths_in, path_out, read_structure, threads, qc=qc
+        )
     else:
-        raise Exception("Unsupported assay version!")
+        num_reads = 0
+        num_too_short = 0
+
+        with gzip.open(path_out, "wb", compresslevel=COMPRESS_LEVEL) as fout:
+            for path_in in paths_in:
+                with open_fastq_gz(path_in) as fin:
+                    for headers, seqs, quals in read_fastq(fin, buffer_size):
+                        chunk, n_short = trim_batch(
+                            headers, seqs, quals, read_structure, qc
+                        )
+                        fout.write(chunk)
+                        num_reads += len(headers)
+                        num_too_short += n_short
+
+    logger.info("Processed {} reads from {} files".format(num_reads, len(paths_in)))
+
+    if num_too_short > 0:
+        logger.warning(
+            "{} reads shorter than {}bp were truncated".format(
+                num_too_short, read_structure.length
+            )
+        )
+
+    if path_read_counts:
+        write_read_counts(path_read_counts, num_reads, num_too_short)
+
+    if path_qc_json:
+        qc.write_json(path_qc_json)
+
+    if path_qc_html:
+        qc.write_html(path_qc_html, title="Read QC: {}".format(path_out))
+
+    return num_reads
 
 
 def parse_arguments():
@@ -45,8 +307,9 @@ def parse_arguments():
     parser.add_argument(
         "--in",
         action="store",
-        dest="path_in",
-        help="path to gzipped input FASTQ",
+        dest="paths_in",
+        nargs="+",
+        help="path to gzipped input FASTQ (multiple files are concatenated)",
         required=True
     )
 
@@ -58,17 +321,62 @@ def parse_arguments():
         required=True
     )
 
+    parser.add_argument(
+        "--read-structure",
+        action="store",
+        dest="read_structure",
+        help="read structure (e.g. CB1:0-8,skip:8-12,CB2:12-20,UMI:20-28) "
+             "or preset ({})".format(", ".join(PRESETS)),
+        required=False
+    )
+
     parser.add_argument(
         "--assay-version",
         action="store",
         dest="assay_version",
-        help="InDrops assay version",
-        required=True
+        help="same as --read-structure with a preset (kept for compatibility)",
+        required=False
+    )
+
+    parser.add_argument(
+        "--threads",
+        action="store",
+        dest="threads",
+        type=int,
+        help="number of worker processes (output is a multi-member gzip if > 1)",
+        default=1
+    )
+
+    parser.add_argument(
+        "--read-counts",
+        action="store",
+        dest="path_read_counts",
+        help="path to output JSON with the number of reads",
+        required=False
+    )
+
+    parser.add_argument(
+        "--qc-json",
+        action="store",
+        dest="path_qc_json",
+        help="path to output JSON with read QC statistics (e.g. base composition)",
+        required=False
+    )
+
+    parser.add_argument(
+        "--qc-html",
+        action="store",
+        dest="path_qc_html",
+        help="path to output HTML with read QC statistics",
+        required=False
     )
 
     # parse arguments
     params = parser.parse_args()
 
+    if not params.read_structure and not params.assay_version:
+        parser.error("one of --read-structure or --assay-version is required")
+
     return params
 
 
@@ -79,8 +387,12 @@ if __name__ == "__main__":
     logger.info("Starting...")
 
     cut_indrop_spacer(
-        params.path_in, params.path_out,
-        params.assay_version
+        params.paths_in, params.path_out,
+        params.read_structure or params.assay_version,
+        threads=params.threads,
+        path_read_counts=params.path_read_counts,
+        path_qc_json=params.path_qc_json,
+        path_qc_html=params.path_qc_html
     )
 
     logger.info("DONE.")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import json
+import html
+
+import numpy as np
+
+from read_structure import SKIP
+
+BASES = "ACGTN"
+
+# byte value -> index in BASES (5 for anything else)
+_base_index = np.full(256, len(BASES), dtype=np.int32)
+for _i, _c in enumerate(BASES):
+    _base_index[ord(_c)] = _i
+    _base_index[ord(_c.lower())] = _i
+del _i, _c
+
+PHRED_OFFSET = 33
+
+
+def _grow(array, width):
+    """
+    Zero-pad the first axis of an array to `width`.
+    """
+    if array.shape[0] >= width:
+        return array
+    padding = np.zeros((width - array.shape[0],) + array.shape[1:], dtype=array.dtype)
+    return np.concatenate([array, padding])
+
+
+class ReadQC(object):
+    """
+    Read QC statistics accumulated while streaming (untrimmed) reads.
+
+    Tracks the total number of reads, the read length histogram, the per-position
+    base composition and mean quality, and the N rate of every named segment of
+    the read structure (e.g. CB, UMI).
+    """
+
+    def __init__(self, read_structure):
+        self.segments = [
+            (name, start, end)
+            for name, start, end in read_structure.segments
+            if name != SKIP
+        ]
+
+        self.num_reads = 0
+        self.length_counts = np.zeros(0, dtype=np.int64)
+        # position x (A, C, G, T, N, other)
+        self.base_counts = np.zeros((0, len(BASES) + 1), dtype=np.int64)
+        self.quality_sums = np.zeros(0, dtype=np.int64)
+        # segment x (N bases, reads with N)
+        self.segment_n_counts = np.zeros((len(self.segments), 2), dtype=np.int64)
+
+    def update(self, seqs, quals):
+        """
+        Add a batch of reads.
+
+        :param seqs: list of bytes
+        :param quals: list of bytes
+        """
+        if len(seqs) == 0:
+            return
+
+        lengths = np.fromiter(map(len, seqs), dtype=np.int64, count=len(seqs))
+        seqs = np.array(seqs, dtype=np.bytes_)
+        quals = np.array(quals, dtype=np.bytes_)
+        width = max(seqs.dtype.itemsize, 1)
+        n = len(seqs)
+
+        mat_seq = seqs.view(np.uint8).reshape(n, seqs.dtype.itemsize)
+        mat_qual = quals.view(np.uint8).reshape(n, quals.dtype.itemsize)
+
+        self.num_reads += n
+
+        self.length_counts = _grow(self.length_counts, width + 1)
+        self.length_counts += np.bincount(lengths, minlength=len(self.length_counts))
+
+        # padding is dropped by only counting positions within the read
+        covered = np.arange(mat_seq.shape[1]) < lengths[:, None]
+        codes = _base_index[mat_seq] + (len(BASES) + 1) * np.arange(mat_seq.shape[1])
+        base_counts = np.bincount(
+            codes[covered], minlength=mat_seq.shape[1] * (len(BASES) + 1)
+        ).reshape(mat_seq.shape[1], len(BASES) + 1)
+        self.base_counts = _grow(self.base_counts, width)
+        self.base_counts[: mat_seq.shape[1]] += base_counts
+
+        quality = mat_qual.astype(np.int64) - PHRED_OFFSET
+        quality[mat_qual == 0] = 0
+        self.quality_sums = _grow(self.quality_sums, width)
+        self.quality_sums[: mat_qual.shape[1]] += quality.sum(axis=0)
+
+        is_n = (mat_seq == ord("N")) | (mat_seq == ord("n"))
+        for i, (name, start, end) in enumerate(self.segments):
+            n_bases = is_n[:, start:end].sum(axis=1)
+            self.segment_n_counts[i, 0] += n_bases.sum()
+            self.segment_n_counts[i, 1] += np.count_nonzero(n_bases)
+
+    def merge(self, other):
+        """
+        Add the statistics of another ReadQC (e.g. from a worker process).
+        """
+        width = max(len(self.quality_sums), len(other.quality_sums))
+
+        self.num_reads += other.num_reads
+        self.length_counts = _grow(self.length_counts, width + 1)
+        self.length_counts[: len(other.length_counts)] += other.length_counts
+        self.base_counts = _grow(self.base_counts, width)
+        self.base_counts[: len(other.base_counts)] += other.base_counts
+        self.quality_sums = _grow(self.quality_sums, width)
+        self.quality_sums[: len(other.quality_sums)] += other.quality_sums
+        self.segment_n_counts += other.segment_n_counts
+
+        return self
+
+    def to_dict(self):
+        """
+        Summarize the statistics as a JSON-serializable dict.
+        """
+        # number of reads covering each position
+        width = len(self.quality_sums)
+        coverage = self.num_reads - np.cumsum(self.length_counts)[:width]
+        safe_coverage = np.maximum(coverage, 1)
+
+        segments = {}
+        for (name, start, end), (n_bases, n_reads) in zip(
+            self.segments, self.segment_n_counts
+        ):
+            segments[name] = {
+                "start": start,
+                "end": end,
+                "n_base_rate": float(n_bases) / max(self.num_reads * (end - start), 1),
+                "reads_with_n_rate": float(n_reads) / max(self.num_reads, 1),
+            }
+
+        lengths = np.flatnonzero(self.length_counts)
+
+        return {
+            "total_reads": int(self.num_reads),
+            "read_length_histogram": {
+                int(length): int(self.length_counts[length]) for length in lengths
+            },
+            "per_position_base_composition": {
+                base: (self.base_counts[:, i] / safe_coverage).round(4).tolist()
+                for i, base in enumerate(BASES)
+            },
+            "per_position_mean_quality": (self.quality_sums / safe_coverage)
+            .round(2)
+            .tolist(),
+            "segment_n_rate": segments,
+        }
+
+    def write_json(self, path):
+        with open(path, "wt") as fout:
+            json.dump(self.to_dict(), fout, indent=2)
+
+    def write_html(self, path, title="Read QC"):
+        """
+        Write the statistics as a small self-contained HTML page.
+        """
+        stats = self.to_dict()
+
+        def table(header, rows):
+            return "<table>\n<tr>{}</tr>\n{}\n</table>".format(
+                "".join("<th>{}</th>".format(html.escape(str(h))) for h in header),
+                "\n".join(
+                    "<tr>{}</tr>".format(
+                        "".join("<td>{}</td>".format(html.escape(str(c))) for c in row)
+                    )
+                    for row in rows
+                ),
+            )
+
+        composition = stats["per_position_base_composition"]
+        mean_quality = stats["per_position_mean_quality"]
+
+        sections = [
+            "<h2>Summary</h2>",
+            table(["Total reads"], [[stats["total_reads"]]]),
+            "<h2>N rate per segment</h2>",
+            table(
+                ["Segment", "Positions", "N bases", "Reads with N"],
+                [
+                    [
+                        name,
+                        "{}-{}".format(segment["start"], segment["end"]),
+                        "{:.4%}".format(segment["n_base_rate"]),
+                        "{:.4%}".format(segment["reads_with_n_rate"]),
+                    ]
+                    for name, segment in stats["segment_n_rate"].items()
+                ],
+            ),
+            "<h2>Read length</h2>",
+            table(
+                ["Length", "Reads"],
+                sorted(stats["read_length_histogram"].items()),
+            ),
+            "<h2>Per-position base composition and mean quality</h2>",
+            table(
+                ["Position"] + list(BASES) + ["Mean quality"],
+                [
+                    [pos]
+                    + ["{:.2%}".format(composition[base][pos]) for base in BASES]
+                    + [mean_quality[pos]]
+                    for pos in range(len(mean_quality))
+                ],
+            ),
+        ]
+
+        with open(path, "wt") as fout:
+            fout.write(
+                '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n'
+                "<title>{title}</title>\n<style>\n"
+                "body {{ font-family: sans-serif; }}\n"
+                "table {{ border-collapse: collapse; }}\n"
+                "th, td {{ border: 1px solid #ccc; padding: 2px 8px; "
+                "text-align: right; }}\n"
+                "</style>\n</head>\n<body>\n<h1>{title}</h1>\n{body}\n"
+                "</body>\n</html>\n".format(
+                    title=html.escape(title), body="\n".join(sections)
+                )
+            )
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import re
+
+import numpy as np
+
+# built-in read structures of the barcode read (R1)
+PRESETS = {
+    # CB1 is on the index read (I7)
+    "in_drop_v3": "CB2:0-8,UMI:8-14",
+    "in_drop_v4": "CB1:0-8,skip:8-12,CB2:12-20,UMI:20-28",
+    "10x_v2": "CB:0-16,UMI:16-26",
+    "10x_v3": "CB:0-16,UMI:16-28",
+    "10x_v4": "CB:0-16,UMI:16-28",
+    # R1 generated by asap_to_kite
+    "asap_seq": "CB:0-16,UMI:16-26",
+}
+
+UNSUPPORTED = {
+    "in_drop_v2": (
+        "inDrop v2 has a variable-length CB1 (8-11bp) followed by the W1 adapter, "
+        "which cannot be described with fixed positions"
+    ),
+}
+
+SKIP = "skip"
+
+_segment_pattern = re.compile(r"^(\w+):(\d+)-(\d+)$")
+
+
+class ReadStructure(object):
+    """
+    Fixed-position layout of a read, e.g. `CB1:0-8,skip:8-12,CB2:12-20,UMI:20-28`.
+
+    Each segment is `name:start-end` (0-based, end exclusive) and segments must
+    be listed in read order without overlapping. Trimming keeps every segment
+    not named `skip` concatenated in order; gaps between segments are dropped.
+    """
+
+    def __init__(self, spec: str):
+        """
+        :param str spec: read structure or the name of a preset (e.g. `in_drop_v4`)
+        """
+        if spec in UNSUPPORTED:
+            raise ValueError("{}: {}".format(spec, UNSUPPORTED[spec]))
+
+        self.name = spec if spec in PRESETS else None
+        self.spec = PRESETS.get(spec, spec)
+        self.segments = ReadStructure.parse(self.spec)
+
+        # positions in the read that are kept
+        self.columns = np.concatenate(
+            [
+                np.arange(start, end)
+                for name, start, end in self.segments
+                if name != SKIP
+            ]
+        )
+
+    @staticmethod
+    def parse(spec: str):
+        """
+        Parse a read structure into a list of (name, start, end).
+        """
+        segments = []
+
+        for token in spec.replace(" ", "").split(","):
+            match = _segment_pattern.match(token)
+            if not match:
+                raise ValueError(
+                    "Invalid read structure segment '{}' "
+                    "(expected name:start-end)".format(token)
+                )
+            name, start, end = match.groups()
+            start, end = int(start), int(end)
+            if start >= end:
+                raise ValueError("Empty read structure segment '{}'".format(token))
+            if segments and start < segments[-1][2]:
+                raise ValueError(
+                    "Read structure segment '{}' overlaps or is out of order".format(
+                        token
+                    )
+                )
+            segments.append((name, start, end))
+
+        if all(name == SKIP for name, _, _ in segments):
+            raise ValueError("Read structure '{}' keeps nothing".format(spec))
+
+        return segments
+
+    @property
+    def length(self) -> int:
+        """
+        Minimum read length covering all segments.
+        """
+        return self.segments[-1][2]
+
+    @property
+    def output_length(self) -> int:
+        return len(self.columns)
+
+    def output_segments(self):
+        """
+        Return the kept segments as (name, start, end) in trimmed-read coordinates.
+        """
+        segments = []
+        pos = 0
+
+        for name, start, end in self.segments:
+            if name == SKIP:
+                continue
+            segments.append((name, pos, pos + end - start))
+            pos += end - start
+
+        return segments
+
+    def extract(self, reads):
+        """
+        Trim a batch of reads (sequences or qualities) in one pass.
+
+        Reads shorter than `length` are truncated to the positions they cover.
+
+        :param reads: list of bytes
+        :return: list of bytes
+        """
+        if len(reads) == 0:
+            return []
+
+        reads = np.array(reads, dtype=np.bytes_)
+        width = max(reads.dtype.itemsize, self.length)
+        reads = reads.astype("S{}".format(width))
+
+        mat = reads.view(np.uint8).reshape(len(reads), width)
+        trimmed = np.ascontiguousarray(mat[:, self.columns])
+
+        # shorter reads are padded with b"\x00" which is dropped by the view
+        return trimmed.view("S{}".format(self.output_length)).ravel().tolist()
+
+    def __repr__(self):
+        return "ReadStructure('{}')".format(self.spec)
@@ -0,0 +1,152 @@
+import io
+import gzip
+import json
+import random
+
+import pytest
+
+from cut_indrop_spacer import (
+    cut_indrop_spacer,
+    cut_indrop_spacer_parallel,
+    read_blocks,
+    read_fastq,
+)
+from read_structure import ReadStructure
+
+
+def write_fastq(path, num_reads, read_length=40, seed=0):
+    random.seed(seed)
+    with gzip.open(path, "wt") as fout:
+        for i in range(num_reads):
+            seq = "".join(random.choice("ACGTN") for _ in range(read_length))
+            qual = "".join(chr(random.randint(33, 74)) for _ in range(read_length))
+            fout.write("@read{} 1:N:0:ACGTACGT\n{}\n+\n{}\n".format(i, seq, qual))
+
+
+def cut_indrop_spacer_biopython(path_in, path_out):
+    """The original Biopython implementation"""
+    SeqIO = pytest.importorskip("Bio.SeqIO")
+
+    with gzip.open(path_in, "rt") as fin:
+        with gzip.open(path_out, "wt") as fout:
+            for record in SeqIO.parse(fin, "fastq"):
+                trimmed_rec = record[:8] + record[12:20] + record[20:28]
+                SeqIO.write(trimmed_rec, fout, "fastq")
+
+
+def read_gz(path):
+    with gzip.open(path, "rb") as fin:
+        return fin.read()
+
+
+@pytest.mark.parametrize("buffer_size", [100, 1024 * 1024])
+def test_identical_to_biopython(tmp_path, buffer_size):
+    """Test the output is byte-identical to the Biopython implementation"""
+    path_in = str(tmp_path / "R1.fastq.gz")
+    write_fastq(path_in, 1000)
+
+    cut_indrop_spacer_biopython(path_in, str(tmp_path / "expected.fastq.gz"))
+    cut_indrop_spacer(
+        path_in, str(tmp_path / "actual.fastq.gz"), "in_drop_v4", buffer_size
+    )
+
+    assert read_gz(tmp_path / "actual.fastq.gz") == read_gz(
+        tmp_path / "expected.fastq.gz"
+    )
+
+
+def test_read_fastq():
+    """Test records are split into headers, sequences and qualities"""
+    fin = io.BytesIO(
+        b"@r1\nAAAAAAAACCCCGGGGGGGGTTTTTTTTAA\n+\nIIIIIIII####IIIIIIIIIIIIIIII!!\n"
+    )
+
+    headers, seqs, quals = next(read_fastq(fin))
+
+    assert headers == [b"r1"]
+    assert seqs == [b"AAAAAAAACCCCGGGGGGGGTTTTTTTTAA"]
+    assert quals == [b"IIIIIIII####IIIIIIIIIIIIIIII!!"]
+
+
+def test_malformed(tmp_path):
+    path_in = str(tmp_path / "R1.fastq.gz")
+
+    with gzip.open(path_in, "wt") as fout:
+        fout.write("@r1\nACGT\n+\nIII\n")
+
+    with pytest.raises(ValueError):
+        cut_indrop_spacer(path_in, str(tmp_path / "out.fastq.gz"), "in_drop_v4")
+
+    with gzip.open(path_in, "wt") as fout:
+        fout.write("@r1\nACGT\n+\nIIII\n@r2\nACGT\n")
+
+    with pytest.raises(ValueError):
+        cut_indrop_spacer(path_in, str(tmp_path / "out.fastq.gz"), "in_drop_v4")
+
+
+@pytest.mark.parametrize("block_size", [1, 50, 1000])
+def test_read_blocks(tmp_path, block_size):
+    """Test blocks contain whole records and cover the entire input"""
+    path_in = str(tmp_path / "R1.fastq.gz")
+    write_fastq(path_in, 100)
+    data = read_gz(path_in)
+
+    blocks = list(read_blocks(io.BytesIO(data), block_size))
+
+    assert b"".join(blocks) == data
+    assert all(block.count(b"\n") % 4 == 0 for block in blocks)
+
+
+def test_parallel(tmp_path):
+    """Test the multi-member output matches the serial output in order"""
+    path_in = str(tmp_path / "R1.fastq.gz")
+    write_fastq(path_in, 5000)
+
+    cut_indrop_spacer(path_in, str(tmp_path / "serial.fastq.gz"), "in_drop_v4")
+    # small blocks so that there are more blocks than workers
+    num_reads = cut_indrop_spacer_parallel(
+        [path_in],
+        str(tmp_path / "parallel.fastq.gz"),
+        ReadStructure("in_drop_v4"),
+        3,
+        10000,
+    )
+
+    assert num_reads == (5000, 0)
+
+    assert read_gz(tmp_path / "parallel.fastq.gz") == read_gz(
+        tmp_path / "serial.fastq.gz"
+    )
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_multiple_lanes(tmp_path, threads):
+    """Test lanes are trimmed into one output in order and reads are counted"""
+    paths_in = []
+    for lane in range(3):
+        paths_in.append(str(tmp_path / "L00{}_R1.fastq.gz".format(lane)))
+        write_fastq(paths_in[-1], 100 * (lane + 1), seed=lane)
+
+    path_merged = str(tmp_path / "merged.fastq.gz")
+    with gzip.open(path_merged, "wb") as fout:
+        fout.write(b"".join(read_gz(path) for path in paths_in))
+
+    cut_indrop_spacer(path_merged, str(tmp_path / "expected.fastq.gz"), "in_drop_v4")
+    cut_indrop_spacer(
+        paths_in,
+        str(tmp_path / "actual.fastq.gz"),
+        "in_drop_v4",
+        threads=threads,
+        path_read_counts=str(tmp_path / "counts.json"),
+        path_qc_json=str(tmp_path / "qc.json"),
+    )
+
+    assert read_gz(tmp_path / "actual.fastq.gz") == read_gz(
+        tmp_path / "expected.fastq.gz"
+    )
+    with open(tmp_path / "counts.json") as fin:
+        assert json.load(fin) == {"num_reads": 600, "num_too_short": 0}
+    with open(tmp_path / "qc.json") as fin:
+        qc = json.load(fin)
+        assert qc["total_reads"] == 600
+        assert qc["read_length_histogram"] == {"40": 600}
@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+import pytest
+
+from read_qc import ReadQC
+from read_structure import ReadStructure
+
+
+@pytest.fixture
+def reads():
+    random.seed(0)
+    seqs, quals = [], []
+    for _ in range(500):
+        length = random.choice([20, 28, 30])
+        seqs.append(bytes(random.choice(b"ACGTN") for _ in range(length)))
+        quals.append(bytes(random.randint(35, 74) for _ in range(length)))
+    return seqs, quals
+
+
+def test_update(reads):
+    """Test the vectorized statistics against per-read loops"""
+    seqs, quals = reads
+    qc = ReadQC(ReadStructure("in_drop_v4"))
+    qc.update(seqs[:200], quals[:200])
+    qc.update(seqs[200:], quals[200:])
+
+    stats = qc.to_dict()
+
+    assert stats["total_reads"] == 500
+    assert stats["read_length_histogram"] == {
+        length: sum(len(s) == length for s in seqs) for length in [20, 28, 30]
+    }
+
+    for pos in [0, 19, 25, 29]:
+        covering = [i for i, s in enumerate(seqs) if len(s) > pos]
+        for base in "ACGTN":
+            expected = sum(seqs[i][pos] == ord(base) for i in covering) / len(covering)
+            assert stats["per_position_base_composition"][base][pos] == pytest.approx(
+                expected, abs=1e-4
+            )
+        expected = np.mean([quals[i][pos] - 33 for i in covering])
+        assert stats["per_position_mean_quality"][pos] == pytest.approx(
+            expected, abs=1e-2
+        )
+
+    umi = stats["segment_n_rate"]["UMI"]
+    assert set(stats["segment_n_rate"]) == {"CB1", "CB2", "UMI"}
+    assert umi["n_base_rate"] == pytest.approx(
+        sum(s[20:28].count(b"N") for s in seqs) / (500 * 8)
+    )
+    assert umi["reads_with_n_rate"] == pytest.approx(
+        sum(b"N" in s[20:28] for s in seqs) / 500
+    )
+
+
+def test_merge(reads):
+    """Test merging per-block statistics gives the same result as one pass"""
+    seqs, quals = reads
+    read_structure = ReadStructure("10x_v3")
+
+    qc = ReadQC(read_structure)
+    qc.update(seqs, quals)
+
+    # blocks with different maximum read lengths
+    order = sorted(range(len(seqs)), key=lambda i: len(seqs[i]))
+    merged = ReadQC(read_structure)
+    for block in [order[:100], order[100:]]:
+        block_qc = ReadQC(read_structure)
+        block_qc.update([seqs[i] for i in block], [quals[i] for i in block])
+        merged.merge(block_qc)
+
+    assert merged.to_dict() == qc.to_dict()
+
+
+def test_write(tmp_path, reads):
+    seqs, quals = reads
+    qc = ReadQC(ReadStructure("in_drop_v4"))
+    qc.update(seqs, quals)
+
+    qc.write_json(str(tmp_path / "qc.json"))
+    qc.write_html(str(tmp_path / "qc.html"))
+
+    assert "<td>500</td>" in (tmp_path / "qc.html").read_text()
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from read_structure import PRESETS, ReadStructure
+
+
+def test_parse():
+    read_structure = ReadStructure("CB1:0-8,skip:8-12,CB2:12-20,UMI:20-28")
+
+    assert read_structure.segments == [
+        ("CB1", 0, 8),
+        ("skip", 8, 12),
+        ("CB2", 12, 20),
+        ("UMI", 20, 28),
+    ]
+    assert read_structure.length == 28
+    assert read_structure.output_length == 24
+    assert read_structure.output_segments() == [
+        ("CB1", 0, 8),
+        ("CB2", 8, 16),
+        ("UMI", 16, 24),
+    ]
+
+
+@pytest.mark.parametrize("name", list(PRESETS))
+def test_presets(name):
+    read_structure = ReadStructure(name)
+
+    assert read_structure.name == name
+    assert read_structure.spec == PRESETS[name]
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        "CB:0-16,UMI:28",
+        "CB:8-0",
+        "CB:0-16,UMI:12-28",
+        "UMI:16-28,CB:0-16",
+        "skip:0-8",
+        "in_drop_v2",
+        "10x_v5",
+    ],
+)
+def test_invalid(spec):
+    with pytest.raises(ValueError):
+        ReadStructure(spec)
+
+
+def test_extract_matches_slicing():
+    """Test the vectorized extraction against slicing each read"""
+    random.seed(0)
+    reads = [
+        bytes(random.choice(b"ACGTN") for _ in range(random.randint(0, 40)))
+        for _ in range(1000)
+    ]
+    read_structure = ReadStructure("in_drop_v4")
+
+    assert read_structure.extract(reads) == [x[:8] + x[12:20] + x[20:28] for x in reads]
+    assert ReadStructure("TAG:0-15").extract(reads) == [x[:15] for x in reads]
+    assert read_structure.extract([]) == []
@@ -1,4 +1,5 @@
 #!/bin/bash -e
 
 source config.sh
+../sharp-utils/stage.sh
 docker build --platform linux/amd64 -t ${image_name}:${version} .
@@ -1,4 +1,4 @@
-version="0.3.9"
+version="0.13.2"
 
 # docker related
 registry="docker.io"
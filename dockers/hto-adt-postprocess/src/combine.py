@@ -1,11 +1,20 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import argparse
+import anndata as ad
+import h5py
+import numpy as np
 import pandas as pd
+import scipy.io
+import scipy.sparse
 import yaml
 import logging
-from dna3bit import DNA3Bit
+from barcode_index import BarcodeIndex, barcode_keys
+from classification_io import read_classification, write_classification_npz
+from count_matrix import narrow_counts, read_count_dir
+from gzip_writer import GzipWriter, to_csv_gz
 from translate_barcodes import translate_barcodes
 
 logger = logging.getLogger("combine")
@@ -19,42 +28,265 @@ logging.basicConfig(
 
 def convert(df, chemistry):
 
-    encoder_decoder = DNA3Bit()
+    # translate numeric barcodes without decoding them to nucleotides
+    df.index = translate_barcodes(df.index.values, chemistry=chemistry)
 
-    # 1234 barcodes to acgt barcodes
-    acgt_barcodes = df.index.map(lambda x: encoder_decoder.decode(x).decode())
+    return df
 
-    # translate
-    translated_acgt_barcodes = translate_barcodes(acgt_barcodes, chemistry=chemistry)
 
-    # acgt barcodes to 1234 barcodes
-    translated_1234_barcodes = translated_acgt_barcodes.map(
-        lambda x: encoder_decoder.encode(x)
+def read_dense_count_matrix(path_dense_count_matrix, chunk_size=None):
+    """
+    Read a dense cell-by-gene count matrix (e.g. SEQC *_dense.csv), all at once
+    or in blocks of `chunk_size` rows.
+    """
+    if not chunk_size:
+        yield pd.read_csv(path_dense_count_matrix, index_col=0)
+        return
+
+    yield from pd.read_csv(path_dense_count_matrix, index_col=0, chunksize=chunk_size)
+
+
+# count matrix formats
+DENSE = "dense"
+MTX = "mtx"
+H5AD = "h5ad"
+H5_10X = "10x-h5"
+
+
+def count_matrix_format(path_count_matrix):
+    """
+    Format of a count matrix: MTX directory, h5ad, Cell Ranger h5 or dense CSV.
+    """
+    if os.path.isdir(path_count_matrix):
+        return MTX
+    if path_count_matrix.endswith(".h5ad"):
+        return H5AD
+    if path_count_matrix.endswith(".h5"):
+        return H5_10X
+    return DENSE
+
+
+def read_10x_h5(path_h5):
+    """
+    Read a Cell Ranger (v3+) feature-barcode matrix, e.g.
+    filtered_feature_bc_matrix.h5.
+
+    :return: (CSR matrix barcodes x features, barcodes, features)
+    """
+    with h5py.File(path_h5, "r") as f:
+        group = f["matrix"]
+        # stored as CSC features x barcodes = CSR barcodes x features
+        num_features, num_barcodes = group["shape"][:]
+        # read the (int64) indices as int32 if possible, without an int64 copy
+        index_dtype = np.int32 if group["data"].shape[0] < 2**31 else np.int64
+        matrix = scipy.sparse.csr_matrix(
+            (
+                group["data"][:],
+                group["indices"].astype(index_dtype)[:],
+                group["indptr"].astype(index_dtype)[:],
+            ),
+            shape=(num_barcodes, num_features),
+        )
+        barcodes = group["barcodes"][:].astype(str).astype(object)
+        features = pd.DataFrame(
+            {"feature_name": group["features/name"][:].astype(str)},
+            index=group["features/id"][:].astype(str),
+        )
+
+    return matrix, barcodes, features
+
+
+def read_sparse_count_matrix(path_count_matrix, input_format, chunk_size=None):
+    """
+    Read a count matrix of any format as a sparse matrix.
+
+    :return: (CSR matrix barcodes x features, barcodes, features as DataFrame)
+    """
+    if input_format == MTX:
+        matrix, barcodes, features = read_count_dir(path_count_matrix)
+        features = pd.DataFrame(index=pd.Index(features))
+    elif input_format == H5AD:
+        adata = ad.read_h5ad(path_count_matrix)
+        matrix = scipy.sparse.csr_matrix(adata.X)
+        barcodes = adata.obs_names.values
+        features = adata.var
+    elif input_format == H5_10X:
+        matrix, barcodes, features = read_10x_h5(path_count_matrix)
+    else:
+        blocks = []
+        barcodes = []
+        for df_gene in read_dense_count_matrix(path_count_matrix, chunk_size):
+            blocks.append(scipy.sparse.csr_matrix(df_gene.values))
+            barcodes.append(df_gene.index.values)
+        matrix = scipy.sparse.vstack(blocks, format="csr")
+        barcodes = np.concatenate(barcodes)
+        features = pd.DataFrame(index=df_gene.columns)
+
+    # narrow the counts in place (the indices are not copied)
+    matrix.data = narrow_counts(matrix.data)
+
+    return matrix, barcodes, features
+
+
+def gex_barcode_keys(barcodes):
+    """
+    Numerical barcodes of numerical or nucleotide GEX barcodes, dropping a Cell
+    Ranger `-1` suffix.
+    """
+    barcodes = pd.Index(barcodes)
+    if barcodes.dtype == object:
+        barcodes = barcodes.str.replace(r"-\d+$", "", regex=True)
+    return barcode_keys(barcodes.values)
+
+
+def write_count_dir(adata, path_dir):
+    """
+    Write a hashed count matrix as a Cell Ranger-like MTX directory (features x
+    barcodes) along with the classification of every barcode.
+    """
+    os.makedirs(path_dir, exist_ok=True)
+
+    with GzipWriter(os.path.join(path_dir, "matrix.mtx.gz")) as fout:
+        scipy.io.mmwrite(fout, adata.X.T.tocoo())
+
+    to_csv_gz(
+        pd.Series(adata.obs_names),
+        os.path.join(path_dir, "barcodes.tsv.gz"),
+        sep="\t",
+        header=False,
+        index=False,
+    )
+    to_csv_gz(
+        adata.var, os.path.join(path_dir, "features.tsv.gz"), sep="\t", header=False
     )
+    to_csv_gz(adata.obs, os.path.join(path_dir, "classification.tsv.gz"), sep="\t")
 
-    df.index = translated_1234_barcodes
 
-    return df
+def combine_sparse(path_count_matrix, index, df_class, output_format, chunk_size=None):
+    """
+    Join a count matrix with the hashtag classification on the cell barcodes
+    and write it as a sparse final-matrix.h5ad or final-matrix/ MTX directory
+    with `hashID` in `obs`.
+
+    :return: classification of the barcodes in the count matrix
+    """
+    input_format = count_matrix_format(path_count_matrix)
+
+    matrix, barcodes, features = read_sparse_count_matrix(
+        path_count_matrix, input_format, chunk_size
+    )
+
+    logger.info(
+        "Loaded {} count matrix ({} x {})".format(
+            input_format, matrix.shape[0], matrix.shape[1]
+        )
+    )
+
+    # inner join on the cell barcodes, keeping the order of the count matrix
+    keys = gex_barcode_keys(barcodes)
+    if keys.dtype != np.uint64:
+        raise ValueError("Count matrix has invalid cell barcodes")
+
+    gene_pos, class_pos = index.join(keys)
+
+    obs = pd.DataFrame(
+        {column: df_class[column].values[class_pos] for column in df_class.columns},
+        index=pd.Index(np.asarray(barcodes[gene_pos]).astype(str)),
+    )
+
+    # only copy the count matrix if rows are dropped, and free the full one
+    if not np.array_equal(gene_pos, np.arange(matrix.shape[0])):
+        matrix = matrix[gene_pos]
+    adata = ad.AnnData(X=matrix, obs=obs, var=features)
+    del matrix
+
+    logger.info(
+        "Merged transcript count matrix with hashtag ({} x {})".format(
+            adata.n_obs, adata.n_vars
+        )
+    )
+
+    if output_format == H5AD:
+        adata.write("final-matrix.h5ad", compression="gzip")
+    else:
+        write_count_dir(adata, "final-matrix")
+
+    return pd.DataFrame(
+        {"hashID": obs.hashID.values},
+        index=pd.Index(keys[gene_pos].astype(np.int64), name=df_class.index.name),
+    )
+
+
+def combine_dense(path_dense_count_matrix, index, df_class, chunk_size=None):
+    """
+    Join a dense count matrix with the hashtag classification on the cell
+    barcodes and write it as final-matrix.tsv.gz, one block of rows at a time.
+
+    :return: classification of the barcodes in the count matrix
+    """
+    logger.info("Writing the full dense count matrix with hashtag...")
+
+    classes = []
+    num_genes = 0
+
+    # blocks are compressed in the background while the next one is read
+    with GzipWriter("final-matrix.tsv.gz") as fout:
+        for block, df_gene in enumerate(
+            read_dense_count_matrix(path_dense_count_matrix, chunk_size)
+        ):
+            num_genes = df_gene.shape[1]
+
+            # inner join on the cell barcodes, keeping the order of the count matrix
+            gene_pos, class_pos = index.join(df_gene.index)
+            df_merged = df_gene.iloc[gene_pos].copy()
+            for column in df_class.columns:
+                df_merged[column] = df_class[column].values[class_pos]
+
+            df_merged.to_csv(fout, sep="\t", header=block == 0)
+
+            classes.append(df_merged[["hashID"]])
+
+            logger.info(
+                "Merged {} of {} barcodes in block {}".format(
+                    len(df_merged), len(df_gene), block
+                )
+            )
+
+    num_columns = num_genes + df_class.shape[1]
+    df_class = pd.concat(classes)
+
+    logger.info(
+        "Merged transcript count matrix with hashtag ({} x {})".format(
+            len(df_class), num_columns
+        )
+    )
+
+    return df_class
 
 
 def combine(
-    path_dense_count_matrix,
+    path_count_matrix,
     path_hto_classification,
     translate_10x_barcodes,
     chemistry,
+    npz=False,
+    chunk_size=None,
+    output_format=None,
 ):
 
-    df_gene = pd.read_csv(path_dense_count_matrix, index_col=0)
+    input_format = count_matrix_format(path_count_matrix)
 
-    logger.info(
-        "Loaded transcript count matrix ({} x {})".format(
-            df_gene.shape[0], df_gene.shape[1]
+    # dense in, dense out; sparse in, h5ad out unless asked otherwise
+    if not output_format:
+        output_format = DENSE if input_format == DENSE else H5AD
+
+    if output_format == DENSE and input_format != DENSE:
+        raise ValueError(
+            "Cannot write a {} count matrix as a dense matrix".format(input_format)
         )
-    )
 
-    df_class = pd.read_csv(
-        path_hto_classification, sep="\t", index_col=0, compression="gzip"
-    )
+    # classification.tsv.gz or classification.npz
+    df_class = read_classification(path_hto_classification)
 
     logger.info(
         "Loaded HTO classification ({} x {})".format(
@@ -69,26 +301,21 @@ def combine(
         logger.info("Translating TotalSeq-B/C HTO barcodes to GEX barcodes...")
         df_class = convert(df_class, chemistry)
 
-    df_merged = pd.merge(
-        df_gene, df_class, left_index=True, right_index=True, how="inner"
-    )
+    index = BarcodeIndex(df_class.index)
 
-    logger.info(
-        "Merged transcript count matrix with hashtag ({} x {})".format(
-            df_merged.shape[0], df_merged.shape[1]
+    if output_format == DENSE:
+        df_class = combine_dense(path_count_matrix, index, df_class, chunk_size)
+    else:
+        df_class = combine_sparse(
+            path_count_matrix, index, df_class, output_format, chunk_size
         )
-    )
 
-    logger.debug(df_merged.groupby(by="hashID").size())
-
-    logger.info("Writing the full dense count matrix with hashtag...")
-
-    df_merged.to_csv("final-matrix.tsv.gz", sep="\t", compression="gzip")
+    logger.debug(df_class.groupby(by="hashID").size())
 
-    # the last column has the hashID
-    df_class = df_merged.iloc[:, -1].to_frame()
+    to_csv_gz(df_class, "final-classification.tsv.gz", sep="\t")
 
-    df_class.to_csv("final-classification.tsv.gz", sep="\t", compression="gzip")
+    if npz:
+        write_classification_npz("final-classification.npz", df_class)
 
     return df_class
 
@@ -107,10 +334,11 @@ def parse_arguments():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
+        "--count-matrix",
         "--dense-count-matrix",
         action="store",
-        dest="path_dense_count_matrix",
-        help="path to scRNA-seq dnese cell-by-gene count matrix file (*.csv)",
+        dest="path_count_matrix",
+        help="path to scRNA-seq count matrix: dense cell-by-gene *.csv, Cell Ranger *.h5, *.h5ad or MTX directory",
         required=True,
     )
 
@@ -118,7 +346,7 @@ def parse_arguments():
         "--hto-classification",
         action="store",
         dest="path_hto_classification",
-        help="path to HTO classification file (*.tsv.gz)",
+        help="path to HTO classification file (*.tsv.gz or *.npz)",
         required=True,
     )
 
@@ -138,6 +366,32 @@ def parse_arguments():
         required=True,
     )
 
+    parser.add_argument(
+        "--npz",
+        action="store_true",
+        dest="npz",
+        help="also write the classification as final-classification.npz",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        action="store",
+        dest="chunk_size",
+        type=int,
+        help="number of rows of the count matrix read at a time (default: all)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--output-format",
+        action="store",
+        dest="output_format",
+        help="format of the hashed count matrix (default: dense for a dense count matrix, h5ad otherwise)",
+        choices=[DENSE, H5AD, MTX],
+        default=None,
+    )
+
     # parse arguments
     params = parser.parse_args()
 
@@ -151,10 +405,13 @@ if __name__ == "__main__":
     logger.info("Starting...")
 
     df_class = combine(
-        path_dense_count_matrix=params.path_dense_count_matrix,
+        path_count_matrix=params.path_count_matrix,
         path_hto_classification=params.path_hto_classification,
         translate_10x_barcodes=params.translate_10x_barcodes,
         chemistry=params.chemistry,
+        npz=params.npz,
+        chunk_size=params.chunk_size,
+        output_format=params.output_format,
     )
 
     logger.info("Writing statistics...")
@@ -7,6 +7,8 @@ from sklearn.linear_model import LinearRegression
 import anndata as ad
 import pandas as pd
 
+from barcode_index import BarcodeIndex
+
 
 def remove_batch_effect(x, covariates=None, design=None):
     """
@@ -85,15 +87,11 @@ def dsb_adapted(
         cell_protein_matrix = cell_protein_matrix.toarray()
 
     # Identify barcodes that are in adata_raw but not in adata_filtered
-    # Convert to sets
-    raw_barcodes = set(adata_raw.obs_names)
-    filtered_barcodes = set(adata_filtered.obs_names)
-
-    # Find the difference
-    empty_barcodes = list(raw_barcodes - filtered_barcodes)
+    is_empty = ~BarcodeIndex(adata_filtered.obs_names).isin(adata_raw.obs_names)
+    empty_barcodes = adata_raw.obs_names[is_empty]
 
     # Get the empty droplets from adata_raw
-    empty_drop_matrix = adata_raw[empty_barcodes, :].X  # .T
+    empty_drop_matrix = adata_raw[is_empty, :].X  # .T
     if scipy.sparse.issparse(empty_drop_matrix):
         empty_drop_matrix = empty_drop_matrix.toarray()
 
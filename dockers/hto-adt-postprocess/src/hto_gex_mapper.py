@@ -2,17 +2,40 @@ import os
 import json
 
 
-def decide_which_whitelist(chemistry):
+def data_path(base_path: str = None) -> str:
+    """
+    Directory of the whitelists. By default it is found relative to this
+    module, so it does not depend on the working directory: `/opt/data` in
+    the docker image (the scripts are in `/opt`), `../data` in the repository.
+
+    Argument `base_path` overrides it with `<base_path>/data`.
+    """
+    if base_path is not None:
+        return os.path.join(base_path, "data")
+
+    src = os.path.dirname(os.path.abspath(__file__))
+    for path in [os.path.join(src, "data"), os.path.join(src, os.pardir, "data")]:
+        if os.path.exists(os.path.join(path, "whitelists.json")):
+            return os.path.normpath(path)
+
+    raise FileNotFoundError("No whitelists.json next to {}".format(src))
+
+
+def decide_which_whitelist(chemistry, base_path: str = None):
     """
     Based on 10x information, decide which whitelist to use. (https://kb.10xgenomics.com/hc/en-us/articles/115004506263-What-is-a-barcode-whitelist-)
     Chemistries are defined in the emulsion sheet.
     Not all whitelists are supported yet.
+
+    :return: path of the whitelist
     """
-    with open("./data/whitelists.json") as fin:
+    path = data_path(base_path)
+
+    with open(os.path.join(path, "whitelists.json")) as fin:
         whitelists = json.load(fin)
 
     for file, chemistries in whitelists.items():
         if chemistry in chemistries:
-            return os.path.join("./data", file)
+            return os.path.join(path, file)
     else:
         raise ValueError("Chemistry {} not supported yet.".format(chemistry))
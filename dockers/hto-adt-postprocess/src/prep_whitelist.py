@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+import sys
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from dna3bit import DNA3Bit
+from barcode_index import barcode_keys
+from translation_index import translate_keys
+
+logger = logging.getLogger("prep_whitelist")
+
+# number of lines read (and barcodes decoded) at a time
+CHUNK_SIZE = 1_000_000
+
+# format = (column with the barcodes, header, separator)
+FORMATS = {
+    # SEQC *_sparse_counts_barcodes.csv: index, numerical barcode
+    "SeqcSparseCountsBarcodesCsv": (1, False, ","),
+    # SEQC *_dense.csv: numerical barcode, gene counts...
+    "SeqcDenseCountsMatrixCsv": (0, True, ","),
+    # Cell Ranger barcodes.tsv.gz (e.g. AAACCCAAGAAACACT-1)
+    "10x": (0, False, "\t"),
+    # one barcode per line
+    "custom": (0, False, "\t"),
+}
+
+
+def read_barcode_keys(
+    path_input: str,
+    column: int = 0,
+    has_header: bool = False,
+    separator: str = ",",
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    Stream one column of a (gzipped) CSV/TSV and yield its cell barcodes as
+    numerical (DNA3Bit) barcodes, one chunk of lines at a time. Nucleotide
+    barcodes are encoded (dropping a Cell Ranger `-1` suffix), numerical
+    barcodes are kept.
+    """
+    reader = pd.read_csv(
+        path_input,
+        sep=separator,
+        header=0 if has_header else None,
+        usecols=[column],
+        dtype=str,
+        chunksize=chunk_size,
+    )
+
+    for chunk in reader:
+        barcodes = chunk.iloc[:, 0].str.replace(r"-\d+$", "", regex=True).values
+        keys = barcode_keys(barcodes)
+
+        if keys.dtype != np.uint64:
+            raise ValueError(
+                "Column {} of {} has invalid cell barcodes".format(column, path_input)
+            )
+
+        yield keys
+
+
+def load_barcode_keys(
+    path_input: str, column: int = 0, has_header: bool = False, separator: str = ","
+) -> np.ndarray:
+    """
+    Read all cell barcodes of one column as numerical barcodes (see
+    `read_barcode_keys`).
+    """
+    return np.concatenate(
+        [np.empty(0, dtype=np.uint64)]
+        + list(read_barcode_keys(path_input, column, has_header, separator))
+    )
+
+
+def write_barcodes(keys: np.ndarray, path_acgt: str, path_1234: str):
+    """
+    Write the nucleotide and numerical barcodes (one per line), decoding one
+    chunk at a time.
+    """
+    with open(path_acgt, "wt") as fout_acgt, open(path_1234, "wt") as fout_1234:
+        for start in range(0, len(keys), CHUNK_SIZE):
+            chunk = keys[start : start + CHUNK_SIZE]
+            fout_acgt.write("\n".join(DNA3Bit.decode_array(chunk)) + "\n")
+            fout_1234.write("\n".join(chunk.astype(str)) + "\n")
+
+
+def prep_whitelist(
+    path_input: str,
+    input_format: str,
+    chemistry: str = None,
+    path_acgt: str = "cb-whitelist.txt",
+    path_1234: str = "cb-whitelist.1234.txt",
+):
+    """
+    Prepare a cell barcode whitelist for CITE-seq-Count from SEQC, Cell Ranger
+    or custom barcodes, optionally translating TotalSeq-B/C barcodes with the
+    whitelist of the given chemistry.
+
+    :return: numerical barcodes of the whitelist
+    """
+    if input_format not in FORMATS:
+        raise ValueError("Unknown whitelist format {}".format(input_format))
+
+    column, has_header, separator = FORMATS[input_format]
+
+    keys = load_barcode_keys(path_input, column, has_header, separator)
+
+    logger.info("Loaded {} barcodes".format(len(keys)))
+
+    if input_format == "SeqcDenseCountsMatrixCsv":
+        # sorted by nucleotide sequence
+        keys = keys[np.argsort(DNA3Bit.decode_array(keys), kind="stable")]
+
+    if chemistry:
+        # unique barcodes in the order they first appear
+        _, first = np.unique(keys, return_index=True)
+        keys = keys[np.sort(first)]
+
+        logger.info("Translating {} TotalSeq-B/C barcodes...".format(len(keys)))
+        keys = translate_keys(keys, chemistry)
+
+    write_barcodes(keys, path_acgt, path_1234)
+
+    return keys
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--input",
+        action="store",
+        dest="path_input",
+        help="path to SEQC/Cell Ranger output or custom barcode file (csv, tsv or gzipped)",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--format",
+        action="store",
+        dest="input_format",
+        help="input format",
+        choices=list(FORMATS.keys()),
+        required=True,
+    )
+
+    parser.add_argument(
+        "--chemistry",
+        action="store",
+        dest="chemistry",
+        help="translate TotalSeq-B/C barcodes with the whitelist of this chemistry (e.g. 10x V3.1)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--output-acgt",
+        action="store",
+        dest="path_acgt",
+        help="path to the nucleotide whitelist",
+        default="cb-whitelist.txt",
+    )
+
+    parser.add_argument(
+        "--output-1234",
+        action="store",
+        dest="path_1234",
+        help="path to the numerical whitelist",
+        default="cb-whitelist.1234.txt",
+    )
+
+    # parse arguments
+    params = parser.parse_args()
+
+    return params
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler("prep_whitelist.log"),
+            logging.StreamHandler(sys.stdout),
+        ],
+    )
+
+    params = parse_arguments()
+
+    logger.info("Starting...")
+
+    prep_whitelist(
+        path_input=params.path_input,
+        input_format=params.input_format,
+        chemistry=params.chemistry,
+        path_acgt=params.path_acgt,
+        path_1234=params.path_1234,
+    )
+
+    logger.info("DONE.")
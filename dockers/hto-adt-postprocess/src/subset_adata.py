@@ -5,9 +5,11 @@ import sys
 import argparse
 import logging
 import anndata as ad
+import numpy as np
 import pandas as pd
 
 from dna3bit import DNA3Bit
+from barcode_index import BarcodeIndex
 
 numba_logger = logging.getLogger("numba")
 numba_logger.setLevel(logging.WARNING)
@@ -41,7 +43,7 @@ def convert_barcodes(x):
     Convert a cell barcode to DNA3Bit if all letters are numeric.
     """
     encoder_decoder = DNA3Bit()
-    x = map(lambda i: encoder_decoder.decode(int(i)).decode(), x)
+    x = encoder_decoder.decode_array(np.asarray(x, dtype=np.uint64))
     return list(x)
 
 
@@ -70,10 +72,12 @@ def subset_adata(
     assert_cellbarcodes(cb_whitelist)
 
     logger.info("Subsetting AnnData...")
-    cb_whitelist_clean = list(set(cb_whitelist).intersection(set(adata.obs_names)))
-    adata = adata[cb_whitelist_clean]
+    # keep the cells in the order of the AnnData object
+    keep = BarcodeIndex(cb_whitelist).isin(adata.obs_names)
+    found = BarcodeIndex(adata.obs_names).isin(cb_whitelist)
+    adata = adata[keep]
 
-    difference = set(cb_whitelist) - set(cb_whitelist_clean)
+    difference = cb_whitelist[~found]
     if len(difference) > 0:
         logger.warning(
             f"Cell barcodes ({len(difference)}) are not in the AnnData object:  {' '.join(difference)}. Ignoring them."
@@ -2,15 +2,16 @@
 # coding: utf-8
 
 import sys
-import os
 import argparse
 import logging
 
 import anndata as ad
+import numpy as np
 import pandas as pd
-import scipy.io
+import scipy.sparse
 
-from dna3bit import DNA3Bit
+from barcode_index import BarcodeIndex, barcode_keys
+from count_matrix import narrow_counts, read_count_dir
 
 numba_logger = logging.getLogger("numba")
 numba_logger.setLevel(logging.WARNING)
@@ -27,7 +28,50 @@ logging.basicConfig(
 )
 
 
-def to_adata(sample_name, path_tag_list, path_umi_counts):
+def align_counts(matrix, keys, features, to_keys, to_features):
+    """
+    Reorder a barcodes x features count matrix to the given barcodes and
+    features, with zero counts for the ones missing from the matrix.
+
+    :param keys: numeric barcodes of the matrix rows
+    :param to_keys: numeric barcodes of the rows to return
+    """
+    rows = BarcodeIndex(keys).get_indexer(to_keys)
+    cols = pd.Index(features).get_indexer(to_features)
+
+    if np.array_equal(rows, np.arange(len(keys))) and np.array_equal(
+        cols, np.arange(len(features))
+    ):
+        return matrix
+
+    # sparse selection matrices (missing barcodes/features select nothing)
+    found_rows = np.flatnonzero(rows >= 0)
+    select_rows = scipy.sparse.csr_matrix(
+        (np.ones(len(found_rows), dtype=matrix.dtype), (found_rows, rows[found_rows])),
+        shape=(len(to_keys), matrix.shape[0]),
+    )
+    found_cols = np.flatnonzero(cols >= 0)
+    select_cols = scipy.sparse.csr_matrix(
+        (np.ones(len(found_cols), dtype=matrix.dtype), (cols[found_cols], found_cols)),
+        shape=(matrix.shape[1], len(to_features)),
+    )
+
+    return (select_rows @ matrix @ select_cols).tocsr()
+
+
+def ratio(numerator, denominator):
+    """
+    Element-wise ratio, zero where the denominator is zero.
+    """
+    return np.divide(
+        numerator,
+        denominator,
+        out=np.zeros(len(numerator), dtype=np.float64),
+        where=denominator > 0,
+    )
+
+
+def to_adata(sample_name, path_tag_list, path_umi_counts, path_read_counts=None):
 
     logger.info("Loading tag list...")
     df_tags = pd.read_csv(
@@ -37,42 +81,67 @@ def to_adata(sample_name, path_tag_list, path_umi_counts):
     df_tags.index = (df_tags.id + "-" + df_tags.seq).values
 
     logger.info("Loading counts matrix...")
-    mtx_umi = scipy.io.mmread(os.path.join(path_umi_counts, "matrix.mtx.gz"))
+    # barcodes x features
+    mtx_umi, barcodes, features = read_count_dir(path_umi_counts)
 
-    barcodes = pd.read_csv(
-        os.path.join(path_umi_counts, "barcodes.tsv.gz"), header=None, index_col=0
-    )
-    barcodes.index.name = "cell_barcodes"
+    # smallest unsigned dtype that holds the counts (uint16 or uint32)
+    mtx_umi = narrow_counts(mtx_umi)
 
-    features = pd.read_csv(
-        os.path.join(path_umi_counts, "features.tsv.gz"), header=None, index_col=0
-    )
-    features.index.name = None
+    # numerical barcodes, shared by the UMI and read count matrices
+    keys = barcode_keys(barcodes)
 
     logger.info("Generating AnnData...")
     # convert to AnnData
     # exclude `unmapped` column
     adata = ad.AnnData(
-        mtx_umi.T.tocsr()[:, :-1], dtype="int64", obs=barcodes, var=features.iloc[:-1]
+        mtx_umi[:, :-1],
+        obs=pd.DataFrame(index=pd.Index(barcodes, name="cell_barcodes")),
+        var=pd.DataFrame(index=pd.Index(features[:-1])),
     )
 
-    # add unmapped to obs
-    adata.obs["unmapped"] = mtx_umi.T.toarray()[:, -1]
+    # add unmapped to obs (only the last column is densified)
+    adata.obs["unmapped"] = mtx_umi[:, -1].toarray().ravel()
+
+    if path_read_counts:
+        logger.info("Loading read counts matrix...")
+        # barcodes x features, aligned to the UMI count matrix
+        mtx_reads, read_barcodes, read_features = read_count_dir(path_read_counts)
+        mtx_reads = align_counts(
+            narrow_counts(mtx_reads),
+            barcode_keys(read_barcodes),
+            read_features,
+            keys,
+            features,
+        )
+
+        # exclude `unmapped` column
+        adata.layers["read_counts"] = mtx_reads[:, :-1]
+        adata.obs["unmapped_reads"] = mtx_reads[:, -1].toarray().ravel()
+
+        # per-cell QC metrics (mapped features only)
+        total_umis = np.asarray(adata.X.sum(axis=1)).ravel()
+        total_reads = np.asarray(adata.layers["read_counts"].sum(axis=1)).ravel()
+        adata.obs["total_umis"] = total_umis
+        adata.obs["total_reads"] = total_reads
+        adata.obs["reads_per_umi"] = ratio(total_reads, total_umis)
+        # sequencing saturation = 1 - UMIs / reads
+        adata.obs["saturation"] = np.where(
+            total_reads > 0, 1 - ratio(total_umis, total_reads), 0.0
+        )
 
     # add human-friendly feature name to var
     # sample of origin in case of hashtag, antibody name in case of CITE-seq
     # stringify at the end (some antibody name is composed of just numbers)
-    feature_names = adata.var.index.map(lambda x: str(df_tags.loc[x, "feature_name"]))
-    adata.var["feature_name"] = feature_names
+    adata.var["feature_name"] = (
+        df_tags.loc[adata.var.index, "feature_name"].astype(str).values
+    )
 
-    dna3bit = DNA3Bit()
-    # get numerical barcodes but stringify (not allowed to store numbers in obs.index)
-    numerical_barcodes = adata.obs.index.map(lambda x: str(dna3bit.encode(x)))
     # add nucleotide barcode to obs
     adata.obs["barcode_sequence"] = adata.obs_names
 
     # use numerical barcodes for obs index
-    adata.obs_names = numerical_barcodes
+    # stringify (not allowed to store numbers in obs.index)
+    adata.obs_names = keys.astype(str)
 
     adata.write(sample_name + ".h5ad")
 
@@ -105,6 +174,14 @@ def parse_arguments():
         required=True,
     )
 
+    parser.add_argument(
+        "--read-counts",
+        action="store",
+        dest="path_read_counts",
+        help="path to read counts (e.g. read-counts/)",
+        required=False,
+    )
+
     # parse arguments
     params = parser.parse_args()
 
@@ -121,6 +198,7 @@ if __name__ == "__main__":
         sample_name=params.sample_name,
         path_tag_list=params.path_tag_list,
         path_umi_counts=params.path_umi_counts,
+        path_read_counts=params.path_read_counts,
     )
 
     logger.info("DONE.")
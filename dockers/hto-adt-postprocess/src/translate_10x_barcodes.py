@@ -1,12 +1,11 @@
-import os
 import sys
-import json
 import argparse
-import pandas as pd
+import numpy as np
 import humanfriendly
 import logging
 from dna3bit import DNA3Bit
-
+from prep_whitelist import CHUNK_SIZE, load_barcode_keys
+from translation_index import translate_keys
 
 logger = logging.getLogger()
 
@@ -20,72 +19,35 @@ logging.basicConfig(
 )
 
 
-def decode(barcodes):
-    encoder_decoder = DNA3Bit()
-
-    decoded = set(map(lambda x: encoder_decoder.decode(x).decode(), barcodes))
-
-    return decoded
-
-
-def decide_which_whitelist(chemistry, base_path="/opt"):
-    """
-    Based on 10x information, decide which whitelist to use. (https://kb.10xgenomics.com/hc/en-us/articles/115004506263-What-is-a-barcode-whitelist-)
-    Chemistries are defined in the emulsion sheet.
-    Not all whitelists are supported yet.
-
-    Argument `base_path` describes where to find the whitelist json. Will be
-    changed when tested locally with `pytest --local`.
-    """
-    with open(os.path.join(base_path, "data/whitelists.json")) as fin:
-        whitelists = json.load(fin)
-
-    for file, chemistries in whitelists.items():
-        if chemistry in chemistries:
-            return os.path.join(base_path, "data", file)
-    else:
-        raise ValueError("Chemistry {} not supported yet.".format(chemistry))
-
+def translate(path_input, chemistry, separator, has_header, debug=False):
 
-def translate(
-    path_input, chemistry, separator, has_header, debug=False, base_path="/opt"
-):
+    # stream only the first column (numerical SEQC or nucleotide barcodes,
+    # without the suffix -1 in case of Cell Ranger output)
+    keys = np.unique(load_barcode_keys(path_input, 0, has_header, separator))
 
-    df = pd.read_csv(path_input, sep=separator, header=0 if has_header else None)
-
-    barcodes = df.iloc[:, 0].values
-
-    if type(barcodes[0]) is str:
-        # remove the suffix -1 in case Cell Ranger output
-        barcodes = set(map(lambda x: x.strip("-1").strip(), barcodes))
-    else:
-        # SEQC outputs numerical barcode.
-        # decode back to nucleotide sequence
-        barcodes = decode(barcodes)
-
-    # write translated barcodes
-    path_10x_whitelist = decide_which_whitelist(chemistry, base_path=base_path)
-    whitelist = pd.read_csv(path_10x_whitelist, sep="\t", header=None)
-    whitelist = whitelist.loc[whitelist.iloc[:, 0].isin(barcodes)]  # subset
-    whitelist.iloc[:, [1]].to_csv("translated-barcodes.txt", index=False, header=None)
-
-    # outputs
-    n = len(barcodes)
-    m = len(whitelist)
+    n = len(keys)
     logger.info("Pre-translated: " + humanfriendly.format_number(n))
-    logger.info("Post-translated: " + humanfriendly.format_number(m))
 
-    if n != m:
+    # binary search in the memory-mapped translation index of the whitelist
+    try:
+        translated = translate_keys(keys, chemistry)
+    except KeyError as error:
         logger.error("Number of pre-/post-translated barcodes is different!")
         if debug:
-            print(barcodes)
-            print(whitelist)
             raise ValueError(
-                f"Number of pre-/post-translated barcodes is different! {n} vs {m}"
+                f"Number of pre-/post-translated barcodes is different! {error}"
             )
         else:
             exit(1)
 
+    # write translated barcodes
+    with open("translated-barcodes.txt", "wt") as fout:
+        for start in range(0, len(translated), CHUNK_SIZE):
+            chunk = translated[start : start + CHUNK_SIZE]
+            fout.write("\n".join(DNA3Bit.decode_array(chunk)) + "\n")
+
+    logger.info("Post-translated: " + humanfriendly.format_number(len(translated)))
+
 
 def parse_arguments():
 
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 import sys
 import argparse
+import numpy as np
 import pandas as pd
 import logging
-from hto_gex_mapper import decide_which_whitelist
+from dna3bit import DNA3Bit
+from barcode_index import barcode_keys
+from translation_index import translate_keys
+from gzip_writer import to_csv_gz
 
 logger = logging.getLogger("translate_barcodes")
 
@@ -17,17 +21,25 @@ logging.basicConfig(
 )
 
 
-def translate_barcodes(barcodes, chemistry: str):
+def translate_barcodes(barcodes, chemistry: str, reverse: bool = False):
+    """
+    Translate TotalSeq-B/C HTO barcodes to GEX barcodes (GEX to HTO if
+    `reverse`). Nucleotide barcodes are translated to nucleotide barcodes,
+    numeric (DNA3Bit) barcodes to numeric barcodes.
+    """
+    barcodes = np.asarray(barcodes)
 
-    # get whitelist
-    path_translation = decide_which_whitelist(chemistry)
+    keys = barcode_keys(barcodes)
+    if keys.dtype != np.uint64:
+        raise ValueError("Cell barcodes must be numeric or nucleotide sequences")
 
-    # translate
-    translation_df = pd.read_csv(path_translation, sep="\t", index_col=0, header=None)
+    # translate in the integer domain
+    translated_keys = translate_keys(keys, chemistry, reverse=reverse)
 
-    translated_barcodes = translation_df.loc[barcodes].values.flatten()
+    if barcodes.dtype.kind in "ui":
+        return translated_keys
 
-    return translated_barcodes
+    return DNA3Bit.decode_array(translated_keys)
 
 
 def convert(df, chemistry: str):
@@ -53,7 +65,7 @@ def translate(
     logger.info("Translating TotalSeq-B/C HTO <--> GEX barcodes...")
     df_final = convert(barcodes, chemistry)
 
-    df_final.to_csv("barcodes-translated.tsv.gz", header=None, compression="gzip")
+    to_csv_gz(df_final, "barcodes-translated.tsv.gz", header=None)
 
 
 def parse_arguments():
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from dna2bit import DNA2Bit
+from dna3bit import DNA3Bit
+from hto_gex_mapper import data_path, decide_which_whitelist
+
+logger = logging.getLogger("translation_index")
+
+# direction of the translation = barcodes the index is sorted by
+HTO = "hto"
+GEX = "gex"
+
+# 10x translation whitelists are 16bp barcodes, 2-bit encoded in a uint32
+BARCODE_LENGTH = 16
+
+
+def index_paths(path_whitelist: str) -> dict:
+    """
+    Paths of the HTO-sorted and GEX-sorted index of a translation whitelist.
+    """
+    return {HTO: path_whitelist + ".hto.npy", GEX: path_whitelist + ".gex.npy"}
+
+
+def read_whitelist(path_whitelist: str):
+    """
+    Read a 10x translation whitelist (HTO and GEX barcode per line) as
+    DNA3Bit-encoded barcodes.
+
+    :return: (HTO barcodes, GEX barcodes) as aligned uint64 arrays
+    """
+    df = pd.read_csv(path_whitelist, sep="\t", header=None, usecols=[0, 1], dtype=str)
+
+    return DNA3Bit.encode_array(df[0].values), DNA3Bit.encode_array(df[1].values)
+
+
+def _sort_pairs(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # stable, so the first line of a duplicated barcode is the one found
+    order = np.argsort(keys, kind="stable")
+    return np.stack([keys[order], values[order]])
+
+
+def build_translation_index(path_whitelist: str) -> dict:
+    """
+    Build the translation index of a whitelist: for each direction, a 2 x n
+    uint32 array of 2-bit encoded (`DNA2Bit`) barcodes, sorted in the first
+    row and with their translations in the second. This is half the size of
+    DNA3Bit keys.
+    """
+    encoder = DNA2Bit(BARCODE_LENGTH)
+    hto, gex = [encoder.from_dna3bit(keys) for keys in read_whitelist(path_whitelist)]
+
+    if np.any(DNA2Bit.is_escaped(hto)) or np.any(DNA2Bit.is_escaped(gex)):
+        raise ValueError(
+            "{} has barcodes that are not {}bp ACGT sequences".format(
+                path_whitelist, BARCODE_LENGTH
+            )
+        )
+
+    return {HTO: _sort_pairs(hto, gex), GEX: _sort_pairs(gex, hto)}
+
+
+def save_translation_index(path_whitelist: str):
+    """
+    Build the translation index of a whitelist and save it as `.npy` next to it.
+    """
+    paths = index_paths(path_whitelist)
+
+    for direction, pairs in build_translation_index(path_whitelist).items():
+        np.save(paths[direction], pairs)
+
+
+def load_translation_index(path_whitelist: str, direction: str = HTO) -> np.ndarray:
+    """
+    Memory-map the prebuilt translation index of a whitelist. If it has not
+    been built (e.g. outside of the docker image), it is built in memory.
+    """
+    path = index_paths(path_whitelist)[direction]
+
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+
+    logger.warning("No translation index for {}, building it...".format(path_whitelist))
+
+    return build_translation_index(path_whitelist)[direction]
+
+
+def translate_keys(keys: np.ndarray, chemistry: str, reverse: bool = False):
+    """
+    Translate DNA3Bit-encoded TotalSeq-B/C HTO barcodes to GEX barcodes (or GEX
+    to HTO barcodes if `reverse`) with a binary search in the translation index.
+
+    :return: translated DNA3Bit-encoded barcodes (uint64)
+    """
+    pairs = load_translation_index(
+        decide_which_whitelist(chemistry), GEX if reverse else HTO
+    )
+
+    # barcodes that cannot be 2-bit encoded (N, wrong length) are not in
+    # the whitelist, the others are searched as uint32 like the index
+    encoder = DNA2Bit(BARCODE_LENGTH)
+    codes = encoder.from_dna3bit(keys)
+    escaped = DNA2Bit.is_escaped(codes)
+    codes = np.where(escaped, 0, codes).astype(pairs.dtype)
+
+    pos = np.searchsorted(pairs[0], codes)
+    pos[pos == pairs.shape[1]] = 0
+
+    missing = np.count_nonzero(escaped | (pairs[0][pos] != codes))
+    if missing:
+        raise KeyError(
+            "{} of {} barcodes are not in the {} whitelist".format(
+                missing, len(keys), chemistry
+            )
+        )
+
+    return encoder.to_dna3bit(pairs[1][pos])
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--whitelists",
+        action="store",
+        dest="path_whitelists",
+        help="path to whitelists.json; the index of every whitelist is saved next to it",
+        default=os.path.join(data_path(), "whitelists.json"),
+    )
+
+    # parse arguments
+    params = parser.parse_args()
+
+    return params
+
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    params = parse_arguments()
+
+    logger.info("Starting...")
+
+    with open(params.path_whitelists) as fin:
+        whitelists = json.load(fin)
+
+    for file in whitelists:
+        logger.info("Building translation index for {}...".format(file))
+        save_translation_index(
+            os.path.join(os.path.dirname(params.path_whitelists), file)
+        )
+
+    logger.info("DONE.")
@@ -7,7 +7,8 @@ import logging
 from anndata._core.anndata import AnnData
 import anndata as ad
 import pandas as pd
-from dna3bit import DNA3Bit
+from barcode_index import barcode_keys
+from classification_io import read_classification
 from translate_barcodes import translate_barcodes
 
 numba_logger = logging.getLogger("numba")
@@ -27,17 +28,12 @@ logging.basicConfig(
 
 def translate(adata: AnnData, chemistry: str):
 
-    # translate (TotalSeq-B/C HTO <--> GEX)
+    # translate (TotalSeq-B/C HTO <--> GEX) the numerical barcodes
     translated_barcodes = translate_barcodes(
-        adata.obs["barcode_sequence"].values, chemistry=chemistry
+        barcode_keys(adata.obs["barcode_sequence"].values), chemistry=chemistry
     )
 
-    # encode nucleotide barcodes into numerical barcodes
-    dna3bit = DNA3Bit()
-    numerical_barcodes = list(
-        map(lambda x: str(dna3bit.encode(x)), translated_barcodes)
-    )
-    adata.obs_names = numerical_barcodes
+    adata.obs_names = translated_barcodes.astype(str)
 
 
 def updata_adata(
@@ -52,7 +48,7 @@ def updata_adata(
     adata = ad.read_h5ad(path_adata_in)
 
     logger.info("Loading classification...")
-    df_class = pd.read_csv(path_class, sep="\t", index_col=0, compression="gzip")
+    df_class = read_classification(path_class)
 
     logger.info("Adding classification to AnnData...")
     adata.obs["hash_id"] = pd.Categorical(df_class.hashID)
@@ -73,7 +69,7 @@ def parse_arguments():
         "--class",
         action="store",
         dest="path_class",
-        help="path to hashtag classification file (*.tsv.gz)",
+        help="path to hashtag classification file (*.tsv.gz or *.npz)",
         required=True,
     )
 
@@ -1,12 +1,21 @@
 import pytest
 import os
+import shutil
 import pandas as pd
+import numpy as np
 import anndata as ad
 
 import translate_barcodes
+import translation_index
+import hto_gex_mapper
+import prep_whitelist
+import combine
 import translate_10x_barcodes
 import to_adata
 import subset_adata
+from count_matrix import read_count_dir
+from dna2bit import DNA2Bit
+from dna3bit import DNA3Bit
 from tests.utils import get_test_data_path, get_opt_data_path
 
 @pytest.fixture
@@ -24,10 +33,10 @@ def path_test_data():
 
 def test_whitelist_path(base_path):
     """Test whitelist path"""
-    path_v3 = translate_10x_barcodes.decide_which_whitelist(
+    path_v3 = hto_gex_mapper.decide_which_whitelist(
         "test-small-v3", base_path=base_path
     )
-    path_v4 = translate_10x_barcodes.decide_which_whitelist(
+    path_v4 = hto_gex_mapper.decide_which_whitelist(
         "test-small-v4", base_path=base_path
     )
 
@@ -87,6 +96,66 @@ def test_hto_gex_translation_v4():
     assert translated.iloc[0].name == "AATGAGGTCCATGTCC"
     assert translated.iloc[1].name == "AATGAGGTCTCTAGGG"
 
+def test_translate_barcodes_numeric_reverse():
+    """Test translation of numeric barcodes in both directions"""
+    barcodes = ["AAACCAAAGAACCAGG", "AAACCAAAGAAGCATA"]
+    keys = DNA3Bit.encode_array(barcodes)
+
+    translated = translate_barcodes.translate_barcodes(keys, chemistry="test-small-v4")
+
+    assert translated.dtype == np.uint64
+    assert list(DNA3Bit.decode_array(translated)) == ["AATGAGGTCCATGTCC", "AATGAGGTCCTGGTAG"]
+
+    reversed_keys = translate_barcodes.translate_barcodes(
+        translated, chemistry="test-small-v4", reverse=True
+    )
+    assert (reversed_keys == keys).all()
+
+    with pytest.raises(KeyError):
+        translate_barcodes.translate_barcodes(["ACGTACGTACGTACGT"], chemistry="test-small-v4")
+    # barcodes with N or of another length are not in the (2-bit encoded) index
+    for barcode in ["AAACCAAAGAACNAGG", "AAACCAAAGAACCAG"]:
+        with pytest.raises(KeyError):
+            translate_barcodes.translate_barcodes([barcode], chemistry="test-small-v4")
+
+def test_translation_index(tmp_path):
+    """Test the saved index is memory-mapped and matches the whitelist"""
+    path_whitelist = str(tmp_path / "test-small-v3.txt")
+    shutil.copy(get_opt_data_path("test-small-v3.txt"), path_whitelist)
+
+    translation_index.save_translation_index(path_whitelist)
+
+    hto, gex = translation_index.read_whitelist(path_whitelist)
+    encoder = DNA2Bit(translation_index.BARCODE_LENGTH)
+    for direction, (keys, values) in [("hto", (hto, gex)), ("gex", (gex, hto))]:
+        pairs = translation_index.load_translation_index(path_whitelist, direction)
+
+        # 2-bit encoded, half the size of DNA3Bit keys
+        assert isinstance(pairs, np.memmap)
+        assert pairs.dtype == np.uint32
+        assert (np.diff(pairs[0].astype(np.int64)) > 0).all()
+        assert dict(zip(keys, values)) == dict(
+            zip(encoder.to_dna3bit(pairs[0]), encoder.to_dna3bit(pairs[1]))
+        )
+
+    # barcodes that cannot be 2-bit encoded cannot be indexed
+    with open(path_whitelist, "a") as fout:
+        fout.write("ACGTNCGTACGTACGT\tACGTACGTACGTACGT\n")
+    with pytest.raises(ValueError):
+        translation_index.build_translation_index(path_whitelist)
+
+def test_translate_keys_cwd(tmp_path, monkeypatch):
+    """Test the whitelist is found from any working directory (e.g. a Cromwell execution directory)"""
+    monkeypatch.chdir(tmp_path)
+
+    path_whitelist = hto_gex_mapper.decide_which_whitelist("test-small-v4")
+    assert os.path.isabs(path_whitelist)
+    assert os.path.exists(path_whitelist)
+
+    keys = DNA3Bit.encode_array(["AAACCAAAGAACCAGG", "AAACCAAAGAAGCATA"])
+    translated = translation_index.translate_keys(keys, chemistry="test-small-v4")
+    assert list(DNA3Bit.decode_array(translated)) == ["AATGAGGTCCATGTCC", "AATGAGGTCCTGGTAG"]
+
 def test_hto_gex_translation_large(path_test_data):
     """Test full translation"""
     test_bc = "GCGAGAAGTAGACCGA"
@@ -123,13 +192,12 @@ def test_hto_gex_translation_duplicates(path_test_data):
     assert translated.iloc[0].name == "AATGAGGTCCATGTCC"
     assert translated.iloc[1].name == "AATGAGGTCCATGTCC"
 
-def test_hto_gex_10x_translation(path_test_data, base_path):
+def test_hto_gex_10x_translation(path_test_data):
     translate_10x_barcodes.translate(
         path_input=get_test_data_path('tests/citeseq/cb-whitelist-gemx.csv'),
         chemistry="test-small-v4",
         separator=",",
         has_header=False,
-        base_path=base_path,
         debug=True,
     )
     assert os.path.exists("translated-barcodes.txt")
@@ -141,6 +209,37 @@ def test_hto_gex_10x_translation(path_test_data, base_path):
 
     os.remove("translated-barcodes.txt")
 
+def test_translate_10x_barcodes_index(tmp_path, monkeypatch):
+    """Test the whitelist translation with the translation index, duplicates and missing barcodes"""
+    monkeypatch.chdir(tmp_path)
+
+    path_input = str(tmp_path / "cb-whitelist.csv")
+    pd.Series(["AAACCAAAGAAGCATA", "AAACCAAAGAACCAGG", "AAACCAAAGAAGCATA"]).to_csv(
+        path_input, header=False, index=False
+    )
+
+    translate_10x_barcodes.translate(
+        path_input=path_input,
+        chemistry="test-small-v4",
+        separator=",",
+        has_header=False,
+        debug=True,
+    )
+
+    with open("translated-barcodes.txt") as fin:
+        translated = fin.read().split()
+    assert sorted(translated) == ["AATGAGGTCCATGTCC", "AATGAGGTCCTGGTAG"]
+
+    pd.Series(["ACGTACGTACGTACGT"]).to_csv(path_input, header=False, index=False)
+    with pytest.raises(ValueError):
+        translate_10x_barcodes.translate(
+            path_input=path_input,
+            chemistry="test-small-v4",
+            separator=",",
+            has_header=False,
+            debug=True,
+        )
+
 def get_adata(path_test_data, use_acgt=False):
     path_tag_list = get_test_data_path('tests/citeseq/tag-list.csv')
     path_umi_counts = get_test_data_path('tests/citeseq/umi-counts')
@@ -169,6 +268,39 @@ def test_to_adata(path_test_data):
 
     os.remove("adata.h5ad")
 
+def test_to_adata_read_counts(path_test_data):
+    path_read_counts = get_test_data_path('tests/citeseq/read-counts')
+
+    to_adata.to_adata(
+        sample_name="adata",
+        path_tag_list=get_test_data_path('tests/citeseq/tag-list.csv'),
+        path_umi_counts=get_test_data_path('tests/citeseq/umi-counts'),
+        path_read_counts=path_read_counts,
+    )
+
+    adata = ad.read_h5ad("adata.h5ad")
+    mtx_reads, barcodes, _ = read_count_dir(path_read_counts)
+
+    # read counts are aligned to the UMI counts
+    assert (adata.obs["barcode_sequence"].values == barcodes).all()
+    assert (adata.layers["read_counts"] != mtx_reads[:, :-1]).nnz == 0
+    assert (adata.obs["unmapped_reads"] == mtx_reads[:, -1].toarray().ravel()).all()
+
+    total_reads = adata.layers["read_counts"].sum(axis=1).A1
+    total_umis = adata.X.sum(axis=1).A1
+    assert (adata.obs["total_reads"] == total_reads).all()
+
+    has_umis = total_umis > 0
+    assert np.allclose(
+        adata.obs["reads_per_umi"][has_umis], total_reads[has_umis] / total_umis[has_umis]
+    )
+    assert (adata.obs["reads_per_umi"][~has_umis] == 0).all()
+    assert np.allclose(
+        adata.obs["saturation"][has_umis], 1 - total_umis[has_umis] / total_reads[has_umis]
+    )
+
+    os.remove("adata.h5ad")
+
 def test_subset_adata(path_test_data):
     adata = get_adata(path_test_data, use_acgt=True)
 
@@ -184,4 +316,217 @@ def test_subset_adata(path_test_data):
     adata = ad.read("adata.h5ad")
     assert adata is not None
 
-    os.remove("adata.h5ad")
\ No newline at end of file
+    os.remove("adata.h5ad")
+
+def test_subset_adata_order(tmp_path):
+    """Test the subset keeps the cells in the order of the AnnData object"""
+    barcodes = ["TTTCCCAAGAAACACT", "AAACCCAAGAAACTGC", "AAACCCAAGAAACACT", "GGGCCCAAGAAACACT"]
+    adata = ad.AnnData(
+        X=np.arange(8, dtype=np.float32).reshape(4, 2),
+        obs=pd.DataFrame(index=barcodes),
+    )
+    path_adata = str(tmp_path / "adata.h5ad")
+    adata.write(path_adata)
+
+    # whitelist in a different order, with a barcode missing from the AnnData
+    path_cb_whitelist = str(tmp_path / "cb-whitelist.csv")
+    whitelist = [barcodes[3], "CCCCCCAAGAAACACT", barcodes[0], barcodes[2]]
+    pd.Series(whitelist).to_csv(path_cb_whitelist, header=False, index=False)
+
+    path_adata_out = str(tmp_path / "subset.h5ad")
+    subset_adata.subset_adata(
+        path_adata_in=path_adata,
+        path_adata_out=path_adata_out,
+        path_cb_whitelist=path_cb_whitelist,
+        convert=False,
+    )
+
+    subset = ad.read_h5ad(path_adata_out)
+    assert list(subset.obs_names) == [barcodes[0], barcodes[2], barcodes[3]]
+    assert np.array_equal(subset.X, adata.X[[0, 2, 3]])
+
+def test_prep_whitelist_seqc(tmp_path):
+    """Test SEQC sparse barcodes and dense matrices give the same whitelist as before"""
+    barcodes = ["TTTCCCAAGAAACACT", "AAACCCAAGAAACTGC", "AAACCCAAGAAACACT"]
+    keys = DNA3Bit.encode_array(barcodes)
+
+    path_sparse = str(tmp_path / "sparse_counts_barcodes.csv")
+    pd.Series(keys).to_csv(path_sparse, header=False)
+    path_dense = str(tmp_path / "dense.csv")
+    pd.DataFrame({"CD3": [1, 2, 3], "CD4": [0, 5, 1]}, index=keys).to_csv(path_dense)
+
+    path_acgt = str(tmp_path / "cb-whitelist.txt")
+    path_1234 = str(tmp_path / "cb-whitelist.1234.txt")
+
+    prep_whitelist.prep_whitelist(
+        path_sparse, "SeqcSparseCountsBarcodesCsv", path_acgt=path_acgt, path_1234=path_1234
+    )
+    assert open(path_acgt).read().split() == barcodes
+    assert open(path_1234).read().split() == keys.astype(str).tolist()
+
+    prep_whitelist.prep_whitelist(
+        path_dense, "SeqcDenseCountsMatrixCsv", path_acgt=path_acgt, path_1234=path_1234
+    )
+    assert open(path_acgt).read().split() == sorted(barcodes)
+
+def test_prep_whitelist_10x_translate(tmp_path, monkeypatch):
+    """Test Cell Ranger barcodes are streamed in chunks and translated from any working directory"""
+    barcodes = ["AAACCCAAGAAACACT", "AAACCCAAGAAACTGC", "AAACCCAAGAAACACT"]
+
+    path_input = str(tmp_path / "barcodes.tsv.gz")
+    pd.Series([bc + "-1" for bc in barcodes]).to_csv(path_input, header=False, index=False)
+
+    chunks = list(prep_whitelist.read_barcode_keys(path_input, separator="\t", chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert list(DNA3Bit.decode_array(np.concatenate(chunks))) == barcodes
+
+    # e.g. a Cromwell execution directory, not /opt
+    monkeypatch.chdir(tmp_path)
+    path_acgt = str(tmp_path / "cb-whitelist.txt")
+    prep_whitelist.prep_whitelist(
+        path_input,
+        "10x",
+        chemistry="test-small-v3",
+        path_acgt=path_acgt,
+        path_1234=str(tmp_path / "cb-whitelist.1234.txt"),
+    )
+    assert open(path_acgt).read().split() == ["AAACCCATCAAACACT", "AAACCCATCAAACTGC"]
+
+def test_combine_chunked(tmp_path, monkeypatch):
+    """Test reading the count matrix in blocks gives the same output"""
+    barcodes = DNA3Bit.encode_array(
+        ["AAACCCAAGAAACACT", "AAACCCAAGAAACTGC", "TTTCCCAAGAAACACT", "GGGCCCAAGAAACACT"]
+    )
+    path_matrix = str(tmp_path / "dense.csv")
+    pd.DataFrame(
+        {"CD3": [1, 2, 3, 4], "CD4": [0, 5, 1, 2]}, index=barcodes[[3, 0, 2, 1]]
+    ).to_csv(path_matrix)
+    path_class = str(tmp_path / "classification.tsv.gz")
+    pd.DataFrame(
+        {"hashID": ["HTO-301", "Doublet", "HTO-302"]}, index=barcodes[:3]
+    ).to_csv(path_class, sep="\t")
+
+    monkeypatch.chdir(tmp_path)
+    outputs = []
+    for chunk_size in [None, 1, 3]:
+        df_class = combine.combine(path_matrix, path_class, False, None, chunk_size=chunk_size)
+        outputs.append(
+            (
+                df_class,
+                pd.read_csv("final-matrix.tsv.gz", sep="\t", index_col=0),
+                pd.read_csv("final-classification.tsv.gz", sep="\t", index_col=0),
+            )
+        )
+
+    # order of the count matrix, only classified barcodes
+    assert outputs[0][0].index.tolist() == barcodes[[0, 2, 1]].tolist()
+    assert outputs[0][1].columns.tolist() == ["CD3", "CD4", "hashID"]
+    for output in outputs[1:]:
+        for expected, actual in zip(outputs[0], output):
+            pd.testing.assert_frame_equal(expected, actual)
+
+
+def test_combine_translate(tmp_path, monkeypatch):
+    """Test HTO barcodes are translated to GEX barcodes from any working directory"""
+    hto = DNA3Bit.encode_array(["AAACCAAAGAACCAGG", "AAACCAAAGAAGCATA"])
+    gex = DNA3Bit.encode_array(["AATGAGGTCCATGTCC", "AATGAGGTCCTGGTAG"])
+    path_matrix = str(tmp_path / "dense.csv")
+    pd.DataFrame({"CD3": [1, 2], "CD4": [0, 5]}, index=gex[::-1]).to_csv(path_matrix)
+    path_class = str(tmp_path / "classification.tsv.gz")
+    pd.DataFrame({"hashID": ["HTO-301", "HTO-302"]}, index=hto).to_csv(path_class, sep="\t")
+
+    # e.g. a Cromwell execution directory, not /opt
+    monkeypatch.chdir(tmp_path)
+    df_class = combine.combine(path_matrix, path_class, True, "test-small-v4")
+
+    assert df_class.index.tolist() == gex[::-1].tolist()
+    assert df_class["hashID"].tolist() == ["HTO-302", "HTO-301"]
+
+
+@pytest.mark.parametrize("input_format", ["dense", "h5ad", "mtx", "10x-h5"])
+@pytest.mark.parametrize("output_format", ["h5ad", "mtx"])
+def test_combine_sparse(tmp_path, monkeypatch, input_format, output_format):
+    """Test sparse count matrices are joined like the dense count matrix"""
+    import h5py
+    import scipy.io
+    import scipy.sparse
+
+    barcodes = ["AAACCCAAGAAACACT", "AAACCCAAGAAACTGC", "TTTCCCAAGAAACACT"]
+    keys = DNA3Bit.encode_array(barcodes)
+    counts = np.array([[1, 0, 0], [0, 5, 2], [3, 0, 1]])
+    genes = ["CD3", "CD4", "CD8"]
+
+    path_class = str(tmp_path / "classification.tsv.gz")
+    pd.DataFrame({"hashID": ["Doublet", "HTO-301"]}, index=keys[[1, 0]]).to_csv(
+        path_class, sep="\t"
+    )
+
+    if input_format == "dense":
+        path_matrix = str(tmp_path / "dense.csv")
+        pd.DataFrame(counts, index=keys, columns=genes).to_csv(path_matrix)
+    elif input_format == "h5ad":
+        path_matrix = str(tmp_path / "gex.h5ad")
+        ad.AnnData(
+            X=scipy.sparse.csr_matrix(counts, dtype=np.float32),
+            obs=pd.DataFrame(index=barcodes),
+            var=pd.DataFrame(index=genes),
+        ).write(path_matrix)
+    elif input_format == "mtx":
+        path_matrix = str(tmp_path / "filtered_feature_bc_matrix")
+        os.makedirs(path_matrix)
+        scipy.io.mmwrite(
+            os.path.join(path_matrix, "matrix.mtx"), scipy.sparse.coo_matrix(counts.T)
+        )
+        pd.Series([b + "-1" for b in barcodes]).to_csv(
+            os.path.join(path_matrix, "barcodes.tsv.gz"), header=False, index=False
+        )
+        pd.Series(genes).to_csv(
+            os.path.join(path_matrix, "features.tsv.gz"), header=False, index=False
+        )
+    else:
+        path_matrix = str(tmp_path / "filtered_feature_bc_matrix.h5")
+        csc = scipy.sparse.csc_matrix(counts.T)
+        with h5py.File(path_matrix, "w") as f:
+            f["matrix/data"] = csc.data
+            f["matrix/indices"] = csc.indices
+            f["matrix/indptr"] = csc.indptr
+            f["matrix/shape"] = np.array(csc.shape)
+            f["matrix/barcodes"] = np.array([b + "-1" for b in barcodes], dtype="S")
+            f["matrix/features/id"] = np.array(["ENSG1", "ENSG2", "ENSG3"], dtype="S")
+            f["matrix/features/name"] = np.array(genes, dtype="S")
+
+    monkeypatch.chdir(tmp_path)
+    df_class = combine.combine(
+        path_matrix, path_class, False, None, output_format=output_format
+    )
+
+    # order of the count matrix, only classified barcodes
+    assert df_class.index.tolist() == keys[:2].tolist()
+    assert df_class.hashID.tolist() == ["HTO-301", "Doublet"]
+    pd.testing.assert_frame_equal(
+        pd.read_csv("final-classification.tsv.gz", sep="\t", index_col=0), df_class
+    )
+
+    if output_format == "h5ad":
+        adata = ad.read_h5ad("final-matrix.h5ad")
+        matrix = adata.X
+        hash_ids = adata.obs.hashID.tolist()
+        assert adata.n_vars == 3
+    else:
+        matrix = read_count_dir("final-matrix")[0]
+        hash_ids = pd.read_csv(
+            "final-matrix/classification.tsv.gz", sep="\t", index_col=0
+        ).hashID.tolist()
+
+    assert scipy.sparse.issparse(matrix)
+    assert matrix.toarray().tolist() == counts[:2].tolist()
+    assert hash_ids == ["HTO-301", "Doublet"]
+
+
+def test_combine_sparse_to_dense(tmp_path):
+    """Test a sparse count matrix cannot be written as a dense matrix"""
+    path_matrix = str(tmp_path / "gex.h5ad")
+    ad.AnnData(X=np.zeros((1, 1))).write(path_matrix)
+
+    with pytest.raises(ValueError):
+        combine.combine(path_matrix, "", False, None, output_format="dense")
@@ -1,4 +1,4 @@
-version="0.5.1"
+version="0.14.1"
 
 # docker related
 registry="docker.io/sailmskcc"
@@ -2,18 +2,26 @@
 # coding: utf-8
 
 import sys
-import os
 import argparse
+import collections
 import pandas as pd
 import numpy as np
+import scipy.sparse
 import yaml
 import logging
-import scipy.io
-import scipy.stats
-from sklearn.cluster import KMeans
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from dna3bit import DNA3Bit
-import warnings
-from scipy.stats.mstats import gmean
+from count_matrix import read_count_dir
+from classification_io import write_classification_npz
+from gzip_writer import GzipWriter
+from two_means import two_means_rows, cluster_size, pack_labels, format_patterns
+from hto_normalization import normalize
+
+# HTO index of doublets returned by `classify_indices`
+DOUBLET = -2
+# HTO index of barcodes below the minimum count
+NEGATIVE = -1
 
 
 logger = logging.getLogger("demux_kmeans")
@@ -28,141 +36,296 @@ logging.basicConfig(
 )
 
 
-def hto_demux(
-    path_hto_umi_count_dir: str,
-    mode: int,
-    min_count_threshold: int
-):
-    # Construct sparse matrix of HTO counts
-    matrix = scipy.io.mmread(
-        os.path.join(path_hto_umi_count_dir, "matrix.mtx.gz")
-        )
-    barcodes = pd.read_csv(
-        os.path.join(path_hto_umi_count_dir, "barcodes.tsv.gz"),
-        header=None
-    )[0]
-    features = pd.read_csv(
-        os.path.join(path_hto_umi_count_dir, "features.tsv.gz"),
-        header=None
-    )[0]
-
-    # Remove barcodes with less than minimum counts
-    negative_mask = np.ravel(matrix.sum(axis=0) > min_count_threshold)
-    csr = matrix.tocsr()[:, negative_mask]
-
-    # convert to numeric cell barcode
-    dna3bit = DNA3Bit()
-    numeric_barcodes = barcodes.apply(dna3bit.encode)
-
-    # Convert to DataFrame
-    df_umi = pd.DataFrame(
-        csr.todense(),
-        columns=numeric_barcodes[negative_mask],
-        index=features,
-    ).T
-
-    logger.info(
-        "Loaded HTO UMI count matrix %s",
-        df_umi.shape[0]
-    )
-
-    # drop the column `unmapped`
-    df_umi = df_umi.iloc[:, 0:-1]
+def load_hto_umi_counts(path_hto_umi_count_dir: str, cache: bool = False):
+    """
+    Load the CITE-seq-Count UMI count matrix as CSR (barcodes x features).
+    """
+    return read_count_dir(path_hto_umi_count_dir, cache=cache)
 
-    logger.info(f"Running in mode {mode}...")
-    if mode == 1:
-        # centered log-ratio (CLR) transformation
-        df_clr = df_umi.apply(
-            lambda row: np.log1p((row + 1) / gmean(row + 1)),
-            axis=1
-        )
-    elif mode == 2:
-        # very noisy methanol-based
-        df_clr = df_umi.apply(lambda row: row - np.mean(row), axis=1)
-        df_clr = df_clr.applymap(lambda x: 0 if x < 0 else x)
-        df_clr = df_clr.apply(
-            lambda row: np.log1p((row + 1) / gmean(row + 1)),
-            axis=1
-        )
-    elif mode == 3:
-        # aggresively rescue from doublets if in doubt
-        df_clr = df_umi.apply(
-            lambda row: row / gmean(row + 1),
-            axis=1
-        )
-    else:
-        raise Exception("Unrecognized mode...")
 
-    # change column name to column index so that we can access by e.g. x[1]
-    df_tmp = df_umi
-    df_tmp.columns = range(0, len(df_tmp.columns))
+def classify_indices(umi: np.ndarray, mode: int):
+    """
+    Classify barcodes given their UMI counts (barcodes x HTOs, float32).
 
+    Returns the index of the HTO of each barcode (DOUBLET for doublets) and the
+    K-means cluster labels (barcodes x HTOs, uint8).
+    The UMI counts are normalized in place.
+    """
     # for each row/barcode, get the index of the one with the largest UMI count
-    ss_umi_largest = df_tmp.idxmax(axis=1)
+    umi_largest = np.argmax(umi, axis=1)
 
-    def kmeans_per_row(row):
-        x = np.array(row).reshape(-1, 1)
-        kmeans = KMeans(n_clusters=2, random_state=0).fit(x)
-        y_predict = kmeans.predict(x)
-        return y_predict
+    clr = normalize(umi, mode, out=umi)
 
-    logger.info("Running K-means...")
     # 227922838763364    [0, 1, 1, 1]
     # 239596337850148    [0, 0, 1, 0]
     # 164759051090203    [0, 1, 1, 1]
     # 191020391422693    [0, 1, 1, 0]
     # 204968413023541    [0, 0, 0, 1]
-    with warnings.catch_warnings():
-        # avoid ConvergenceWarning: Number of distinct clusters (1)
-        # found smaller than n_clusters (2). 
-        # Possibly due to duplicate points in X.
-        warnings.simplefilter("ignore")
-        df_kmeans = df_clr.apply(lambda row: kmeans_per_row(row), axis=1)
+    # optimal 2-means split of every row at once
+    labels = two_means_rows(clr)
 
-    df_kmeans_hotencoded = df_kmeans.apply(
-        lambda x: "".join(str(y) for y in x)
-    ).to_frame()
+    # index of hto having the largest UMIs: 0, 1, 2, or 3
+    # how many hto belong to its group (0 or 1)?
+    num_htos = cluster_size(labels, umi_largest)
 
-    # shorten and replace _ with -
-    # ['HTO-301', 'HTO-302', 'HTO-303', 'HTO-304']
-    hto_names = list(
-        map(lambda name: name.split("-")[0].replace("_", "-"), df_clr.columns)
-    )
+    # if greater than or equal to two HTOs belong to that group,
+    # it means doublet
+    hto_ids = np.where(num_htos >= 2, DOUBLET, umi_largest).astype(np.int16)
+
+    return hto_ids, labels
+
+
+# set in every worker process by `init_worker`
+_worker = {}
+
+
+def share_csr(matrix):
+    """
+    Copy the arrays of a CSR matrix into one shared memory segment.
+
+    Returns the segment and the layout needed to attach to it
+    (see `attach_csr`).
+    """
+    arrays = [matrix.data, matrix.indices, matrix.indptr]
 
-    def demux_pass2(cb):
+    offsets = np.concatenate([[0], np.cumsum([a.nbytes for a in arrays])])
+    shm = shared_memory.SharedMemory(create=True, size=max(int(offsets[-1]), 1))
 
-        # index of hto having the largest UMIs: 0, 1, 2, or 3
-        idmax = ss_umi_largest[cb]
+    layout = []
+    for offset, array in zip(offsets, arrays):
+        layout.append((int(offset), array.dtype.str, len(array)))
+        np.ndarray(len(array), dtype=array.dtype, buffer=shm.buf, offset=offset)[:] = array
 
-        # which group belongs to? 0 or 1
-        group_id = df_kmeans_hotencoded.loc[cb][0][idmax]
+    return shm, (layout, matrix.shape)
 
-        # how many hto belong that group?
-        num_htos = df_kmeans_hotencoded.loc[cb][0].count(group_id)
 
-        # if greater than or equal to two HTOs belong to that group,
-        # it means doublet
-        # return "Doublet" if doublet, return HTO ID if singlet
-        # return "Doublet" if num_htos >= 2 else "Singlet"
-        return "Doublet" if num_htos >= 2 else hto_names[idmax]
+def attach_csr(shm, layout):
+    """
+    CSR matrix backed by the arrays in a shared memory segment (no copy).
+    """
+    arrays, shape = layout
+    data, indices, indptr = [
+        np.ndarray(size, dtype=dtype, buffer=shm.buf, offset=offset)
+        for offset, dtype, size in arrays
+    ]
+    return scipy.sparse.csr_matrix((data, indices, indptr), shape=shape, copy=False)
 
-    df_class = pd.DataFrame(
-        list(map(lambda cb: (cb, demux_pass2(cb)), df_kmeans_hotencoded.index))
+
+def classify_rows(umi, start: int, end: int, mode: int, debug_patterns: bool, scores: bool):
+    """
+    Classify rows [start, end) of the sparse UMI count matrix (barcodes x HTOs),
+    densifying only those rows.
+
+    Returns the HTO indices, the packed cluster labels (None unless debugging
+    patterns) and the normalized UMI counts (None unless `scores`).
+    """
+    block = umi[start:end].toarray()
+    hto_ids, labels = classify_indices(block, mode)
+    return (
+        hto_ids,
+        pack_labels(labels) if debug_patterns else None,
+        block if scores else None
     )
-    df_class.columns = ["CB", "hashID"]
-    df_class.set_index("CB", inplace=True)
 
-    logger.debug(df_class.groupby(by="hashID").size())
 
-    df_neg = pd.DataFrame(
-        "Negative",
-        index=numeric_barcodes[~negative_mask],
-        columns=["hashID"],
+def init_worker(shm_name: str, layout, mode: int, debug_patterns: bool, scores: bool):
+    """
+    Attach a worker process to the shared UMI count matrix.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["umi"] = attach_csr(shm, layout)
+    _worker["args"] = (mode, debug_patterns, scores)
+
+
+def classify_block(start: int, end: int):
+    """
+    Classify rows [start, end) of the shared UMI count matrix in a worker.
+    """
+    return classify_rows(_worker["umi"], start, end, *_worker["args"])
+
+
+def demux_blocks(
+    umi,
+    negative_mask: np.ndarray,
+    mode: int,
+    chunk_size: int = None,
+    workers: int = 1,
+    debug_patterns: bool = False,
+    scores: bool = False
+):
+    """
+    Classify barcodes in blocks of `chunk_size` barcodes, in barcode order.
+
+    `umi` is the sparse UMI count matrix (CSR, float32) of the barcodes in
+    `negative_mask` only. Every block is densified and normalized on its own,
+    so the dense arrays are bounded by the block size. With more than one
+    worker, blocks are classified in a process pool that shares the arrays of
+    `umi` in shared memory.
+
+    Yields (start, end, HTO indices, packed cluster labels, normalized UMI
+    counts) for every block of barcodes, where the HTO indices are NEGATIVE
+    or DOUBLET for the barcodes that are not singlets, and the cluster labels
+    and normalized UMI counts (of the barcodes in `negative_mask`) are None
+    unless `debug_patterns` and `scores`.
+    """
+    num_barcodes = len(negative_mask)
+    chunk_size = chunk_size or max(num_barcodes, 1)
+
+    # row of the UMI count matrix for every barcode position
+    rows = np.concatenate([[0], np.cumsum(negative_mask)])
+
+    blocks = [
+        (start, min(start + chunk_size, num_barcodes))
+        for start in range(0, num_barcodes, chunk_size)
+    ]
+
+    def to_block(start, end, hto_ids, packed, normalized):
+        mask = negative_mask[start:end]
+
+        block_ids = np.full(end - start, NEGATIVE, dtype=np.int16)
+        block_ids[mask] = hto_ids
+
+        return start, end, block_ids, packed, normalized
+
+    if workers <= 1:
+        for start, end in blocks:
+            yield to_block(
+                start,
+                end,
+                *classify_rows(umi, rows[start], rows[end], mode, debug_patterns, scores)
+            )
+        return
+
+    shm, layout = share_csr(umi)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(shm.name, layout, mode, debug_patterns, scores),
+        ) as executor:
+            # bound the number of blocks in flight to limit memory usage
+            pending = collections.deque()
+
+            for start, end in blocks:
+                if len(pending) >= 2 * workers:
+                    block, future = pending.popleft()
+                    yield to_block(*block, *future.result())
+                pending.append(
+                    ((start, end), executor.submit(classify_block, rows[start], rows[end]))
+                )
+
+            while pending:
+                block, future = pending.popleft()
+                yield to_block(*block, *future.result())
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def hash_id_names(hto_ids: np.ndarray, hto_names) -> np.ndarray:
+    """
+    Hash IDs (HTO name, Doublet or Negative) of HTO indices.
+    """
+    names = np.array(list(hto_names) + ["Doublet", "Negative"], dtype=object)
+    # DOUBLET and NEGATIVE index the last two names
+    return names[hto_ids]
+
+
+def hto_demux(
+    path_hto_umi_count_dir: str,
+    mode: int,
+    min_count_threshold: int,
+    debug_patterns: bool = False,
+    workers: int = 1,
+    chunk_size: int = None,
+    cache: bool = False,
+    npz: bool = False
+):
+    # barcodes x features, the last feature is `unmapped`
+    matrix, barcodes, features = load_hto_umi_counts(path_hto_umi_count_dir, cache)
+
+    # Remove barcodes with less than minimum counts
+    negative_mask = np.ravel(matrix.sum(axis=1) > min_count_threshold)
+
+    # compact barcodes x HTOs matrix without the `unmapped` column
+    umi = matrix[negative_mask][:, :-1].astype(np.float32)
+    del matrix
+
+    logger.info(
+        "Loaded HTO UMI count matrix %s",
+        umi.shape[0]
     )
-    df_neg.index.rename("CB", inplace=True)
-    df_class = pd.concat([df_class, df_neg]).loc[numeric_barcodes]
 
-    df_class.to_csv("classification.tsv.gz", sep="\t", compression="gzip")
+    # shorten and replace _ with -
+    # ['HTO-301', 'HTO-302', 'HTO-303', 'HTO-304']
+    hto_names = list(
+        map(lambda name: name.split("-")[0].replace("_", "-"), features[:-1])
+    )
+
+    # convert to numeric cell barcode
+    dna3bit = DNA3Bit()
+    cb = pd.Index(dna3bit.encode_array(barcodes), name="CB")
+
+    # compact per-barcode results: HTO index and packed cluster labels
+    hto_ids = np.empty(len(barcodes), dtype=np.int16)
+    packed = np.zeros(len(barcodes) if debug_patterns else 0, dtype=np.uint64)
+    if npz:
+        # normalized UMI counts used for the classification
+        scores = np.full((len(barcodes), len(hto_names)), np.nan, dtype=np.float32)
+
+    logger.info(f"Running in mode {mode} with {workers} worker(s)...")
+
+    # write the classification of every block as soon as it is ready, the
+    # header first (also when there are no barcodes)
+    with GzipWriter("classification.tsv.gz") as fout:
+        columns = ["hashID", "pattern"] if debug_patterns else ["hashID"]
+        pd.DataFrame(columns=columns, index=cb[:0]).to_csv(fout, sep="\t")
+
+        for start, end, block_ids, block_packed, normalized in demux_blocks(
+            umi,
+            negative_mask,
+            mode,
+            chunk_size=chunk_size,
+            workers=workers,
+            debug_patterns=debug_patterns,
+            scores=npz,
+        ):
+            mask = negative_mask[start:end]
+
+            df_block = pd.DataFrame(
+                {"hashID": hash_id_names(block_ids, hto_names)}, index=cb[start:end]
+            )
+            if debug_patterns:
+                # K-means cluster pattern (e.g. 0100), empty for negatives
+                block_patterns = np.full(end - start, None, dtype=object)
+                distinct, codes = format_patterns(block_packed, len(hto_names))
+                block_patterns[mask] = distinct[codes]
+                df_block["pattern"] = block_patterns
+                packed[start:end][mask] = block_packed
+            df_block.to_csv(fout, sep="\t", header=False)
+
+            hto_ids[start:end] = block_ids
+            if npz:
+                scores[start:end][mask] = normalized
+
+    df_class = pd.DataFrame({"hashID": hash_id_names(hto_ids, hto_names)}, index=cb)
+    if debug_patterns:
+        distinct, codes = format_patterns(packed[negative_mask], len(hto_names))
+        pattern_codes = np.full(len(barcodes), -1, dtype=np.int64)
+        pattern_codes[negative_mask] = codes
+        df_class["pattern"] = pd.Categorical.from_codes(pattern_codes, distinct)
+
+    logger.debug(df_class[negative_mask].groupby(by="hashID").size())
+
+    if npz:
+        df_scores = pd.DataFrame(
+            scores, index=cb, columns=["score_" + name for name in hto_names]
+        )
+        write_classification_npz(
+            "classification.npz", pd.concat([df_class, df_scores], axis=1)
+        )
 
     return df_class
 
@@ -206,6 +369,45 @@ def parse_arguments():
         default=1,
     )
 
+    parser.add_argument(
+        "--debug-patterns",
+        action="store_true",
+        dest="debug_patterns",
+        help="add the K-means cluster pattern of each barcode (e.g. 0100) to the classification",
+    )
+
+    parser.add_argument(
+        "--workers",
+        action="store",
+        dest="workers",
+        type=int,
+        help="number of worker processes",
+        default=1,
+    )
+
+    parser.add_argument(
+        "--chunk-size",
+        action="store",
+        dest="chunk_size",
+        type=int,
+        help="number of barcodes per block; bounds the dense UMI counts normalized at a time (default: all barcodes in one block)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        dest="cache",
+        help="keep the parsed UMI count matrix in a sidecar next to it for later runs",
+    )
+
+    parser.add_argument(
+        "--npz",
+        action="store_true",
+        dest="npz",
+        help="also write the classification with per-HTO scores as classification.npz",
+    )
+
     # parse arguments
     params = parser.parse_args()
 
@@ -219,7 +421,14 @@ if __name__ == "__main__":
     logger.info("Starting...")
 
     df_class = hto_demux(
-        params.path_hto_umi_count_dir, params.mode, params.min_count_threshold
+        params.path_hto_umi_count_dir,
+        params.mode,
+        params.min_count_threshold,
+        params.debug_patterns,
+        params.workers,
+        params.chunk_size,
+        params.cache,
+        params.npz
     )
 
     logger.info("Writing statistics...")
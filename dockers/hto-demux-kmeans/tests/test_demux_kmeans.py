@@ -0,0 +1,198 @@
+import os
+import gzip
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.io
+import scipy.sparse
+from scipy.stats.mstats import gmean
+from sklearn.cluster import KMeans
+
+import demux_kmeans
+from classification_io import read_classification
+
+HTOS = [
+    "HTO_301-ACCCACCAGTAAGAC",
+    "HTO_302-GGTCGAGAGCATTCA",
+    "HTO_303-CTTGCCGCATGTCAT",
+    "HTO_304-AAAGCATTCTTCACG",
+]
+
+
+def write_umi_count_dir(path, num_barcodes=300, seed=0):
+    """
+    Write a synthetic CITE-seq-Count UMI count output
+    (singlets, doublets and low-count barcodes).
+    """
+    rng = np.random.default_rng(seed)
+
+    counts = rng.poisson(5, size=(num_barcodes, len(HTOS)))
+    kind = rng.integers(0, 10, size=num_barcodes)
+    for i in range(num_barcodes):
+        if kind[i] < 7:
+            counts[i, rng.integers(len(HTOS))] += rng.poisson(200)
+        elif kind[i] < 9:
+            for j in rng.choice(len(HTOS), 2, replace=False):
+                counts[i, j] += rng.poisson(150)
+    unmapped = rng.poisson(20, size=(num_barcodes, 1))
+
+    matrix = scipy.sparse.coo_matrix(np.hstack([counts, unmapped]).T)
+
+    bases = np.array(list("ACGT"))
+    barcodes = [
+        "".join(rng.choice(bases, 16)) for _ in range(num_barcodes)
+    ]
+
+    os.makedirs(path, exist_ok=True)
+    with gzip.open(os.path.join(path, "matrix.mtx.gz"), "wb") as fout:
+        scipy.io.mmwrite(fout, matrix)
+    pd.Series(barcodes).to_csv(
+        os.path.join(path, "barcodes.tsv.gz"), header=False, index=False
+    )
+    pd.Series(HTOS + ["unmapped"]).to_csv(
+        os.path.join(path, "features.tsv.gz"), header=False, index=False
+    )
+
+
+def hto_demux_reference(path, mode, min_count_threshold):
+    """
+    The original dense pandas implementation.
+    """
+    matrix = scipy.io.mmread(os.path.join(path, "matrix.mtx.gz"))
+    barcodes = pd.read_csv(os.path.join(path, "barcodes.tsv.gz"), header=None)[0]
+    features = pd.read_csv(os.path.join(path, "features.tsv.gz"), header=None)[0]
+
+    negative_mask = np.ravel(matrix.sum(axis=0) > min_count_threshold)
+    csr = matrix.tocsr()[:, negative_mask]
+
+    df_umi = pd.DataFrame(
+        csr.todense(), columns=barcodes[negative_mask], index=features
+    ).T
+    df_umi = df_umi.iloc[:, 0:-1]
+
+    if mode == 1:
+        df_clr = df_umi.apply(
+            lambda row: np.log1p((row + 1) / gmean(row + 1)), axis=1
+        )
+    elif mode == 2:
+        df_clr = df_umi.apply(lambda row: row - np.mean(row), axis=1)
+        df_clr = df_clr.map(lambda x: 0 if x < 0 else x)
+        df_clr = df_clr.apply(
+            lambda row: np.log1p((row + 1) / gmean(row + 1)), axis=1
+        )
+    else:
+        df_clr = df_umi.apply(lambda row: row / gmean(row + 1), axis=1)
+
+    hto_names = [name.split("-")[0].replace("_", "-") for name in df_clr.columns]
+
+    hash_ids = pd.Series("Negative", index=barcodes.values)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for cb, row in df_clr.iterrows():
+            x = np.array(row).reshape(-1, 1)
+            labels = KMeans(n_clusters=2, random_state=0).fit(x).predict(x)
+            idmax = int(np.argmax(df_umi.loc[cb].values))
+            num_htos = np.count_nonzero(labels == labels[idmax])
+            hash_ids[cb] = "Doublet" if num_htos >= 2 else hto_names[idmax]
+
+    return hash_ids.values
+
+
+@pytest.mark.parametrize("mode", [1, 2, 3])
+def test_hto_demux_matches_reference(tmp_path, monkeypatch, mode):
+    """Test the compact implementation against the original dense one"""
+    path = str(tmp_path / "umi_count")
+    write_umi_count_dir(path)
+    monkeypatch.chdir(tmp_path)
+
+    df_class = demux_kmeans.hto_demux(path, mode, min_count_threshold=50)
+
+    expected = hto_demux_reference(path, mode, min_count_threshold=50)
+    assert df_class.hashID.tolist() == expected.tolist()
+    assert (df_class.hashID == "Negative").any()
+
+    df_written = pd.read_csv(
+        "classification.tsv.gz", sep="\t", index_col=0, compression="gzip"
+    )
+    assert df_written.index.name == "CB"
+    assert df_written.hashID.tolist() == expected.tolist()
+
+
+def test_debug_patterns(tmp_path, monkeypatch):
+    """Test the optional K-means cluster pattern column"""
+    path = str(tmp_path / "umi_count")
+    write_umi_count_dir(path)
+    monkeypatch.chdir(tmp_path)
+
+    df_class = demux_kmeans.hto_demux(path, 1, 50, debug_patterns=True)
+
+    negative = df_class.hashID == "Negative"
+    assert df_class.pattern.dtype == "category"
+    assert df_class.pattern[negative].isna().all()
+
+    patterns = df_class.pattern[~negative].astype(str)
+    assert (patterns.str.len() == len(HTOS)).all()
+    # singlets are the only member of the high cluster
+    singlets = df_class.hashID[~negative] != "Doublet"
+    assert (patterns[singlets].str.count("1") == 1).all()
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_chunked(tmp_path, monkeypatch, workers):
+    """Test classifying in blocks (in a process pool) matches one block"""
+    path = str(tmp_path / "umi_count")
+    write_umi_count_dir(path, num_barcodes=500)
+    monkeypatch.chdir(tmp_path)
+
+    expected = demux_kmeans.hto_demux(path, 2, 50, debug_patterns=True, npz=True)
+    with gzip.open("classification.tsv.gz", "rb") as fin:
+        expected_written = fin.read()
+    expected_npz = read_classification("classification.npz")
+
+    df_class = demux_kmeans.hto_demux(
+        path, 2, 50, debug_patterns=True, workers=workers, chunk_size=64, npz=True
+    )
+    with gzip.open("classification.tsv.gz", "rb") as fin:
+        written = fin.read()
+
+    pd.testing.assert_frame_equal(df_class, expected)
+    assert written == expected_written
+    pd.testing.assert_frame_equal(read_classification("classification.npz"), expected_npz)
+
+
+def test_npz(tmp_path, monkeypatch):
+    """Test the binary classification matches the text one"""
+    path = str(tmp_path / "umi_count")
+    write_umi_count_dir(path)
+    monkeypatch.chdir(tmp_path)
+
+    df_class = demux_kmeans.hto_demux(path, 1, 50, npz=True)
+
+    df_npz = read_classification("classification.npz")
+    df_tsv = read_classification("classification.tsv.gz")
+    assert df_npz.index.tolist() == df_tsv.index.tolist()
+    assert df_npz.hashID.tolist() == df_tsv.hashID.tolist()
+
+    scores = df_npz.filter(like="score_")
+    assert scores.shape[1] == len(HTOS)
+    assert scores[df_class.hashID.values == "Negative"].isna().all(axis=None)
+    assert scores[df_class.hashID.values != "Negative"].notna().all(axis=None)
+
+
+@pytest.mark.parametrize("debug_patterns", [False, True])
+def test_empty(tmp_path, monkeypatch, debug_patterns):
+    """Test the header is written when there are no barcodes"""
+    path = str(tmp_path / "umi_count")
+    write_umi_count_dir(path, num_barcodes=0)
+    monkeypatch.chdir(tmp_path)
+
+    df_class = demux_kmeans.hto_demux(
+        path, 1, 50, debug_patterns=debug_patterns, chunk_size=64
+    )
+
+    assert len(df_class) == 0
+    with gzip.open("classification.tsv.gz", "rt") as fin:
+        header = "CB\thashID\tpattern\n" if debug_patterns else "CB\thashID\n"
+        assert fin.read() == header
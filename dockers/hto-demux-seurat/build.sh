@@ -2,4 +2,6 @@
 
 source config.sh
 
+../sharp-utils/stage.sh
+
 docker build -t ${image_name}:${version} .
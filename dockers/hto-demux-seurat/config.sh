@@ -1,4 +1,4 @@
-version="0.6.0"
+version="0.14.1"
 
 # docker related
 registry="quay.io/hisplan"
@@ -2,16 +2,17 @@
 # coding: utf-8
 
 import sys
-import os
 import argparse
 import pandas as pd
 import numpy as np
 import yaml
 import logging
-import scipy.io
-import scipy.stats
-from sklearn.cluster import KMeans
-from dna3bit import DNA3Bit
+from count_matrix import read_count_dir
+from barcode_index import BarcodeIndex, barcode_keys
+from classification_io import read_classification, write_classification_npz
+from gzip_writer import to_csv_gz
+from two_means import two_means_rows, cluster_size, label_patterns
+from hto_normalization import clr
 
 
 logger = logging.getLogger("correct_fp_doublets")
@@ -26,64 +27,53 @@ logging.basicConfig(
 )
 
 
-def correct_false_positives(path_hto_classification, path_hto_umi_count_dir):
-
-    dna3bit = DNA3Bit()
+def correct_false_positives(
+    path_hto_classification, path_hto_umi_count_dir, cache=False, npz=False
+):
 
     # index = numeric cellular barcode (e.g. 120703409573286, ...)
     # column = hashID (e.g. HTO-301, Doublet, ...)
-    df_class = pd.read_csv(
-        path_hto_classification,
-        index_col=0,
-        compression="gzip" if path_hto_classification.endswith(".gz") else None
-    )
+    # Seurat classification.csv (comma-separated) or classification.npz
+    df_class = read_classification(path_hto_classification, sep=",")
 
-    # convert to numeric cell barcode
-    numeric_barcodes = df_class.index.map(lambda cb: dna3bit.encode(cb))
-    df_class.index = numeric_barcodes
+    # convert to numeric cell barcode (no-op if already numeric), keeping the
+    # index name (Seurat's "rn")
+    df_class.index = pd.Index(barcode_keys(df_class.index), name=df_class.index.name)
 
-    matrix = scipy.io.mmread(
-        os.path.join(path_hto_umi_count_dir, "matrix.mtx.gz")
-    )
-    barcodes = pd.read_csv(
-        os.path.join(path_hto_umi_count_dir, "barcodes.tsv.gz"),
-        header=None
-    )[0]
-    features = pd.read_csv(
-        os.path.join(path_hto_umi_count_dir, "features.tsv.gz"),
-        header=None
-    )[0]
-
-    # convert to numeric cell barcode
-    numeric_barcodes = barcodes.apply(lambda cb: dna3bit.encode(cb))
-
-    df_umi = pd.DataFrame(
-        matrix.todense(),
-        columns=numeric_barcodes,
-        index=features
-    ).T
+    # only the Seurat doublets are corrected
+    doublet_rows = np.flatnonzero(df_class.hashID.values == "Doublet")
+
+    # barcodes x features (sparse)
+    matrix, barcodes, features = read_count_dir(path_hto_umi_count_dir, cache)
 
     logger.info(
         "Loaded HTO UMI count matrix ({} x {})".format(
-            df_umi.shape[0], df_umi.shape[1]
+            matrix.shape[0], matrix.shape[1]
         )
     )
 
+    # look up the doublets in the count matrix and densify only their rows
+    doublet_pos, umi_pos = BarcodeIndex(barcodes).join(
+        df_class.index.values[doublet_rows]
+    )
+    doublet_rows = doublet_rows[doublet_pos]
+
     # index = numeric cellular barcode (e.g. 120703409573286, ...)
-    # column 1 = hashID (e.g. HTO-301, Doublet, ...)
-    # column 2 = HTO_301-ACCCACCAGTAAGAC
-    # column 3 = HTO_302-GGTCGAGAGCATTCA
-    # column 4 = HTO_303-CTTGCCGCATGTCAT
-    # column 5 = HTO_304-AAAGCATTCTTCACG
-    # column 6 = unmapped
-    df_doublets_umi = pd.merge(
-        df_class[df_class.hashID == "Doublet"], df_umi,
-        left_index=True, right_index=True,
-        how="inner"
+    # column 1 = HTO_301-ACCCACCAGTAAGAC
+    # column 2 = HTO_302-GGTCGAGAGCATTCA
+    # column 3 = HTO_303-CTTGCCGCATGTCAT
+    # column 4 = HTO_304-AAAGCATTCTTCACG
+    # column 5 = unmapped
+    df_doublets_umi = pd.DataFrame(
+        matrix[umi_pos].toarray(),
+        index=df_class.index[doublet_rows],
+        columns=features
     )
 
+    logger.info("Found {} doublets".format(len(df_doublets_umi)))
+
     # remove the column `unmapped`
-    df_fp = df_doublets_umi.iloc[:, 1:-1]
+    df_fp = df_doublets_umi.iloc[:, :-1]
 
     logger.info("Computing centered log-ratio (CLR)...")
     # centered log-ratio (CLR) transformation
@@ -92,21 +82,12 @@ def correct_false_positives(path_hto_classification, path_hto_umi_count_dir):
     # 164640656084404	2.477301	0.054396	0.046804	3.561632
     # 121748877338358	2.501004	0.091309	0.034176	3.327706
     # 134463437596589	3.060824	2.458869	0.053883
-    df_clr = df_fp.apply(lambda row: np.log1p(
-        (row + 1) / scipy.stats.mstats.gmean(row + 1)), axis=1)
-
-    # change column name to column index so that we can access by e.g. x[1]
-    df_tmp = df_doublets_umi.iloc[:, 1:-1]
-    df_tmp.columns = range(0, len(df_tmp.columns))
+    df_clr = pd.DataFrame(
+        clr(df_fp.values), index=df_fp.index, columns=df_fp.columns
+    )
 
     # for each row (barcode), get the index of the one with the largest UMI count
-    ss_doublets_umi_largest = df_tmp.idxmax(axis=1)
-
-    def kemans_per_row(row):
-        x = np.array(row).reshape(-1, 1)
-        kmeans = KMeans(n_clusters=2, random_state=0).fit(x)
-        y_predict = kmeans.predict(x)
-        return y_predict
+    umi_largest = np.argmax(df_fp.values, axis=1)
 
     logger.info("Running K-means...")
     # 227922838763364    [0, 1, 1, 1]
@@ -114,56 +95,44 @@ def correct_false_positives(path_hto_classification, path_hto_umi_count_dir):
     # 164759051090203    [0, 1, 1, 1]
     # 191020391422693    [0, 1, 1, 0]
     # 204968413023541    [0, 0, 0, 1]
-    df_kmeans = df_clr.apply(lambda row: kemans_per_row(row), axis=1)
-
-    df_kmeans_hotencoded = df_kmeans.apply(
-        lambda x: "".join(str(y) for y in x)).to_frame()
+    # optimal 2-means split of every row at once
+    labels = two_means_rows(df_clr.values)
 
     # shorten and replace _ with -
     # ['HTO-301', 'HTO-302', 'HTO-303', 'HTO-304']
-    hto_names = list(map(lambda name: name.split(
-        "-")[0].replace("_", "-"), df_clr.columns))
-
-    def demux_pass2(cb):
-
-        # index of hto having the largest UMIs: 0, 1, 2, or 3
-        idmax = ss_doublets_umi_largest[cb]
-
-        # which group belongs to? 0 or 1
-        group_id = df_kmeans_hotencoded.loc[cb][0][idmax]
-
-        # how many hto belong that group?
-        num_htos = df_kmeans_hotencoded.loc[cb][0].count(group_id)
+    hto_names = np.array(
+        list(map(lambda name: name.split("-")[0].replace("_", "-"), df_clr.columns)),
+        dtype=object
+    )
 
-        # if greater than or equal to two HTOs belong to that group, it means doublet
-        # return "Doublet" if doublet, return HTO ID if singlet
-        # return "Doublet" if num_htos >= 2 else "Singlet"
-        return "Doublet" if num_htos >= 2 else hto_names[idmax]
+    # how many hto belong to the group (0 or 1) of the one with the largest UMIs?
+    num_htos = cluster_size(labels, umi_largest)
 
-    df_pass2 = pd.concat([df_doublets_umi, df_kmeans_hotencoded], axis=1)
+    # K-means cluster pattern (e.g. 0110) for debugging
+    patterns, codes = label_patterns(labels)
 
     # add `rescue` column which shows post-FP-corrected hash ID
-    df_pass2 = df_pass2.assign(
-        rescue=df_kmeans_hotencoded.index.map(lambda cb: demux_pass2(cb)))
+    # if greater than or equal to two HTOs belong to that group, it means doublet
+    # "Doublet" if doublet, HTO ID if singlet
+    df_pass2 = df_doublets_umi.assign(
+        pattern=pd.Categorical.from_codes(codes, patterns),
+        rescue=np.where(num_htos >= 2, "Doublet", hto_names[umi_largest])
+    )
 
     logger.debug(df_pass2.groupby("rescue").size())
 
-    fp_corrected = df_pass2.rescue.to_dict()
-
     # update the original classification table
-    # with the FP corrected
-    new_class = df_class.index.map(
-        lambda cb: fp_corrected[cb] if cb in fp_corrected else df_class.loc[cb].values[0]
-    )
+    # with the FP corrected (rows of df_pass2 are the rows `doublet_rows`)
+    new_class = df_class.hashID.values.copy()
+    new_class[doublet_rows] = df_pass2.rescue.values
     df_class.hashID = new_class
 
     logger.debug(df_class.groupby(by="hashID").size())
 
-    df_class.to_csv(
-        "classification.tsv.gz",
-        sep="\t",
-        compression="gzip"
-    )
+    to_csv_gz(df_class, "classification.tsv.gz", sep="\t")
+
+    if npz:
+        write_classification_npz("classification.npz", df_class)
 
     return df_class
 
@@ -197,6 +166,20 @@ def parse_arguments():
         required=True
     )
 
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        dest="cache",
+        help="keep the parsed UMI count matrix in a sidecar next to it for later runs"
+    )
+
+    parser.add_argument(
+        "--npz",
+        action="store_true",
+        dest="npz",
+        help="also write the classification as classification.npz"
+    )
+
     # parse arguments
     params = parser.parse_args()
 
@@ -211,7 +194,9 @@ if __name__ == "__main__":
 
     df_class = correct_false_positives(
         params.path_hto_classification,
-        params.path_hto_umi_count_dir
+        params.path_hto_umi_count_dir,
+        params.cache,
+        params.npz
     )
 
     logger.info("Writing statistics...")
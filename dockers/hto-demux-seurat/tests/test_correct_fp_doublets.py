@@ -0,0 +1,226 @@
+import os
+import gzip
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.io
+import scipy.sparse
+import scipy.stats
+import yaml
+from sklearn.cluster import KMeans
+
+import correct_fp_doublets
+from classification_io import read_classification
+from dna3bit import DNA3Bit
+
+HTOS = [
+    "HTO_301-ACCCACCAGTAAGAC",
+    "HTO_302-GGTCGAGAGCATTCA",
+    "HTO_303-CTTGCCGCATGTCAT",
+    "HTO_304-AAAGCATTCTTCACG",
+]
+
+
+def write_inputs(path, num_barcodes=400, num_missing=20, seed=0):
+    """
+    Write a synthetic CITE-seq-Count UMI count output and a Seurat
+    classification.csv of the same barcodes (shuffled), plus doublets that
+    are not in the count matrix.
+    """
+    rng = np.random.default_rng(seed)
+
+    counts = rng.poisson(3, size=(num_barcodes, len(HTOS)))
+    kind = rng.integers(0, 4, size=num_barcodes)
+    for i in range(num_barcodes):
+        if kind[i] == 0:
+            # singlet
+            counts[i, rng.integers(len(HTOS))] += rng.poisson(200)
+        elif kind[i] == 1:
+            # true doublet
+            for j in rng.choice(len(HTOS), 2, replace=False):
+                counts[i, j] += rng.poisson(150)
+        elif kind[i] == 2:
+            # false positive doublet: one strong HTO, one weak
+            j, k = rng.choice(len(HTOS), 2, replace=False)
+            counts[i, j] += rng.poisson(300)
+            counts[i, k] += rng.poisson(10)
+    unmapped = rng.poisson(20, size=(num_barcodes, 1))
+
+    bases = np.array(list("ACGT"))
+    barcodes = np.unique(
+        ["".join(rng.choice(bases, 16)) for _ in range(num_barcodes + num_missing)]
+    )
+    rng.shuffle(barcodes)
+    missing = barcodes[num_barcodes:]
+    barcodes = barcodes[:num_barcodes]
+
+    path_umi = os.path.join(path, "umi_count")
+    os.makedirs(path_umi, exist_ok=True)
+    matrix = scipy.sparse.coo_matrix(np.hstack([counts, unmapped]).T)
+    with gzip.open(os.path.join(path_umi, "matrix.mtx.gz"), "wb") as fout:
+        scipy.io.mmwrite(fout, matrix)
+    pd.Series(barcodes).to_csv(
+        os.path.join(path_umi, "barcodes.tsv.gz"), header=False, index=False
+    )
+    pd.Series(HTOS + ["unmapped"]).to_csv(
+        os.path.join(path_umi, "features.tsv.gz"), header=False, index=False
+    )
+
+    hash_ids = np.where(
+        kind == 3,
+        "Negative",
+        np.where(kind == 0, "HTO-301", "Doublet"),
+    )
+    df_class = pd.DataFrame(
+        {"hashID": np.concatenate([hash_ids, ["Doublet"] * len(missing)])},
+        index=pd.Index(np.concatenate([barcodes, missing]), name="rn"),
+    )
+    # classification in a different order than the count matrix
+    df_class = df_class.iloc[rng.permutation(len(df_class))]
+
+    path_class = os.path.join(path, "classification.csv")
+    df_class.to_csv(path_class)
+
+    return path_class, path_umi
+
+
+def correct_false_positives_reference(path_hto_classification, path_hto_umi_count_dir):
+    """
+    The original merge + per-row sklearn KMeans implementation.
+    """
+    dna3bit = DNA3Bit()
+
+    df_class = pd.read_csv(path_hto_classification, index_col=0)
+    df_class.index = df_class.index.map(lambda cb: dna3bit.encode(cb))
+
+    matrix = scipy.io.mmread(os.path.join(path_hto_umi_count_dir, "matrix.mtx.gz"))
+    barcodes = pd.read_csv(
+        os.path.join(path_hto_umi_count_dir, "barcodes.tsv.gz"), header=None
+    )[0]
+    features = pd.read_csv(
+        os.path.join(path_hto_umi_count_dir, "features.tsv.gz"), header=None
+    )[0]
+
+    df_umi = pd.DataFrame(
+        matrix.todense(),
+        columns=barcodes.apply(lambda cb: dna3bit.encode(cb)),
+        index=features,
+    ).T
+
+    df_doublets_umi = pd.merge(
+        df_class[df_class.hashID == "Doublet"],
+        df_umi,
+        left_index=True,
+        right_index=True,
+        how="inner",
+    )
+    df_fp = df_doublets_umi.iloc[:, 1:-1]
+
+    df_clr = df_fp.apply(
+        lambda row: np.log1p((row + 1) / scipy.stats.mstats.gmean(row + 1)), axis=1
+    )
+
+    hto_names = [name.split("-")[0].replace("_", "-") for name in df_clr.columns]
+
+    fp_corrected = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for cb, row in df_clr.iterrows():
+            x = np.array(row).reshape(-1, 1)
+            labels = KMeans(n_clusters=2, random_state=0).fit(x).predict(x)
+            idmax = int(np.argmax(df_fp.loc[cb].values))
+            num_htos = np.count_nonzero(labels == labels[idmax])
+            fp_corrected[cb] = "Doublet" if num_htos >= 2 else hto_names[idmax]
+
+    df_class.hashID = df_class.index.map(
+        lambda cb: fp_corrected[cb] if cb in fp_corrected else df_class.loc[cb].values[0]
+    )
+
+    return df_class
+
+
+@pytest.fixture
+def inputs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return write_inputs(str(tmp_path))
+
+
+def test_matches_reference(inputs):
+    """Test the doublet-only implementation against the original one"""
+    path_class, path_umi = inputs
+
+    df_class = correct_fp_doublets.correct_false_positives(path_class, path_umi)
+    expected = correct_false_positives_reference(path_class, path_umi)
+
+    # order of the classification, all barcodes kept
+    assert df_class.index.tolist() == expected.index.tolist()
+    assert df_class.hashID.tolist() == expected.hashID.tolist()
+
+    # some false positives are rescued, doublets missing from the matrix are kept
+    before = pd.read_csv(path_class, index_col=0).hashID
+    assert ((before == "Doublet").values & (df_class.hashID != "Doublet").values).any()
+    assert (df_class.hashID == "Doublet").sum() > 0
+
+    # Seurat's index name is kept
+    with gzip.open("classification.tsv.gz", "rt") as fin:
+        assert fin.readline() == "rn\thashID\n"
+
+    df_written = read_classification("classification.tsv.gz")
+    assert df_written.index.name == "rn"
+    assert df_written.index.tolist() == expected.index.tolist()
+    assert df_written.hashID.tolist() == expected.hashID.tolist()
+
+
+def test_missing_doublets(tmp_path, monkeypatch):
+    """Test doublets that are not in the count matrix stay doublets"""
+    monkeypatch.chdir(tmp_path)
+    path_class, path_umi = write_inputs(str(tmp_path), num_missing=50, seed=1)
+
+    df_class = correct_fp_doublets.correct_false_positives(path_class, path_umi)
+
+    barcodes = pd.read_csv(
+        os.path.join(path_umi, "barcodes.tsv.gz"), header=None
+    )[0]
+    missing = ~df_class.index.isin(DNA3Bit.encode_array(barcodes.values))
+    assert missing.sum() == 50
+    assert (df_class.hashID[missing] == "Doublet").all()
+
+
+def test_write_stats(inputs):
+    """Test the counts of every hashID"""
+    path_class, path_umi = inputs
+
+    df_class = correct_fp_doublets.correct_false_positives(path_class, path_umi)
+    correct_fp_doublets.write_stats(df_class)
+
+    expected = correct_false_positives_reference(path_class, path_umi)
+    with open("stats.yml") as fin:
+        stats = yaml.safe_load(fin)
+
+    assert stats == dict(
+        expected.hashID.value_counts().to_dict(), Total=len(expected)
+    )
+
+
+def test_npz(inputs):
+    """Test the binary classification matches the text one"""
+    path_class, path_umi = inputs
+
+    df_class = correct_fp_doublets.correct_false_positives(
+        path_class, path_umi, npz=True
+    )
+
+    df_npz = read_classification("classification.npz")
+    df_tsv = read_classification("classification.tsv.gz")
+    assert df_npz.index.name == df_tsv.index.name == "rn"
+    assert df_npz.index.tolist() == df_tsv.index.tolist()
+    assert df_npz.hashID.tolist() == df_tsv.hashID.tolist()
+    assert df_npz.hashID.tolist() == df_class.hashID.tolist()
+
+    # the corrected classification can be corrected again from the .npz
+    df_again = correct_fp_doublets.correct_false_positives(
+        "classification.npz", path_umi
+    )
+    assert df_again.hashID.tolist() == df_class.hashID.tolist()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+
+import sys
+import os
+import gzip
+import time
+import argparse
+import tempfile
+import warnings
+import logging
+
+import numpy as np
+import pandas as pd
+import scipy.io
+import scipy.sparse
+
+from barcode_index import BarcodeIndex
+from classification_io import read_classification, write_classification_npz
+from count_matrix import read_count_dir, read_mtx
+from dna2bit import DNA2Bit
+from dna3bit import DNA3Bit
+from gzip_writer import to_csv_gz
+from two_means import two_means_rows, within_cluster_ss
+
+logger = logging.getLogger("benchmark")
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+
+def random_barcodes(num_barcodes, length=16, seed=0):
+    """
+    Generate random ACGT barcodes of a fixed length.
+    """
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    mat = bases[rng.integers(0, 4, size=(num_barcodes, length))]
+    return mat.view("S{}".format(length)).ravel().astype(str)
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def benchmark_dna3bit(num_barcodes, num_scalar):
+    """
+    Compare the vectorized DNA3Bit encode/decode against the scalar versions.
+    Returns False if the two disagree.
+    """
+    barcodes = random_barcodes(num_barcodes)
+
+    encoded, t_encode = timeit(DNA3Bit.encode_array, barcodes)
+    decoded, t_decode = timeit(DNA3Bit.decode_array, encoded)
+
+    subset = barcodes[:num_scalar]
+    encoded_scalar, t_encode_scalar = timeit(
+        lambda x: [DNA3Bit.encode(b) for b in x], subset
+    )
+    decoded_scalar, t_decode_scalar = timeit(
+        lambda x: [DNA3Bit.decode(i).decode() for i in x], encoded_scalar
+    )
+
+    # extrapolate the scalar timings to the full set
+    scale = num_barcodes / len(subset)
+
+    logger.info(
+        "DNA3Bit encode: {:.3f}s vectorized vs ~{:.3f}s scalar ({} barcodes)".format(
+            t_encode, t_encode_scalar * scale, num_barcodes
+        )
+    )
+    logger.info(
+        "DNA3Bit decode: {:.3f}s vectorized vs ~{:.3f}s scalar ({} barcodes)".format(
+            t_decode, t_decode_scalar * scale, num_barcodes
+        )
+    )
+
+    ok = encoded[: len(subset)].tolist() == encoded_scalar
+    ok = ok and decoded[: len(subset)].tolist() == decoded_scalar
+    ok = ok and np.array_equal(decoded, barcodes)
+
+    return ok
+
+
+def benchmark_sequence_stats(num_barcodes):
+    """
+    Time the vectorized sequence statistics used for barcode QC.
+    """
+    encoded = DNA3Bit.encode_array(random_barcodes(num_barcodes))
+
+    _, t_len = timeit(DNA3Bit.seq_len_array, encoded)
+    _, t_n = timeit(DNA3Bit.contains_array, encoded, DNA3Bit.str2bindict["N"])
+    _, t_gc = timeit(DNA3Bit.gc_content_array, encoded)
+    _, t_homopolymer = timeit(DNA3Bit.homopolymer_array, encoded, 5)
+
+    logger.info(
+        "DNA3Bit stats: length {:.3f}s, N {:.3f}s, GC {:.3f}s, "
+        "homopolymer {:.3f}s ({} barcodes)".format(
+            t_len, t_n, t_gc, t_homopolymer, num_barcodes
+        )
+    )
+
+
+def benchmark_dna2bit(num_barcodes):
+    """
+    Compare the 2-bit encoding against DNA3Bit for 16bp barcodes.
+    Returns False if the roundtrip fails or an escaped code is a barcode code.
+    """
+    barcodes = random_barcodes(num_barcodes)
+    encoder = DNA2Bit(16)
+
+    codes, t_encode = timeit(encoder.encode_array, barcodes)
+    decoded, t_decode = timeit(encoder.decode_array, codes)
+
+    logger.info(
+        "DNA2Bit encode: {:.3f}s, decode: {:.3f}s, {:.1f} MB vs {:.1f} MB "
+        "DNA3Bit ({} barcodes)".format(
+            t_encode,
+            t_decode,
+            codes.nbytes / 1e6,
+            DNA3Bit.encode_array(barcodes).nbytes / 1e6,
+            num_barcodes,
+        )
+    )
+
+    # an escaped barcode must not match "AAAA..." (code 0)
+    escaped = encoder.encode_array(["N" * 16, "A" * 16])
+
+    return np.array_equal(decoded, barcodes) and escaped[0] != escaped[1]
+
+
+def benchmark_barcode_index(num_barcodes):
+    """
+    Compare BarcodeIndex lookups against Python sets of barcode strings.
+    Returns False if the two disagree.
+    """
+    barcodes = random_barcodes(num_barcodes)
+    query = random_barcodes(num_barcodes, seed=1)
+    query[::2] = barcodes[::2]
+
+    index, t_build = timeit(BarcodeIndex, barcodes)
+    found, t_lookup = timeit(index.isin, query)
+
+    def isin_set(x, y):
+        y = set(y)
+        return np.array([b in y for b in x])
+
+    found_set, t_set = timeit(isin_set, query, barcodes)
+
+    logger.info(
+        "BarcodeIndex: build {:.3f}s, isin {:.3f}s vs {:.3f}s set ({} barcodes)".format(
+            t_build, t_lookup, t_set, num_barcodes
+        )
+    )
+
+    return np.array_equal(found, found_set)
+
+
+def random_hto_rows(num_rows, num_htos=4, seed=0):
+    """
+    Generate CLR-like HTO rows: a background with one high HTO (singlets)
+    or two (doublets).
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.poisson(5, size=(num_rows, num_htos)).astype(np.float32)
+    x[np.arange(num_rows), rng.integers(0, num_htos, num_rows)] += rng.poisson(
+        100, num_rows
+    )
+    doublets = rng.random(num_rows) < 0.2
+    x[doublets, rng.integers(0, num_htos, doublets.sum())] += 100
+    return np.log1p(x)
+
+
+def benchmark_two_means(num_rows, num_sklearn):
+    """
+    Compare the batched 2-means solver against sklearn KMeans on each row.
+    Returns False if the solver finds a worse split than sklearn on any row.
+    """
+    try:
+        from sklearn.cluster import KMeans
+    except ImportError:
+        logger.info("scikit-learn is not installed, skipping 2-means benchmark")
+        return True
+
+    x = random_hto_rows(num_rows)
+
+    labels, t_batched = timeit(two_means_rows, x)
+
+    def kmeans_loop(rows):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return np.array(
+                [
+                    KMeans(n_clusters=2, random_state=0).fit_predict(row.reshape(-1, 1))
+                    for row in rows
+                ]
+            )
+
+    subset = x[:num_sklearn]
+    labels_sklearn, t_sklearn = timeit(kmeans_loop, subset)
+
+    # extrapolate the sklearn timing to the full set
+    scale = num_rows / len(subset)
+
+    same = (labels[: len(subset)] == labels_sklearn).all(axis=1) | (
+        labels[: len(subset)] != labels_sklearn
+    ).all(axis=1)
+
+    logger.info(
+        "2-means: {:.3f}s batched vs ~{:.1f}s sklearn loop ({} rows), "
+        "{:.2%} of rows with the same clusters".format(
+            t_batched, t_sklearn * scale, num_rows, same.mean()
+        )
+    )
+
+    # sklearn can only differ by stopping at a worse local optimum
+    ss = within_cluster_ss(subset, labels[: len(subset)])
+    ss_sklearn = within_cluster_ss(subset, labels_sklearn)
+
+    return bool(np.all(ss <= ss_sklearn + 1e-6))
+
+
+def benchmark_count_matrix(num_barcodes, num_features=12):
+    """
+    Compare reading a MatrixMarket count directory (and its sidecar cache)
+    against scipy.io.mmread. Returns False if the two disagree.
+    """
+    rng = np.random.default_rng(0)
+    matrix = scipy.sparse.random(
+        num_features, num_barcodes, density=0.5, random_state=0, format="coo"
+    )
+    matrix.data = rng.integers(1, 1000, matrix.nnz).astype(np.int64)
+
+    with tempfile.TemporaryDirectory() as path:
+        path_mtx = os.path.join(path, "matrix.mtx.gz")
+        with gzip.open(path_mtx, "wb", compresslevel=1) as fout:
+            scipy.io.mmwrite(fout, matrix)
+        with gzip.open(os.path.join(path, "barcodes.tsv.gz"), "wt") as fout:
+            fout.write("\n".join(random_barcodes(num_barcodes)) + "\n")
+        with gzip.open(os.path.join(path, "features.tsv.gz"), "wt") as fout:
+            fout.write("\n".join(map(str, range(num_features))) + "\n")
+
+        expected, t_mmread = timeit(scipy.io.mmread, path_mtx)
+        actual, t_read = timeit(read_mtx, path_mtx, True)
+        # the first reader writes the sidecar
+        read_count_dir(path, True)
+        (cached, _, _), t_cached = timeit(read_count_dir, path, True)
+
+    logger.info(
+        "MatrixMarket: {:.3f}s read_mtx, {:.3f}s cached read_count_dir vs {:.3f}s "
+        "scipy.io.mmread ({} x {})".format(
+            t_read, t_cached, t_mmread, num_features, num_barcodes
+        )
+    )
+
+    expected = expected.T.tocsr()
+    return (actual != expected).nnz == 0 and (cached != expected).nnz == 0
+
+
+def benchmark_classification_io(num_barcodes, num_htos=4):
+    """
+    Compare writing and reading a classification table as `.npz` against
+    `classification.tsv.gz`. Returns False if the roundtrip changes the table.
+    """
+    rng = np.random.default_rng(0)
+    hto_names = ["HTO-{}".format(301 + i) for i in range(num_htos)]
+    df_class = pd.DataFrame(
+        {"hashID": rng.choice(hto_names + ["Doublet", "Negative"], num_barcodes)},
+        index=pd.Index(DNA3Bit.encode_array(random_barcodes(num_barcodes))),
+    )
+    for name in hto_names:
+        df_class["score_" + name] = rng.random(num_barcodes, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as path:
+        path_tsv = os.path.join(path, "classification.tsv.gz")
+        path_npz = os.path.join(path, "classification.npz")
+
+        _, t_write_tsv = timeit(
+            lambda: df_class.to_csv(path_tsv, sep="\t", compression="gzip")
+        )
+        _, t_write_npz = timeit(write_classification_npz, path_npz, df_class)
+        _, t_read_tsv = timeit(read_classification, path_tsv)
+        actual, t_read_npz = timeit(read_classification, path_npz)
+
+    logger.info(
+        "Classification: {:.3f}s/{:.3f}s write/read .npz vs {:.3f}s/{:.3f}s "
+        ".tsv.gz ({} x {})".format(
+            t_write_npz,
+            t_read_npz,
+            t_write_tsv,
+            t_read_tsv,
+            num_barcodes,
+            df_class.shape[1],
+        )
+    )
+
+    return actual.index.equals(df_class.index.astype(np.int64)) and all(
+        np.array_equal(actual[name].values, df_class[name].values)
+        for name in df_class.columns
+    )
+
+
+def benchmark_gzip_writer(num_barcodes, num_columns=20):
+    """
+    Compare `to_csv_gz` against `to_csv(compression="gzip")`.
+    Returns False if the decompressed outputs differ.
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.integers(0, 10, size=(num_barcodes, num_columns)),
+        index=pd.Index(DNA3Bit.encode_array(random_barcodes(num_barcodes))),
+    )
+
+    with tempfile.TemporaryDirectory() as path:
+        path_pandas = os.path.join(path, "pandas.tsv.gz")
+        path_writer = os.path.join(path, "writer.tsv.gz")
+
+        _, t_pandas = timeit(
+            lambda: df.to_csv(path_pandas, sep="\t", compression="gzip")
+        )
+        _, t_writer = timeit(lambda: to_csv_gz(df, path_writer, sep="\t"))
+
+        with gzip.open(path_pandas, "rb") as fin:
+            expected = fin.read()
+        with gzip.open(path_writer, "rb") as fin:
+            actual = fin.read()
+
+    logger.info(
+        "Gzipped TSV: {:.3f}s to_csv_gz vs {:.3f}s to_csv ({} x {})".format(
+            t_writer, t_pandas, num_barcodes, num_columns
+        )
+    )
+
+    return actual == expected
+
+
+# input sizes of the parity checks (default) and of the timings (--timings)
+PARITY_SIZES = {
+    "num_barcodes": 10000,
+    "num_scalar": 1000,
+    "num_rows": 10000,
+    "num_sklearn": 200,
+}
+TIMING_SIZES = {
+    "num_barcodes": 1000000,
+    "num_scalar": 20000,
+    "num_rows": 1000000,
+    "num_sklearn": 2000,
+}
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--num-barcodes",
+        action="store",
+        dest="num_barcodes",
+        type=int,
+        help="number of barcodes for the vectorized implementations (default: 10000, or 1000000 with --timings)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num-scalar",
+        action="store",
+        dest="num_scalar",
+        type=int,
+        help="number of barcodes for the scalar implementations (extrapolated, default: 1000, or 20000 with --timings)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num-rows",
+        action="store",
+        dest="num_rows",
+        type=int,
+        help="number of HTO rows for the batched 2-means solver (default: 10000, or 1000000 with --timings)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--num-sklearn",
+        action="store",
+        dest="num_sklearn",
+        type=int,
+        help="number of HTO rows for the sklearn KMeans loop (extrapolated, default: 200, or 2000 with --timings)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        dest="timings",
+        help="time the implementations on large inputs instead of only checking parity on small ones",
+    )
+
+    # parse arguments
+    params = parser.parse_args()
+
+    # small inputs by default, e.g. when building the docker images
+    sizes = TIMING_SIZES if params.timings else PARITY_SIZES
+    for name, size in sizes.items():
+        if getattr(params, name) is None:
+            setattr(params, name, size)
+
+    return params
+
+
+if __name__ == "__main__":
+
+    params = parse_arguments()
+
+    ok = benchmark_dna3bit(params.num_barcodes, params.num_scalar)
+
+    if not ok:
+        logger.error("Vectorized and scalar DNA3Bit results differ!")
+        sys.exit(1)
+
+    if params.timings:
+        benchmark_sequence_stats(params.num_barcodes)
+
+    if not benchmark_dna2bit(params.num_barcodes):
+        logger.error("DNA2Bit roundtrip failed!")
+        sys.exit(1)
+
+    if not benchmark_barcode_index(params.num_barcodes):
+        logger.error("BarcodeIndex and set lookups differ!")
+        sys.exit(1)
+
+    if not benchmark_count_matrix(params.num_barcodes):
+        logger.error("MatrixMarket reader and scipy.io.mmread differ!")
+        sys.exit(1)
+
+    if not benchmark_classification_io(params.num_barcodes // 10):
+        logger.error("Classification .npz roundtrip failed!")
+        sys.exit(1)
+
+    if not benchmark_gzip_writer(params.num_barcodes // 10):
+        logger.error("to_csv_gz and to_csv outputs differ!")
+        sys.exit(1)
+
+    if not benchmark_two_means(params.num_rows, params.num_sklearn):
+        logger.error("2-means solver found a worse split than sklearn!")
+        sys.exit(1)
+
+    logger.info("DONE.")
@@ -0,0 +1,19 @@
+from setuptools import setup
+
+setup(
+    name="sharp-utils",
+    version="0.1.0",
+    description="Shared utilities for the sharp docker images",
+    package_dir={"": "src"},
+    py_modules=[
+        "dna3bit",
+        "dna2bit",
+        "barcode_index",
+        "two_means",
+        "hto_normalization",
+        "count_matrix",
+        "classification_io",
+        "gzip_writer",
+    ],
+    install_requires=["numpy", "scipy", "pandas"],
+)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from dna3bit import DNA3Bit
+
+
+def barcode_keys(barcodes) -> np.ndarray:
+    """
+    Convert cell barcodes into sortable keys.
+
+    Integers and numeric strings (e.g. DNA3Bit-encoded `obs_names`) become uint64,
+    nucleotide strings are DNA3Bit-encoded, so both representations of the same
+    barcode map to the same key. Anything else (e.g. "cell1") is kept as a string
+    array.
+
+    :param barcodes: iterable of int or str (e.g. list, np.ndarray, pd.Index)
+    """
+    barcodes = np.asarray(barcodes).ravel()
+
+    if barcodes.dtype.kind in "ui":
+        if barcodes.dtype.kind == "i" and np.any(barcodes < 0):
+            raise ValueError("barcodes must not be negative")
+        return barcodes.astype(np.uint64, copy=False)
+
+    if len(barcodes) == 0:
+        return np.empty(0, dtype=np.uint64)
+
+    try:
+        return barcodes.astype(np.uint64)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    try:
+        return DNA3Bit.encode_array(barcodes)
+    except (ValueError, UnicodeEncodeError):
+        pass
+
+    return barcodes.astype(str)
+
+
+class BarcodeIndex(object):
+    """
+    Sorted index of cell barcodes for vectorized lookups and joins.
+
+    Barcodes are stored as uint64 keys (see `barcode_keys`) along with the
+    permutation that sorts them, so lookups are a single `np.searchsorted` and
+    results refer to positions in the original order. If a barcode occurs more
+    than once, lookups return its first position.
+    """
+
+    def __init__(self, barcodes):
+        """
+        :param barcodes: iterable of int or str (e.g. list, np.ndarray, pd.Index)
+        """
+        self.keys = barcode_keys(barcodes)
+
+        if np.all(self.keys[1:] >= self.keys[:-1]):
+            # already sorted (e.g. whitelists), no need for a permutation
+            self._order = None
+            self._sorted = self.keys
+        else:
+            self._order = np.argsort(self.keys, kind="stable")
+            self._sorted = self.keys[self._order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def is_unique(self) -> bool:
+        return not np.any(self._sorted[1:] == self._sorted[:-1])
+
+    def _as_index(self, other) -> "BarcodeIndex":
+        return other if isinstance(other, BarcodeIndex) else BarcodeIndex(other)
+
+    def _query_keys(self, barcodes) -> np.ndarray:
+        if isinstance(barcodes, BarcodeIndex):
+            keys = barcodes.keys
+        else:
+            keys = barcode_keys(barcodes)
+
+        if (keys.dtype.kind == "U") != (self.keys.dtype.kind == "U"):
+            raise ValueError(
+                "cannot compare numeric/nucleotide barcodes with other labels"
+            )
+
+        return keys
+
+    def get_indexer(self, barcodes) -> np.ndarray:
+        """
+        Return the position of each barcode in the index, -1 if it is missing.
+
+        :param barcodes: iterable of int or str, or a BarcodeIndex
+        """
+        keys = self._query_keys(barcodes)
+
+        if len(self) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+
+        pos = np.searchsorted(self._sorted, keys)
+        np.minimum(pos, len(self) - 1, out=pos)
+        found = self._sorted[pos] == keys
+
+        indexer = pos if self._order is None else self._order[pos]
+        indexer = indexer.astype(np.int64)
+        indexer[~found] = -1
+
+        return indexer
+
+    def isin(self, barcodes) -> np.ndarray:
+        """
+        Return a boolean mask of the barcodes that are in the index.
+
+        :param barcodes: iterable of int or str, or a BarcodeIndex
+        """
+        return self.get_indexer(barcodes) >= 0
+
+    def lookup(self, barcodes) -> np.ndarray:
+        """
+        Same as `get_indexer` but raise KeyError if a barcode is missing.
+
+        :param barcodes: iterable of int or str, or a BarcodeIndex
+        """
+        indexer = self.get_indexer(barcodes)
+
+        missing = indexer < 0
+        if np.any(missing):
+            keys = self._query_keys(barcodes)[missing]
+            raise KeyError(
+                "{} barcodes not in the index, e.g. {}".format(
+                    len(keys), ", ".join(map(str, keys[:5]))
+                )
+            )
+
+        return indexer
+
+    def join(self, barcodes):
+        """
+        Inner join with the given barcodes, preserving their order.
+
+        Returns a tuple of the positions in `barcodes` that are in the index and
+        the corresponding positions in the index, so that `left.iloc[lpos]` and
+        `right.iloc[rpos]` are aligned row by row.
+
+        :param barcodes: iterable of int or str, or a BarcodeIndex
+        """
+        indexer = self.get_indexer(barcodes)
+        found = indexer >= 0
+
+        return np.flatnonzero(found), indexer[found]
+
+    def intersect(self, other) -> np.ndarray:
+        """
+        Return the keys that are also in `other`, in the order of this index.
+
+        :param other: iterable of int or str, or a BarcodeIndex
+        """
+        return self.keys[self._as_index(other).isin(self.keys)]
+
+    def difference(self, other) -> np.ndarray:
+        """
+        Return the keys that are not in `other`, in the order of this index.
+
+        :param other: iterable of int or str, or a BarcodeIndex
+        """
+        return self.keys[~self._as_index(other).isin(self.keys)]
+
+    def save(self, path: str):
+        """
+        Save the keys (in their original order) as a .npy file.
+        """
+        np.save(path, self.keys)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode=None) -> "BarcodeIndex":
+        """
+        Load an index saved with `save`.
+
+        :param str mmap_mode: passed to `np.load` (e.g. "r" for sorted whitelists)
+        """
+        return cls(np.load(path, mmap_mode=mmap_mode))
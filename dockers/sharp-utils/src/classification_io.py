@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pandas as pd
+
+from barcode_index import barcode_keys
+
+_magic_npz = b"PK\x03\x04"
+_magic_gzip = b"\x1f\x8b"
+
+# columns are stored as `c{i}.values` (numeric) or `c{i}.codes` + `c{i}.categories`
+_categorical = "categorical"
+_numeric = "numeric"
+
+
+def _magic(path: str) -> bytes:
+    with open(path, "rb") as fin:
+        return fin.read(4)
+
+
+def is_npz(path: str) -> bool:
+    """
+    Whether a classification file is in the binary `.npz` format.
+    """
+    return _magic(path) == _magic_npz
+
+
+def write_classification_npz(path: str, df: pd.DataFrame):
+    """
+    Write a classification table (e.g. `hashID` indexed by cell barcode) as
+    uncompressed `.npz` column arrays.
+
+    Barcodes are stored as uint64 (see `barcode_index.barcode_keys`), numeric
+    columns (e.g. per-HTO scores) as they are and all other columns (e.g.
+    `hashID`) as categorical codes. Missing values are kept.
+    """
+    keys = barcode_keys(df.index)
+    if keys.dtype != np.uint64:
+        raise ValueError("Cell barcodes must be numeric or nucleotide sequences")
+
+    arrays = {
+        "barcodes": keys,
+        "index_name": np.array(df.index.name or ""),
+        "columns": np.array([str(name) for name in df.columns]),
+    }
+    kinds = []
+
+    for i, name in enumerate(df.columns):
+        values = df[name]
+        if values.dtype.kind in "biuf":
+            kinds.append(_numeric)
+            arrays["c{}.values".format(i)] = values.to_numpy()
+        else:
+            kinds.append(_categorical)
+            categorical = pd.Categorical(values)
+            arrays["c{}.codes".format(i)] = categorical.codes
+            arrays["c{}.categories".format(i)] = categorical.categories.to_numpy(
+                dtype=str
+            )
+
+    arrays["kinds"] = np.array(kinds)
+
+    with open(path, "wb") as fout:
+        np.savez(fout, **arrays)
+
+
+def read_classification_npz(path: str, categorical: bool = False) -> pd.DataFrame:
+    """
+    Read a classification table written by `write_classification_npz`.
+
+    The index holds the numeric cell barcodes (int64, as when reading the TSV).
+    Categorical columns are returned as strings unless `categorical`.
+    """
+    with np.load(path, allow_pickle=False) as npz:
+        index = pd.Index(
+            npz["barcodes"].astype(np.int64), name=str(npz["index_name"]) or None
+        )
+        data = {}
+
+        for i, (name, kind) in enumerate(zip(npz["columns"], npz["kinds"])):
+            if kind == _numeric:
+                data[str(name)] = npz["c{}.values".format(i)]
+            else:
+                values = pd.Categorical.from_codes(
+                    npz["c{}.codes".format(i)],
+                    npz["c{}.categories".format(i)].astype(object),
+                )
+                data[str(name)] = (
+                    values if categorical else np.asarray(values, dtype=object)
+                )
+
+    return pd.DataFrame(data, index=index)
+
+
+def read_classification(
+    path: str, sep: str = None, categorical: bool = False
+) -> pd.DataFrame:
+    """
+    Read a classification table, detecting the format from the file contents:
+    `.npz` (see `write_classification_npz`), gzipped or plain text.
+
+    For text, the first column is the index and the separator is `,` for
+    `*.csv[.gz]` files and a tab otherwise, unless `sep` is given.
+    """
+    magic = _magic(path)
+
+    if magic == _magic_npz:
+        return read_classification_npz(path, categorical=categorical)
+
+    if sep is None:
+        sep = "," if path.endswith((".csv", ".csv.gz")) else "\t"
+
+    df = pd.read_csv(
+        path,
+        sep=sep,
+        index_col=0,
+        compression="gzip" if magic[:2] == _magic_gzip else None,
+    )
+
+    if categorical:
+        for name in df.columns:
+            if df[name].dtype == object:
+                df[name] = pd.Categorical(df[name])
+
+    return df
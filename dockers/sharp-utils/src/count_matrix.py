@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+import os
+import gzip
+import hashlib
+import warnings
+
+import numpy as np
+import scipy
+import scipy.io
+import scipy.sparse
+
+# bytes of the MatrixMarket body parsed at a time
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# scipy >= 1.12 reads MatrixMarket files with a fast (multi-threaded) C++ parser
+FAST_MMREAD = tuple(int(v) for v in scipy.__version__.split(".")[:2]) >= (1, 12)
+
+_dtypes = {"integer": np.int64, "real": np.float64, "pattern": None}
+
+
+def _open(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def _read_header(fin):
+    """
+    Read the MatrixMarket banner, comments and size line.
+
+    :return: (field, (rows, cols), nnz)
+    """
+    banner = fin.readline().decode().strip().lower().split()
+    if len(banner) != 5 or banner[0] != "%%matrixmarket":
+        raise ValueError("Not a MatrixMarket file")
+
+    _, obj, fmt, field, symmetry = banner
+    if obj != "matrix" or fmt != "coordinate" or symmetry != "general":
+        raise ValueError(
+            "Only general coordinate matrices are supported, not {} {} {}".format(
+                obj, fmt, symmetry
+            )
+        )
+    if field not in _dtypes:
+        raise ValueError("Unsupported MatrixMarket field '{}'".format(field))
+
+    line = fin.readline()
+    while line.startswith(b"%") or not line.strip():
+        if not line:
+            raise ValueError("MatrixMarket size line is missing")
+        line = fin.readline()
+
+    rows, cols, nnz = map(int, line.split())
+
+    return field, (rows, cols), nnz
+
+
+def _read_entries(fin, num_columns: int, dtype):
+    """
+    Parse the whitespace-separated entries of the MatrixMarket body in bulk,
+    one newline-aligned chunk at a time.
+    """
+    chunks = []
+    rest = b""
+
+    while True:
+        data = fin.read(CHUNK_SIZE)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        rest = data[end:]
+        chunks.append(np.fromstring(data[:end], dtype=dtype, sep=" "))
+
+    if rest.strip():
+        chunks.append(np.fromstring(rest, dtype=dtype, sep=" "))
+
+    values = np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+    if len(values) % num_columns != 0:
+        raise ValueError("Malformed MatrixMarket entries")
+
+    return values.reshape(-1, num_columns)
+
+
+def read_mtx(path: str, transpose: bool = False) -> scipy.sparse.csr_matrix:
+    """
+    Read a (gzipped) MatrixMarket coordinate file as CSR.
+
+    Equivalent to `scipy.io.mmread(path).tocsr()` (or `.T.tocsr()` if
+    transposed) for general integer, real and pattern matrices. With scipy
+    1.12 or later, this is `scipy.io.mmread`; older versions (pure Python
+    parser) fall back to parsing the coordinates in bulk with NumPy.
+
+    :param path: path to matrix.mtx or matrix.mtx.gz
+    :param transpose: return the transposed matrix (e.g. barcodes x features)
+    """
+    if not FAST_MMREAD:
+        return _read_mtx_numpy(path, transpose)
+
+    with _open(path) as fin:
+        field, _, _ = _read_header(fin)
+
+    matrix = scipy.io.mmread(path)
+    if field == "pattern":
+        matrix = matrix.astype(np.float64)
+
+    return (matrix.T if transpose else matrix).tocsr()
+
+
+def _read_mtx_numpy(path: str, transpose: bool = False) -> scipy.sparse.csr_matrix:
+    with _open(path) as fin:
+        field, shape, nnz = _read_header(fin)
+        dtype = _dtypes[field]
+
+        if dtype is None:
+            entries = _read_entries(fin, 2, np.int64)
+            values = np.ones(len(entries), dtype=np.float64)
+        elif dtype is np.int64:
+            entries = _read_entries(fin, 3, np.int64)
+            values = entries[:, 2]
+        else:
+            entries = _read_entries(fin, 3, np.float64)
+            values = entries[:, 2]
+
+    if len(entries) != nnz:
+        raise ValueError(
+            "Expected {} MatrixMarket entries, found {}".format(nnz, len(entries))
+        )
+
+    # 1-based coordinates
+    rows = entries[:, 0].astype(np.int32) - 1
+    cols = entries[:, 1].astype(np.int32) - 1
+
+    if transpose:
+        rows, cols, shape = cols, rows, shape[::-1]
+
+    return scipy.sparse.coo_matrix((values, (rows, cols)), shape=shape).tocsr()
+
+
+def narrow_counts(matrix):
+    """
+    Cast a (sparse) count matrix to the smallest of uint16 and uint32 that
+    holds its largest count.
+
+    Matrices with negative, non-integer or larger counts are returned as they
+    are.
+    """
+    values = matrix.data if scipy.sparse.issparse(matrix) else np.asarray(matrix)
+
+    if values.dtype.kind not in "iu":
+        return matrix
+    if values.size and values.min() < 0:
+        return matrix
+
+    largest = values.max() if values.size else 0
+    for dtype in [np.uint16, np.uint32]:
+        if largest <= np.iinfo(dtype).max:
+            return matrix.astype(dtype)
+
+    return matrix
+
+
+def read_first_column(path: str) -> np.ndarray:
+    """
+    Read the first tab-separated column of a (gzipped) TSV without a header,
+    e.g. barcodes.tsv.gz or features.tsv.gz.
+    """
+    with _open(path) as fin:
+        lines = fin.read().decode().splitlines()
+
+    return np.array([line.split("\t", 1)[0] for line in lines if line], dtype=object)
+
+
+def fingerprint(paths) -> str:
+    """
+    SHA-1 of the size and modification time of one or more files, which
+    changes whenever they are rewritten without reading them.
+    """
+    sha1 = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        sha1.update("{}:{}:{}\n".format(path, stat.st_size, stat.st_mtime_ns).encode())
+    return sha1.hexdigest()
+
+
+def _count_dir_paths(path_dir: str):
+    paths = []
+    for name in ["matrix.mtx", "barcodes.tsv", "features.tsv"]:
+        path = os.path.join(path_dir, name + ".gz")
+        paths.append(path if os.path.exists(path) else os.path.join(path_dir, name))
+    return paths
+
+
+def read_count_dir(path_dir: str, cache: bool = False):
+    """
+    Read a MatrixMarket count directory (e.g. CITE-seq-Count umi_count/ or
+    read_count/) with matrix.mtx.gz, barcodes.tsv.gz and features.tsv.gz.
+
+    With `cache`, the parsed arrays are stored in a `.npz` sidecar next to the
+    matrix, keyed by the size and modification time of the three files, so
+    later readers of the same files skip parsing. The sidecar is skipped if
+    the directory is not writable.
+
+    :return: (CSR matrix barcodes x features, barcodes, features)
+    """
+    path_mtx, path_barcodes, path_features = _count_dir_paths(path_dir)
+
+    path_cache = None
+    if cache:
+        path_cache = os.path.join(
+            path_dir,
+            ".{}.{}.npz".format(
+                os.path.basename(path_mtx),
+                fingerprint([path_mtx, path_barcodes, path_features])[:16],
+            ),
+        )
+        if os.path.exists(path_cache):
+            with np.load(path_cache, allow_pickle=False) as npz:
+                matrix = scipy.sparse.csr_matrix(
+                    (npz["data"], npz["indices"], npz["indptr"]),
+                    shape=tuple(npz["shape"]),
+                )
+                return (
+                    matrix,
+                    npz["barcodes"].astype(object),
+                    npz["features"].astype(object),
+                )
+
+    matrix = read_mtx(path_mtx, transpose=True)
+    barcodes = read_first_column(path_barcodes)
+    features = read_first_column(path_features)
+
+    if path_cache:
+        try:
+            # write to a temporary file first so readers never see a partial cache
+            path_tmp = "{}.{}.tmp.npz".format(path_cache, os.getpid())
+            np.savez(
+                path_tmp,
+                data=matrix.data,
+                indices=matrix.indices,
+                indptr=matrix.indptr,
+                shape=np.array(matrix.shape),
+                barcodes=barcodes.astype(str),
+                features=features.astype(str),
+            )
+            os.replace(path_tmp, path_cache)
+        except OSError as e:
+            warnings.warn("Could not write {}: {}".format(path_cache, e))
+
+    return matrix, barcodes, features
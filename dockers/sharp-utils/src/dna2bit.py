@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from dna3bit import DNA3Bit
+
+
+class DNA2Bit(object):
+    """
+    Compact 2-bit encoding scheme for fixed-length, N-free sequence data.
+
+    A 16bp 10x cell barcode fits in a uint32 and a cell barcode + 12bp UMI fits in
+    a uint64 (DNA3Bit needs 48 and 84 bits). Sequences that cannot be 2-bit
+    encoded (e.g. containing N, or not `length` bases long) are stored once in a
+    small escape table. Their code is the position in the table with the
+    `ESCAPED` bit (bit 63) set, so it never equals the code of a 2-bit encoded
+    sequence and the codes can be used as join keys as they are. Arrays with
+    escaped sequences are therefore returned as uint64.
+    """
+
+    # tag of the codes of escaped sequences (above the 2 * 31 bits of any code)
+    ESCAPED = np.uint64(1 << 63)
+
+    @staticmethod
+    def bits_per_base():
+        return 2
+
+    str2bindict = {
+        "A": 0b00,
+        "C": 0b01,
+        "G": 0b10,
+        "T": 0b11,
+        "a": 0b00,
+        "c": 0b01,
+        "g": 0b10,
+        "t": 0b11,
+    }
+    bin2strdict = {0b00: b"A", 0b01: b"C", 0b10: b"G", 0b11: b"T"}
+
+    # byte value -> 2-bit code (255 means the base needs escaping)
+    str2binarray = np.full(256, 255, dtype=np.uint8)
+    for _c, _b in str2bindict.items():
+        str2binarray[ord(_c)] = _b
+    # 2-bit code -> byte value
+    bin2strarray = np.frombuffer(b"ACGT", dtype=np.uint8)
+    # DNA3Bit code -> 2-bit code (255 means N or invalid)
+    dna3bit2binarray = np.full(8, 255, dtype=np.uint8)
+    for _c, _b in str2bindict.items():
+        dna3bit2binarray[DNA3Bit.str2bindict[_c]] = _b
+    del _c, _b
+
+    def __init__(self, length: int):
+        """
+        :param int length: number of bases of every sequence (e.g. 16 for 10x CB)
+        """
+        if not 0 < length <= 31:
+            raise ValueError("length must be between 1 and 31, not {}".format(length))
+        self.length = length
+        self.dtype = np.dtype(np.uint32) if length <= 16 else np.dtype(np.uint64)
+        self.escape_table = []
+        self._escape_index = {}
+
+    @staticmethod
+    def is_escaped(codes) -> np.ndarray:
+        """
+        Boolean mask of the codes of escaped sequences.
+        """
+        codes = np.asarray(codes)
+        if codes.dtype != np.uint64:
+            return np.zeros(codes.shape, dtype=bool)
+        return (codes & DNA2Bit.ESCAPED) != 0
+
+    def _escape(self, seqs) -> np.ndarray:
+        """
+        Add sequences to the escape table and return their (tagged) codes.
+        """
+        codes = np.empty(len(seqs), dtype=np.uint64)
+        for i, seq in enumerate(map(str, seqs)):
+            if seq not in self._escape_index:
+                self._escape_index[seq] = len(self.escape_table)
+                self.escape_table.append(seq)
+            codes[i] = self._escape_index[seq]
+        return codes | DNA2Bit.ESCAPED
+
+    def _unescape(self, codes):
+        """
+        Positions in the escape table of the escaped codes.
+
+        :return: (mask of the escaped codes, their positions)
+        """
+        escaped = DNA2Bit.is_escaped(codes)
+        positions = (codes[escaped] & ~DNA2Bit.ESCAPED).astype(np.int64)
+        return escaped, positions
+
+    def encode_array(self, strings) -> np.ndarray:
+        """
+        Convert an array of nucleotide sequences into 2-bit codes, first nucleotide
+        in the most significant position.
+
+        The codes are uint32 if length <= 16 and no sequence was put in the
+        escape table, uint64 otherwise.
+
+        :param strings: iterable of str or bytes (e.g. list, np.ndarray, pd.Index)
+        """
+        seqs = np.asarray(strings, dtype=np.bytes_).ravel()
+        n = len(seqs)
+
+        # fixed-length barcode matrix (shorter sequences are padded with b"\x00")
+        width = max(seqs.dtype.itemsize, self.length)
+        seqs = seqs.astype("S{}".format(width))
+        mat = np.ascontiguousarray(seqs).view(np.uint8).reshape(n, width)
+        codes2 = DNA2Bit.str2binarray[mat[:, : self.length]]
+
+        escaped = np.any(codes2 == 255, axis=1)
+        if width > self.length:
+            escaped |= np.any(mat[:, self.length :] != 0, axis=1)
+
+        codes = np.zeros(n, dtype=self.dtype)
+        two = self.dtype.type(2)
+        for j in range(self.length):
+            codes <<= two
+            codes |= (codes2[:, j] & 0b11).astype(self.dtype)
+
+        if not np.any(escaped):
+            return codes
+
+        codes = codes.astype(np.uint64)
+        codes[escaped] = self._escape(seqs[escaped].astype(str))
+        return codes
+
+    def decode_array(self, codes) -> np.ndarray:
+        """
+        Convert an array of 2-bit codes back into an array of nucleotide strings.
+
+        :param codes: iterable of codes returned by `encode_array`
+        """
+        codes = np.asarray(codes).ravel()
+        escaped, positions = self._unescape(codes)
+
+        plain = codes.astype(self.dtype)
+        shifts = (self.length - 1 - np.arange(self.length)) * 2
+        mat = (plain[:, None] >> shifts.astype(self.dtype)) & self.dtype.type(0b11)
+        chars = DNA2Bit.bin2strarray[mat.astype(np.uint8)]
+
+        seqs = np.ascontiguousarray(chars).view("S{}".format(self.length)).ravel()
+        seqs = seqs.astype(str)
+
+        if np.any(escaped):
+            # escaped sequences can be longer than `length`
+            seqs = seqs.astype(object)
+            seqs[escaped] = np.asarray(self.escape_table, dtype=object)[positions]
+            seqs = seqs.astype(str)
+
+        return seqs
+
+    def _check_dna3bit_length(self):
+        if self.length > DNA3Bit.max_array_seq_len:
+            raise ValueError(
+                "DNA3Bit supports up to {} bases, not {}".format(
+                    DNA3Bit.max_array_seq_len, self.length
+                )
+            )
+
+    def from_dna3bit(self, ints) -> np.ndarray:
+        """
+        Convert DNA3Bit-encoded sequences into 2-bit codes without going through
+        strings. Same codes as `encode_array`.
+
+        :param ints: iterable of DNA3Bit-encoded sequences
+        """
+        self._check_dna3bit_length()
+        ints = np.asarray(ints).astype(np.uint64, copy=False).ravel()
+
+        escaped = DNA3Bit.seq_len_array(ints) != self.length
+        codes = np.zeros(len(ints), dtype=self.dtype)
+        two = self.dtype.type(2)
+        for j in range(self.length - 1, -1, -1):
+            code3 = ((ints >> np.uint64(3 * j)) & np.uint64(0b111)).astype(np.uint8)
+            code2 = DNA2Bit.dna3bit2binarray[code3]
+            escaped |= code2 == 255
+            codes <<= two
+            codes |= (code2 & 0b11).astype(self.dtype)
+
+        if not np.any(escaped):
+            return codes
+
+        codes = codes.astype(np.uint64)
+        codes[escaped] = self._escape(DNA3Bit.decode_array(ints[escaped]))
+        return codes
+
+    def to_dna3bit(self, codes) -> np.ndarray:
+        """
+        Convert 2-bit codes back into DNA3Bit-encoded sequences (uint64).
+
+        :param codes: iterable of codes returned by `encode_array`
+        """
+        self._check_dna3bit_length()
+        codes = np.asarray(codes).ravel()
+        escaped, positions = self._unescape(codes)
+
+        plain = codes.astype(self.dtype)
+        # 2-bit code -> DNA3Bit code
+        table = DNA3Bit.str2binarray[DNA2Bit.bin2strarray].astype(np.uint64)
+
+        ints = np.zeros(len(codes), dtype=np.uint64)
+        for j in range(self.length - 1, -1, -1):
+            code2 = (plain >> self.dtype.type(2 * j)) & self.dtype.type(0b11)
+            ints <<= np.uint64(3)
+            ints |= table[code2]
+
+        if np.any(escaped):
+            ints[escaped] = DNA3Bit.encode_array(
+                np.asarray(self.escape_table)[positions]
+            )
+
+        return ints
+
+    @staticmethod
+    def concat(high, low, low_length: int) -> np.ndarray:
+        """
+        Concatenate two arrays of 2-bit codes (e.g. CB and UMI) into single uint64
+        keys. Escaped sequences cannot be concatenated.
+
+        :param high: codes of the first sequences (e.g. 16bp CB)
+        :param low: codes of the second sequences (e.g. 12bp UMI)
+        :param int low_length: number of bases of the second sequences
+        """
+        if not 0 < low_length < 32:
+            raise ValueError(
+                "low_length must be between 1 and 31, not {}".format(low_length)
+            )
+        if np.any(DNA2Bit.is_escaped(high)) or np.any(DNA2Bit.is_escaped(low)):
+            raise ValueError("escaped sequences cannot be concatenated")
+        high = np.asarray(high).astype(np.uint64)
+        low = np.asarray(low).astype(np.uint64)
+        if np.any(high >> np.uint64(2 * (32 - low_length) - 1)):
+            raise ValueError("concatenated sequences do not fit in 63 bits")
+        return (high << np.uint64(2 * low_length)) | low
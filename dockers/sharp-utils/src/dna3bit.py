@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+
+class DNA3Bit(object):
+    """
+    Compact 3-bit encoding scheme for sequence data.
+    """
+
+    @staticmethod
+    def bits_per_base():
+        return 3
+
+    # TODO: The sam reader needs to be fixed so text files are read as text not binary
+    str2bindict = {
+        65: 0b100,
+        67: 0b110,
+        71: 0b101,
+        84: 0b011,
+        78: 0b111,
+        97: 0b100,
+        99: 0b110,
+        103: 0b101,
+        116: 0b011,
+        110: 0b111,
+        "A": 0b100,
+        "C": 0b110,
+        "G": 0b101,
+        "T": 0b011,
+        "N": 0b111,
+        "a": 0b100,
+        "c": 0b110,
+        "g": 0b101,
+        "t": 0b011,
+        "n": 0b111,
+    }
+    bin2strdict = {0b100: b"A", 0b110: b"C", 0b101: b"G", 0b011: b"T", 0b111: b"N"}
+
+    # lookup tables for the batch (array) versions of encode/decode
+    # byte value -> 3-bit code (0 means invalid base)
+    str2binarray = np.zeros(256, dtype=np.uint8)
+    for _c, _b in str2bindict.items():
+        if isinstance(_c, int):
+            str2binarray[_c] = _b
+    # 3-bit code -> byte value (0 means invalid code)
+    bin2strarray = np.zeros(8, dtype=np.uint8)
+    for _b, _c in bin2strdict.items():
+        bin2strarray[_b] = ord(_c)
+    del _c, _b
+
+    # 21 bases * 3 bits = 63 bits, the most that fits in a uint64
+    max_array_seq_len = 21
+
+    @staticmethod
+    def encode_array(strings) -> np.ndarray:
+        """
+        Vectorized version of `encode`. Convert an array of nucleotide sequences
+        into an array of uint64 using a byte lookup table. Sequences can be of
+        different lengths, but must not be longer than 21 bases.
+
+        :param strings: iterable of str or bytes (e.g. list, np.ndarray, pd.Index)
+        """
+        seqs = np.asarray(strings, dtype=np.bytes_)
+        if seqs.ndim != 1:
+            seqs = seqs.ravel()
+
+        width = seqs.dtype.itemsize
+        if len(seqs) == 0 or width == 0:
+            return np.zeros(len(seqs), dtype=np.uint64)
+        if width > DNA3Bit.max_array_seq_len:
+            raise ValueError(
+                "DNA3Bit.encode_array supports up to {} bases, not {}".format(
+                    DNA3Bit.max_array_seq_len, width
+                )
+            )
+
+        # fixed-length barcode matrix (shorter sequences are padded with b"\x00")
+        mat = np.ascontiguousarray(seqs).view(np.uint8).reshape(len(seqs), width)
+        codes = DNA3Bit.str2binarray[mat]
+
+        padding = mat == 0
+        if np.any((codes == 0) & ~padding):
+            raise ValueError("DNA3Bit.encode_array was called with invalid bases")
+
+        res = np.zeros(len(seqs), dtype=np.uint64)
+        for j in range(width):
+            res <<= np.uint64(3)
+            res |= codes[:, j]
+
+        # padded positions were shifted in as 0b000, shift them back out
+        num_padded = padding.sum(axis=1, dtype=np.uint64)
+        if np.any(num_padded):
+            res >>= np.uint64(3) * num_padded
+
+        return res
+
+    @staticmethod
+    def decode_array(ints) -> np.ndarray:
+        """
+        Vectorized version of `decode`. Convert an array of encoded sequences back
+        into an array of nucleotide strings.
+
+        :param ints: iterable of non-negative integers (e.g. list, np.ndarray)
+        """
+        ints = np.asarray(ints)
+        if ints.ndim != 1:
+            ints = ints.ravel()
+        if ints.dtype.kind == "i" and np.any(ints < 0):
+            raise ValueError("ints must be unsigned (positive) integers")
+        ints = ints.astype(np.uint64, copy=False)
+
+        if len(ints) == 0:
+            return np.array([], dtype=str)
+
+        # one 3-bit code per base, least significant base first
+        shifts = np.arange(DNA3Bit.max_array_seq_len, dtype=np.uint64) * np.uint64(3)
+        codes = ((ints[:, None] >> shifts) & np.uint64(0b111)).astype(np.uint8)
+
+        # the number of bases is the position of the most significant non-zero code
+        nonzero = codes != 0
+        lengths = np.where(
+            nonzero.any(axis=1),
+            DNA3Bit.max_array_seq_len - np.argmax(nonzero[:, ::-1], axis=1),
+            0,
+        )
+        width = max(int(lengths.max()), 1)
+
+        # flip to most significant base first, then left-align each sequence
+        codes = codes[:, :width][:, ::-1]
+        if np.all(lengths == width):
+            # fast path: fixed-length barcodes need no alignment
+            inside = np.ones(codes.shape, dtype=bool)
+        else:
+            cols = np.arange(width) + (width - lengths)[:, None]
+            inside = cols < width
+            codes = np.take_along_axis(codes, np.minimum(cols, width - 1), axis=1)
+
+        chars = DNA3Bit.bin2strarray[codes]
+        if np.any((chars == 0) & inside):
+            raise ValueError("DNA3Bit.decode_array was called with invalid codes")
+        chars[~inside] = 0
+
+        seqs = np.ascontiguousarray(chars).view("S{}".format(width)).ravel()
+
+        return seqs.astype(str)
+
+    @staticmethod
+    def encode(b) -> int:
+        """
+        Convert string nucleotide sequence into binary, note: string is stored so
+        that the first nucleotide is in the MSB position
+
+        :param bytes|str b: sequence containing nucleotides to be encoded
+        """
+        res = 0
+        for c in b:
+            res <<= 3
+            res += DNA3Bit.str2bindict[c]
+        return res
+
+    @staticmethod
+    def decode(i: int) -> bytes:
+        """
+        Convert binary nucleotide sequence into string
+
+        :param i: int, encoded sequence to be converted back to nucleotides
+        """
+        if i < 0:
+            message = "i must be an unsigned (positive) integer, not {0!s}".format(i)
+            raise ValueError(message)
+        r = b""
+        while i > 0:
+            r = DNA3Bit.bin2strdict[i & 0b111] + r
+            i >>= 3
+        return r
+
+    @staticmethod
+    def seq_len(i: int) -> int:
+        """
+        Return the length of an encoded sequence based on its binary representation
+
+        :param i: int, encoded sequence
+        """
+        # every base has a non-zero code, so only the most significant base
+        # can have preceding 0's
+        return (int(i).bit_length() + 2) // 3
+
+    @staticmethod
+    def contains(s: int, char: int) -> bool:
+        """
+        return true if the char (bin representation) is contained in seq (binary
+        representation)
+
+        :param char: int, encoded character (one must be only one nucleotide)
+        :param s: int, sequence of encoded nucleotides
+        """
+        while s > 0:
+            if char == (s & 0b111):
+                return True
+            s >>= 3
+        return False
+
+    @staticmethod
+    def ints2int(ints):
+        """
+        convert an iterable of sequences [i1, i2, i3] into a concatenated single integer
+        0bi1i2i3. In cases where the sequence is longer than 64 bits, python will
+        transition seamlessly to a long int representation, however the user must be
+        aware that downsteam interaction with numpy or other fixed-size representations
+        may not function (use `DNA2Bit.concat` for uint64 CB + UMI keys instead)
+
+        :param ints: iterable of encoded sequences to concatenate
+        """
+
+        res = 0
+        for num in ints:
+            tmp = num
+            # Get length of next number to concatenate (with enough room for leading 0's)
+            while tmp > 0:
+                res <<= 3
+                tmp >>= 3
+            res += num
+        return res
+
+    @staticmethod
+    def count(seq, char_bin):
+        """
+        count how many times char is in seq.
+        char needs to be an encoded value of one of the bases.
+        """
+        if char_bin not in DNA3Bit.bin2strdict.keys():
+            raise ValueError(
+                "DNA3Bit.count was called with an invalid char code - "
+                "{}".format(char_bin)
+            )
+        res = 0
+        while seq > 0:
+            if seq & 0b111 == char_bin:
+                res += 1
+            seq >>= 3
+        return res
+
+    # bit 0 of every 3-bit code in a uint64 (21 bases)
+    lsb_mask = np.uint64(int("001" * 21, 2))
+
+    @staticmethod
+    def _nonzero_codes(ints) -> np.ndarray:
+        """
+        Set bit 0 of every 3-bit code that is non-zero, clear all other bits.
+        """
+        ints = np.asarray(ints).astype(np.uint64, copy=False)
+        one, two = np.uint64(1), np.uint64(2)
+        return (ints | (ints >> one) | (ints >> two)) & DNA3Bit.lsb_mask
+
+    @staticmethod
+    def _popcount(ints) -> np.ndarray:
+        """
+        Number of set bits in each element of a uint64 array.
+        """
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(ints).astype(np.int64)
+        # SWAR popcount for numpy < 2.0
+        x = ints - ((ints >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + (
+            (x >> np.uint64(2)) & np.uint64(0x3333333333333333)
+        )
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+    @staticmethod
+    def seq_len_array(ints) -> np.ndarray:
+        """
+        Vectorized version of `seq_len`. Every base has a non-zero code, so the
+        length is the number of non-zero 3-bit codes.
+
+        :param ints: iterable of encoded sequences
+        """
+        return DNA3Bit._popcount(DNA3Bit._nonzero_codes(ints))
+
+    @staticmethod
+    def count_array(ints, char_bin) -> np.ndarray:
+        """
+        Vectorized version of `count`. Count how many times char is in each of
+        the encoded sequences.
+
+        :param ints: iterable of encoded sequences
+        :param char_bin: int, encoded value of one of the bases
+        """
+        if char_bin not in DNA3Bit.bin2strdict.keys():
+            raise ValueError(
+                "DNA3Bit.count_array was called with an invalid char code - "
+                "{}".format(char_bin)
+            )
+        ints = np.asarray(ints).astype(np.uint64, copy=False)
+        # XOR with char_bin repeated in every position zeroes the matching codes
+        # (positions past the end of the sequence never match since char_bin > 0)
+        pattern = np.uint64(char_bin) * DNA3Bit.lsb_mask
+        mismatches = DNA3Bit._nonzero_codes(ints ^ pattern)
+        return DNA3Bit._popcount(~mismatches & DNA3Bit.lsb_mask)
+
+    @staticmethod
+    def contains_array(ints, char_bin) -> np.ndarray:
+        """
+        Vectorized version of `contains`. Return True for each encoded sequence
+        that contains char (e.g. to flag barcodes with N).
+
+        :param ints: iterable of encoded sequences
+        :param char_bin: int, encoded value of one of the bases
+        """
+        return DNA3Bit.count_array(ints, char_bin) > 0
+
+    @staticmethod
+    def gc_content_array(ints) -> np.ndarray:
+        """
+        Fraction of G and C bases in each encoded sequence (0 for empty sequences).
+
+        :param ints: iterable of encoded sequences
+        """
+        ints = np.asarray(ints).astype(np.uint64, copy=False)
+        gc = DNA3Bit.count_array(ints, 0b101) + DNA3Bit.count_array(ints, 0b110)
+        lengths = DNA3Bit.seq_len_array(ints)
+        return np.divide(
+            gc, lengths, out=np.zeros(len(ints), dtype=np.float64), where=lengths > 0
+        )
+
+    @staticmethod
+    def homopolymer_array(ints, min_run=None) -> np.ndarray:
+        """
+        Flag encoded sequences that contain a run of at least `min_run` identical
+        bases. If `min_run` is None, flag sequences made of a single base
+        (e.g. poly-T barcodes).
+
+        :param ints: iterable of encoded sequences
+        :param min_run: int, minimum homopolymer length
+        """
+        ints = np.asarray(ints).astype(np.uint64, copy=False)
+        lengths = DNA3Bit.seq_len_array(ints)
+
+        if min_run is None:
+            # a single repeated base means every adjacent pair is identical
+            num_same = DNA3Bit._popcount(DNA3Bit._same_as_next(ints, lengths))
+            return (lengths > 0) & (num_same == lengths - 1)
+
+        if min_run <= 1:
+            return lengths >= max(min_run, 0)
+
+        # bit 3k is set if base k is identical to base k + 1; a run of
+        # `min_run` bases is `min_run - 1` consecutive set bits
+        same = DNA3Bit._same_as_next(ints, lengths)
+        run = same
+        for k in range(1, min_run - 1):
+            run = run & (same >> np.uint64(3 * k))
+        return run != 0
+
+    @staticmethod
+    def _same_as_next(ints, lengths) -> np.ndarray:
+        """
+        Set bit 0 of every 3-bit code that is identical to the next code
+        (within the sequence), clear all other bits.
+        """
+        different = DNA3Bit._nonzero_codes(ints ^ (ints >> np.uint64(3)))
+        # only the first `length - 1` positions have a next base
+        num_pairs = np.maximum(lengths - 1, 0).astype(np.uint64)
+        within = (np.uint64(1) << (np.uint64(3) * num_pairs)) - np.uint64(1)
+        return ~different & DNA3Bit.lsb_mask & within
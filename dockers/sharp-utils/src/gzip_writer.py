@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+import os
+import io
+import gzip
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# uncompressed bytes per gzip member
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# rows of a data frame formatted at a time
+CHUNK_SIZE = 100_000
+
+
+def num_threads() -> int:
+    """
+    Number of cores available to this process (e.g. the `cpu` of a task).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class GzipWriter(io.IOBase):
+    """
+    Write-only (text or bytes) file object that compresses its output as a
+    multi-member gzip in a background thread pool.
+
+    Writes are buffered into blocks of `block_size` bytes and every block is
+    compressed into its own gzip member by one of `threads` threads (zlib
+    releases the GIL), so compression overlaps with the caller and uses all
+    cores. Members are written to the file in order. The output is read like
+    any gzip file (`gzip`, `pandas.read_csv`, `zcat`).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        threads: int = None,
+        block_size: int = BLOCK_SIZE,
+        compresslevel: int = 6,
+        encoding: str = "utf-8",
+    ):
+        self.path = path
+        self.threads = threads or num_threads()
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.encoding = encoding
+
+        self._file = open(path, "wb")
+        self._buffer = []
+        self._buffered = 0
+        self._pending = collections.deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+        if isinstance(data, str):
+            self._buffer.append(data.encode(self.encoding))
+        else:
+            self._buffer.append(bytes(data))
+        self._buffered += len(self._buffer[-1])
+
+        if self._buffered >= self.block_size:
+            self._submit()
+
+        return len(data)
+
+    def _submit(self):
+        if not self._buffered:
+            return
+
+        block = b"".join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        self._pending.append(
+            self._executor.submit(gzip.compress, block, self.compresslevel, mtime=0)
+        )
+
+        # write the members that are ready, and wait when too many are in
+        # flight so that memory stays bounded
+        while self._pending and (
+            self._pending[0].done() or len(self._pending) > 2 * self.threads
+        ):
+            self._file.write(self._pending.popleft().result())
+
+    def flush(self):
+        if self._file.closed:
+            return
+
+        self._submit()
+        while self._pending:
+            self._file.write(self._pending.popleft().result())
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+            self._file.close()
+            super().close()
+
+
+def to_csv_gz(
+    df, path: str, threads: int = None, chunk_size: int = CHUNK_SIZE, **kwargs
+):
+    """
+    Write a data frame as gzipped CSV/TSV like `df.to_csv(path,
+    compression="gzip", **kwargs)`, formatting `chunk_size` rows at a time
+    and compressing them in the background with `GzipWriter`.
+    """
+    header = kwargs.pop("header", True)
+
+    with GzipWriter(path, threads=threads) as fout:
+        if len(df) == 0:
+            df.to_csv(fout, header=header, **kwargs)
+        for start in range(0, len(df), chunk_size):
+            df.iloc[start : start + chunk_size].to_csv(
+                fout, header=header if start == 0 else False, **kwargs
+            )
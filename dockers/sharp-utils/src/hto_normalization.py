@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# --mode of the HTO demultiplexers
+CLR = 1
+CLR_POSITIVE = 2
+GMEAN = 3
+
+
+def row_log_gmean(x) -> np.ndarray:
+    """
+    Log of the geometric mean of x + 1 of every row, i.e. mean(log1p(x)).
+
+    Equivalent to `np.log(scipy.stats.mstats.gmean(row + 1))` per row.
+    """
+    return np.log1p(x).mean(axis=1, keepdims=True)
+
+
+def clr(x, out=None) -> np.ndarray:
+    """
+    Centered log-ratio transformation of every row:
+    `log1p((row + 1) / gmean(row + 1))`.
+
+    :param x: 2-D array (barcodes x HTOs)
+    :param out: array to write the result to (can be x itself)
+    """
+    x = np.asarray(x)
+    log_gmean = row_log_gmean(x)
+
+    if out is None:
+        out = np.array(x, dtype=np.float32)
+    elif out is not x:
+        out[...] = x
+
+    out += 1
+    out /= np.exp(log_gmean)
+    return np.log1p(out, out=out)
+
+
+def normalize(umi, mode: int, out=None) -> np.ndarray:
+    """
+    Normalize the UMI counts (barcodes x HTOs) of each barcode.
+
+    1: centered log-ratio (CLR) transformation
+    2: subtract the row mean, clip at 0, then CLR (very noisy methanol-based)
+    3: divide by the geometric mean of the row + 1 (aggressively rescue from
+       doublets if in doubt)
+
+    The result is float32 unless `out` is given. Pass `out=umi` to normalize a
+    float array in place.
+    """
+    umi = np.asarray(umi)
+    if out is None:
+        out = np.array(umi, dtype=np.float32)
+    elif out is not umi:
+        out[...] = umi
+
+    if mode == CLR:
+        return clr(out, out=out)
+    elif mode == CLR_POSITIVE:
+        out -= out.mean(axis=1, keepdims=True)
+        np.maximum(out, 0, out=out)
+        return clr(out, out=out)
+    elif mode == GMEAN:
+        out /= np.exp(row_log_gmean(out))
+        return out
+    else:
+        raise ValueError("Unrecognized mode {}".format(mode))
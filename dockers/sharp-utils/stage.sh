@@ -0,0 +1,10 @@
+#!/bin/bash -e
+
+# copy sharp-utils into a docker build context
+# usage: ../sharp-utils/stage.sh (run from the image directory, e.g. dockers/hto-demux-kmeans)
+
+path_src=$(dirname "$0")
+
+rm -rf ./sharp-utils
+mkdir -p ./sharp-utils
+cp -r ${path_src}/setup.py ${path_src}/benchmark.py ${path_src}/src ./sharp-utils/
@@ -0,0 +1,115 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from barcode_index import BarcodeIndex, barcode_keys
+from dna3bit import DNA3Bit
+
+
+@pytest.fixture
+def barcodes():
+    random.seed(0)
+    return list(
+        set("".join(random.choice("ACGT") for _ in range(16)) for _ in range(5000))
+    )
+
+
+def test_barcode_keys():
+    """Test numeric and nucleotide barcodes map to the same keys"""
+    acgt = ["AAAC", "TTTG", "CGTA"]
+    numeric = DNA3Bit.encode_array(acgt)
+
+    assert barcode_keys(acgt).tolist() == numeric.tolist()
+    assert barcode_keys(numeric.astype(str)).tolist() == numeric.tolist()
+    assert barcode_keys(pd.Index(numeric.astype(np.int64))).dtype == np.uint64
+    assert barcode_keys(["cell1", "cell2"]).dtype.kind == "U"
+
+    with pytest.raises(ValueError):
+        barcode_keys([1, -1])
+
+
+def test_get_indexer_matches_pandas(barcodes):
+    """Test get_indexer against pd.Index.get_indexer"""
+    random.seed(1)
+    query = random.sample(barcodes, 1000) + ["ACGTACGTACGTACGA", "NNNNACGTACGTACGT"]
+    index = BarcodeIndex(barcodes)
+
+    assert (
+        index.get_indexer(query).tolist()
+        == pd.Index(barcodes).get_indexer(query).tolist()
+    )
+    assert index.isin(query).tolist() == pd.Index(query).isin(barcodes).tolist()
+
+
+def test_lookup(barcodes):
+    """Test lookup returns positions and raises on missing barcodes"""
+    index = BarcodeIndex(barcodes)
+
+    assert index.lookup(barcodes[::-1]).tolist() == list(range(len(barcodes)))[::-1]
+
+    with pytest.raises(KeyError):
+        index.lookup(["NNNNACGTACGTACGT"])
+
+
+def test_duplicates():
+    """Test lookups return the first occurrence of a duplicated barcode"""
+    index = BarcodeIndex([30, 10, 20, 10])
+
+    assert not index.is_unique
+    assert index.get_indexer([10, 20, 40]).tolist() == [1, 2, -1]
+
+
+def test_join_preserves_order(barcodes):
+    """Test join against an inner pd.merge on the index"""
+    random.seed(2)
+    df_left = pd.DataFrame(
+        {"a": range(2000)},
+        index=DNA3Bit.encode_array(random.sample(barcodes, 2000)),
+    )
+    df_right = pd.DataFrame(
+        {"b": range(3000)},
+        index=DNA3Bit.encode_array(random.sample(barcodes, 3000)),
+    )
+
+    lpos, rpos = BarcodeIndex(df_right.index).join(df_left.index)
+    df_joined = df_left.iloc[lpos].assign(b=df_right.b.values[rpos])
+
+    df_merged = pd.merge(
+        df_left, df_right, left_index=True, right_index=True, how="inner"
+    )
+    pd.testing.assert_frame_equal(df_joined, df_merged)
+
+
+def test_intersect_difference():
+    """Test set operations keep the order of the index"""
+    index = BarcodeIndex(["0", "5", "2", "4", "1"])
+
+    assert index.intersect(["1", "2", "3"]).tolist() == [2, 1]
+    assert index.difference(BarcodeIndex([1, 2, 3])).tolist() == [0, 5, 4]
+
+    labels = BarcodeIndex(["cell1", "empty1", "cell2"])
+    assert labels.difference(["cell1", "cell2"]).tolist() == ["empty1"]
+
+    with pytest.raises(ValueError):
+        labels.isin([1, 2])
+
+
+def test_empty():
+    index = BarcodeIndex([])
+
+    assert len(index) == 0
+    assert index.get_indexer([1, 2]).tolist() == [-1, -1]
+
+
+def test_save_load(tmp_path, barcodes):
+    """Test .npy roundtrip, including memory-mapped loading"""
+    index = BarcodeIndex(barcodes)
+    path = str(tmp_path / "index.npy")
+    index.save(path)
+
+    for mmap_mode in [None, "r"]:
+        loaded = BarcodeIndex.load(path, mmap_mode=mmap_mode)
+        assert np.array_equal(loaded.keys, index.keys)
+        assert loaded.get_indexer(barcodes).tolist() == list(range(len(barcodes)))
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from classification_io import (
+    is_npz,
+    read_classification,
+    write_classification_npz,
+)
+from dna3bit import DNA3Bit
+
+
+@pytest.fixture
+def df_class():
+    barcodes = ["AAACGTTT", "ACGTACGT", "TTTTCCCC", "GGGGAAAA"]
+    return pd.DataFrame(
+        {
+            "hashID": ["HTO-301", "Doublet", "Negative", "HTO-301"],
+            "pattern": ["1000", "1100", np.nan, "1000"],
+            "score_HTO-301": np.array([2.5, 1.5, np.nan, 3.0], dtype=np.float32),
+        },
+        index=pd.Index(DNA3Bit.encode_array(barcodes).astype(np.int64), name="CB"),
+    )
+
+
+def test_npz_roundtrip(tmp_path, df_class):
+    path = str(tmp_path / "classification.npz")
+
+    write_classification_npz(path, df_class)
+
+    assert is_npz(path)
+    pd.testing.assert_frame_equal(read_classification(path), df_class)
+
+    df = read_classification(path, categorical=True)
+    assert df.hashID.dtype == "category"
+    assert df.hashID.tolist() == df_class.hashID.tolist()
+
+
+def test_npz_nucleotide_barcodes(tmp_path, df_class):
+    """Test nucleotide barcodes are stored as numeric barcodes"""
+    path = str(tmp_path / "classification.npz")
+    df_acgt = df_class.copy()
+    df_acgt.index = DNA3Bit.decode_array(df_class.index.values)
+
+    write_classification_npz(path, df_acgt)
+
+    assert read_classification(path).index.tolist() == df_class.index.tolist()
+
+
+@pytest.mark.parametrize(
+    "name,sep", [("classification.tsv.gz", "\t"), ("classification.csv", ",")]
+)
+def test_detect_text(tmp_path, df_class, name, sep):
+    """Test text tables are read like the stages always did"""
+    path = str(tmp_path / name)
+    df_class.to_csv(path, sep=sep)
+
+    assert not is_npz(path)
+    pd.testing.assert_frame_equal(
+        read_classification(path), pd.read_csv(path, sep=sep, index_col=0)
+    )
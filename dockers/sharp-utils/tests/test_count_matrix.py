@@ -0,0 +1,132 @@
+import os
+import gzip
+
+import numpy as np
+import pytest
+import scipy.io
+import scipy.sparse
+
+import count_matrix
+from count_matrix import narrow_counts, read_count_dir, read_mtx
+
+
+def random_matrix(shape=(5, 300), field="integer", seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = scipy.sparse.random(*shape, density=0.3, random_state=seed, format="coo")
+    if field == "integer":
+        matrix.data = rng.integers(1, 1000, matrix.nnz).astype(np.int64)
+    return matrix
+
+
+def write_count_dir(path, matrix):
+    """
+    Write a CITE-seq-Count style count directory (features x barcodes).
+    """
+    os.makedirs(path, exist_ok=True)
+    with gzip.open(os.path.join(path, "matrix.mtx.gz"), "wb") as fout:
+        scipy.io.mmwrite(fout, matrix)
+    with gzip.open(os.path.join(path, "barcodes.tsv.gz"), "wt") as fout:
+        fout.writelines("CB{:06d}\n".format(i) for i in range(matrix.shape[1]))
+    with gzip.open(os.path.join(path, "features.tsv.gz"), "wt") as fout:
+        fout.writelines("HTO_{}-ACGT\n".format(i) for i in range(matrix.shape[0] - 1))
+        fout.write("unmapped\n")
+
+
+@pytest.fixture(params=[True, False], ids=["mmread", "numpy"])
+def fast_mmread(request, monkeypatch):
+    """Run with scipy.io.mmread and with the NumPy parser of older scipy"""
+    monkeypatch.setattr(count_matrix, "FAST_MMREAD", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("field", ["integer", "real", "pattern"])
+@pytest.mark.parametrize("path", ["matrix.mtx", "matrix.mtx.gz"])
+def test_matches_mmread(tmp_path, monkeypatch, fast_mmread, field, path):
+    """Test parity with scipy.io.mmread"""
+    path = str(tmp_path / path)
+    with (gzip.open if path.endswith(".gz") else open)(path, "wb") as fout:
+        scipy.io.mmwrite(fout, random_matrix(field=field), field=field)
+    # parse in several chunks
+    monkeypatch.setattr(count_matrix, "CHUNK_SIZE", 1000)
+
+    expected = scipy.io.mmread(path).tocsr()
+    actual = read_mtx(path)
+    transposed = read_mtx(path, transpose=True)
+
+    assert actual.dtype == expected.dtype
+    assert actual.shape == expected.shape
+    assert (actual != expected).nnz == 0
+    assert (transposed != expected.T).nnz == 0
+
+
+def test_malformed(tmp_path, fast_mmread):
+    path = str(tmp_path / "matrix.mtx")
+
+    with open(path, "wt") as fout:
+        fout.write("%%MatrixMarket matrix coordinate integer general\n2 2 2\n1 1 5\n")
+    with pytest.raises(ValueError):
+        read_mtx(path)
+
+    with open(path, "wt") as fout:
+        fout.write("%%MatrixMarket matrix array integer general\n2 2\n1\n2\n3\n4\n")
+    with pytest.raises(ValueError):
+        read_mtx(path)
+
+
+def test_read_count_dir(tmp_path):
+    """Test the matrix is barcodes x features along with the names"""
+    path = str(tmp_path / "umi_count")
+    matrix = random_matrix()
+    write_count_dir(path, matrix)
+
+    actual, barcodes, features = read_count_dir(path)
+
+    assert (actual != matrix.T.tocsr()).nnz == 0
+    assert barcodes[:2].tolist() == ["CB000000", "CB000001"]
+    assert features.tolist()[-2:] == ["HTO_3-ACGT", "unmapped"]
+
+
+def test_cache(tmp_path):
+    """Test the sidecar is reused and invalidated when the inputs change"""
+    path = str(tmp_path / "umi_count")
+    write_count_dir(path, random_matrix())
+
+    expected = read_count_dir(path, cache=True)
+    sidecars = [name for name in os.listdir(path) if name.endswith(".npz")]
+    assert len(sidecars) == 1
+
+    cached = read_count_dir(path, cache=True)
+    assert (cached[0] != expected[0]).nnz == 0
+    assert cached[0].dtype == expected[0].dtype
+    assert cached[1].tolist() == expected[1].tolist()
+    assert cached[2].tolist() == expected[2].tolist()
+
+    write_count_dir(path, random_matrix(seed=1))
+    updated = read_count_dir(path, cache=True)
+    assert (updated[0] != random_matrix(seed=1).T.tocsr()).nnz == 0
+    assert len([name for name in os.listdir(path) if name.endswith(".npz")]) == 2
+
+
+@pytest.mark.parametrize(
+    "largest,dtype",
+    [(1, np.uint16), (65535, np.uint16), (65536, np.uint32), (2**32, np.int64)],
+)
+def test_narrow_counts(largest, dtype):
+    matrix = random_matrix().tocsr()
+    matrix.data[0] = largest
+
+    narrowed = narrow_counts(matrix)
+
+    assert narrowed.dtype == dtype
+    assert (narrowed != matrix).nnz == 0
+    assert narrow_counts(matrix.toarray()).dtype == dtype
+
+
+def test_narrow_counts_unchanged():
+    """Test non-count matrices keep their dtype"""
+    real = random_matrix(field="real").tocsr()
+    negative = random_matrix().tocsr()
+    negative.data[0] = -1
+
+    assert narrow_counts(real).dtype == np.float64
+    assert narrow_counts(negative).dtype == np.int64
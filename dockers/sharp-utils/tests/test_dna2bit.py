@@ -0,0 +1,104 @@
+import random
+
+import numpy as np
+import pytest
+
+from dna2bit import DNA2Bit
+from dna3bit import DNA3Bit
+
+
+@pytest.fixture
+def barcodes():
+    random.seed(0)
+    return ["".join(random.choice("ACGT") for _ in range(16)) for _ in range(5000)]
+
+
+def test_encode_decode_roundtrip(barcodes):
+    """Test N-free 16bp barcodes fit in uint32 and survive a roundtrip"""
+    encoder = DNA2Bit(16)
+
+    codes = encoder.encode_array(barcodes)
+
+    assert codes.dtype == np.uint32
+    assert not DNA2Bit.is_escaped(codes).any()
+    assert len(encoder.escape_table) == 0
+    assert encoder.decode_array(codes).tolist() == barcodes
+
+
+def test_encode_order():
+    """Test the first nucleotide is in the most significant position"""
+    encoder = DNA2Bit(4)
+
+    codes = encoder.encode_array(["AAAA", "AAAC", "CAAA", "TTTT"])
+
+    assert codes.tolist() == [0b00000000, 0b00000001, 0b01000000, 0b11111111]
+
+
+def test_escape_table():
+    """Test barcodes with N or the wrong length go to the escape table"""
+    encoder = DNA2Bit(16)
+    barcodes = [
+        "ACGTACGTACGTACGT",
+        "ACGTNCGTACGTACGT",
+        "ACGT",
+        "ACGTNCGTACGTACGT",
+        "ACGTACGTACGTACGTA",
+    ]
+
+    codes = encoder.encode_array(barcodes)
+    escaped = DNA2Bit.is_escaped(codes)
+
+    assert codes.dtype == np.uint64
+    assert escaped.tolist() == [False, True, True, True, True]
+    # duplicates are only stored once
+    assert encoder.escape_table == ["ACGTNCGTACGTACGT", "ACGT", "ACGTACGTACGTACGTA"]
+    assert (codes[escaped] & ~DNA2Bit.ESCAPED).tolist() == [0, 1, 0, 2]
+    assert encoder.decode_array(codes).tolist() == barcodes
+
+
+def test_escape_codes_are_distinct():
+    """Test escaped codes never equal the code of a 2-bit encoded barcode"""
+    encoder = DNA2Bit(16)
+
+    codes = encoder.encode_array(["NNNNNNNNNNNNNNNN", "AAAAAAAAAAAAAAAA"])
+
+    # the first escape is at position 0 of the table, "A" * 16 is code 0
+    assert (codes[0] & ~DNA2Bit.ESCAPED) == 0
+    assert codes[1] == 0
+    assert codes[0] != codes[1]
+
+
+def test_dna3bit_conversion(barcodes):
+    """Test conversion from/to DNA3Bit without going through strings"""
+    barcodes = barcodes + ["ACGTNCGTACGTACGT", "ACGT"]
+    encoder = DNA2Bit(16)
+    ints = DNA3Bit.encode_array(barcodes)
+
+    codes = encoder.from_dna3bit(ints)
+
+    assert DNA2Bit.is_escaped(codes).tolist() == [False] * (len(barcodes) - 2) + [
+        True,
+        True,
+    ]
+    np.testing.assert_array_equal(codes, encoder.encode_array(barcodes))
+    assert encoder.decode_array(codes).tolist() == barcodes
+    np.testing.assert_array_equal(encoder.to_dna3bit(codes), ints)
+
+
+def test_cb_umi_keys(barcodes):
+    """Test CB + 12bp UMI keys fit in uint64"""
+    umis = [b[:12] for b in barcodes]
+    cb_codes = DNA2Bit(16).encode_array(barcodes)
+    umi_codes = DNA2Bit(12).encode_array(umis)
+
+    keys = DNA2Bit.concat(cb_codes, umi_codes, 12)
+
+    expected = DNA2Bit(28).encode_array([b + u for b, u in zip(barcodes, umis)])
+    assert keys.dtype == np.uint64
+    np.testing.assert_array_equal(keys, expected)
+
+    with pytest.raises(ValueError):
+        DNA2Bit.concat(DNA2Bit(31).encode_array(["T" * 31]), umi_codes[:1], 12)
+
+    with pytest.raises(ValueError):
+        DNA2Bit.concat(DNA2Bit(16).encode_array(["N" * 16]), umi_codes[:1], 12)
@@ -0,0 +1,151 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dna3bit import DNA3Bit
+
+
+@pytest.fixture
+def barcodes():
+    random.seed(0)
+    # mixed lengths incl. empty, lowercase and N-containing sequences
+    return [
+        "".join(random.choice("ACGTNacgtn") for _ in range(random.randint(0, 21)))
+        for _ in range(5000)
+    ]
+
+
+def test_encode_array_matches_encode(barcodes):
+    """Test batch encoding gives the same results as the scalar version"""
+    expected = np.array([DNA3Bit.encode(b) for b in barcodes], dtype=np.uint64)
+
+    encoded = DNA3Bit.encode_array(barcodes)
+
+    assert encoded.dtype == np.uint64
+    np.testing.assert_array_equal(encoded, expected)
+
+
+def test_decode_array_matches_decode(barcodes):
+    """Test batch decoding gives the same results as the scalar version"""
+    encoded = DNA3Bit.encode_array(barcodes)
+    expected = [DNA3Bit.decode(int(i)).decode() for i in encoded]
+
+    decoded = DNA3Bit.decode_array(encoded)
+
+    assert list(decoded) == expected
+
+
+def test_array_roundtrip_fixed_length():
+    """Test 16bp (10x) barcodes survive a roundtrip"""
+    barcodes = pd.Index(["AAACCCAAGAAACACT", "AAACCCAAGAAACTGC", "NNNNNNNNNNNNNNNN"])
+
+    decoded = DNA3Bit.decode_array(DNA3Bit.encode_array(barcodes))
+
+    assert list(decoded) == list(barcodes)
+
+
+def test_array_input_types():
+    """Test bytes, signed ints and numerical strings are accepted"""
+    assert DNA3Bit.encode_array([b"ACGT", b"A"]).tolist() == [2475, 4]
+    assert DNA3Bit.decode_array(np.array([2475, 4], dtype=np.int64)).tolist() == [
+        "ACGT",
+        "A",
+    ]
+    numerical_strings = np.asarray(["2475", "4"], dtype=np.uint64)
+    assert DNA3Bit.decode_array(numerical_strings).tolist() == ["ACGT", "A"]
+    assert len(DNA3Bit.encode_array([])) == 0
+    assert len(DNA3Bit.decode_array([])) == 0
+
+
+def test_array_invalid_inputs():
+    """Test invalid inputs are rejected"""
+    with pytest.raises(ValueError):
+        DNA3Bit.encode_array(["ACGX"])
+    with pytest.raises(ValueError):
+        DNA3Bit.encode_array(["A" * 22])
+    with pytest.raises(ValueError):
+        DNA3Bit.decode_array([-1])
+    with pytest.raises(ValueError):
+        # 0b001 is not a valid base
+        DNA3Bit.decode_array([0b001100])
+
+
+def test_parity_with_seqc(barcodes):
+    """Test encodings are identical to SEQC's (used to produce dense/sparse matrices)"""
+    encodings = pytest.importorskip("seqc.sequence.encodings")
+    seqc_dna3bit = encodings.DNA3Bit()
+
+    encoded = DNA3Bit.encode_array(barcodes)
+    expected = [seqc_dna3bit.encode(b.encode()) for b in barcodes]
+    np.testing.assert_array_equal(encoded, np.array(expected, dtype=np.uint64))
+
+    decoded = DNA3Bit.decode_array(encoded)
+    assert list(decoded) == [seqc_dna3bit.decode(int(i)).decode() for i in encoded]
+
+
+def test_seq_len(barcodes):
+    """Test scalar and vectorized sequence lengths"""
+    encoded = DNA3Bit.encode_array(barcodes)
+
+    assert [DNA3Bit.seq_len(int(i)) for i in encoded] == [len(b) for b in barcodes]
+    np.testing.assert_array_equal(
+        DNA3Bit.seq_len_array(encoded), [len(b) for b in barcodes]
+    )
+
+
+@pytest.mark.parametrize("base", ["A", "C", "G", "T", "N"])
+def test_count_and_contains_array(barcodes, base):
+    """Test vectorized count/contains match the scalar versions"""
+    encoded = DNA3Bit.encode_array(barcodes)
+    char_bin = DNA3Bit.str2bindict[base]
+
+    np.testing.assert_array_equal(
+        DNA3Bit.count_array(encoded, char_bin),
+        [DNA3Bit.count(int(i), char_bin) for i in encoded],
+    )
+    np.testing.assert_array_equal(
+        DNA3Bit.contains_array(encoded, char_bin),
+        [DNA3Bit.contains(int(i), char_bin) for i in encoded],
+    )
+
+    with pytest.raises(ValueError):
+        DNA3Bit.count_array(encoded, 0b001)
+
+
+def test_gc_content_array():
+    """Test GC content"""
+    encoded = DNA3Bit.encode_array(["GCGC", "ACGT", "AATT", "GNNN", ""])
+
+    np.testing.assert_allclose(
+        DNA3Bit.gc_content_array(encoded), [1.0, 0.5, 0.0, 0.25, 0.0]
+    )
+
+
+def test_homopolymer_array():
+    """Test homopolymer flags"""
+    barcodes = ["TTTTTTTTTTTTTTTT", "ACGTTTTTACGTACGT", "ACGTACGTACGTACGT", "A", ""]
+    encoded = DNA3Bit.encode_array(barcodes)
+
+    assert DNA3Bit.homopolymer_array(encoded).tolist() == [
+        True,
+        False,
+        False,
+        True,
+        False,
+    ]
+    assert DNA3Bit.homopolymer_array(encoded, min_run=5).tolist() == [
+        True,
+        True,
+        False,
+        False,
+        False,
+    ]
+    assert DNA3Bit.homopolymer_array(encoded, min_run=6).tolist() == [
+        True,
+        False,
+        False,
+        False,
+        False,
+    ]
@@ -0,0 +1,65 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.io
+import scipy.sparse
+
+from gzip_writer import GzipWriter, to_csv_gz
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_multi_member(tmp_path, threads):
+    """Test small blocks are written in order as several gzip members"""
+    path = str(tmp_path / "out.txt.gz")
+    lines = ["line {}\n".format(i) for i in range(1000)]
+
+    with GzipWriter(path, threads=threads, block_size=100) as fout:
+        for line in lines:
+            fout.write(line)
+
+    assert gzip.open(path, "rt").read() == "".join(lines)
+
+    # every member starts with the gzip magic
+    with open(path, "rb") as fin:
+        assert fin.read().count(b"\x1f\x8b\x08") > 1
+
+
+def test_bytes(tmp_path):
+    """Test binary writers (e.g. scipy.io.mmwrite) can write to it"""
+    path = str(tmp_path / "matrix.mtx.gz")
+    matrix = scipy.sparse.random(20, 30, density=0.3, random_state=0, format="coo")
+
+    with GzipWriter(path, block_size=64) as fout:
+        scipy.io.mmwrite(fout, matrix)
+
+    assert np.allclose(scipy.io.mmread(path).toarray(), matrix.toarray())
+
+
+def test_closed(tmp_path):
+    fout = GzipWriter(str(tmp_path / "out.txt.gz"))
+    fout.close()
+    fout.close()
+
+    with pytest.raises(ValueError):
+        fout.write("x")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+def test_to_csv_gz(tmp_path, chunk_size):
+    """Test the output is the same as to_csv(compression="gzip")"""
+    df = pd.DataFrame(
+        {"hashID": ["HTO-301", "Doublet", "Negative", "HTO-302"], "score": range(4)},
+        index=pd.Index([11, 12, 13, 14], name="CB"),
+    )
+    path_expected = str(tmp_path / "expected.tsv.gz")
+    path_actual = str(tmp_path / "actual.tsv.gz")
+
+    df.to_csv(path_expected, sep="\t", compression="gzip")
+    to_csv_gz(df, path_actual, chunk_size=chunk_size, sep="\t")
+
+    assert gzip.open(path_actual).read() == gzip.open(path_expected).read()
+
+    to_csv_gz(df.iloc[:0], path_actual, sep="\t", header=None)
+    assert gzip.open(path_actual).read() == b""
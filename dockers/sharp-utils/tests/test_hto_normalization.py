@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from hto_normalization import normalize
+
+gmean = pytest.importorskip("scipy.stats.mstats").gmean
+
+
+@pytest.fixture
+def umi():
+    rng = np.random.default_rng(0)
+    umi = rng.poisson(5, size=(500, 6))
+    umi[np.arange(500), rng.integers(0, 6, 500)] += rng.poisson(200, 500)
+    umi[:10] = 0
+    return umi
+
+
+def normalize_lambdas(umi, mode):
+    """The original row-wise implementation"""
+    if mode == 1:
+        return np.apply_along_axis(
+            lambda row: np.log1p((row + 1) / gmean(row + 1)), 1, umi
+        )
+    elif mode == 2:
+        clr = np.apply_along_axis(lambda row: row - np.mean(row), 1, umi)
+        clr[clr < 0] = 0
+        return np.apply_along_axis(
+            lambda row: np.log1p((row + 1) / gmean(row + 1)), 1, clr
+        )
+    else:
+        return np.apply_along_axis(lambda row: row / gmean(row + 1), 1, umi)
+
+
+@pytest.mark.parametrize("mode", [1, 2, 3])
+def test_matches_lambdas(umi, mode):
+    """Test numeric parity with the row-wise gmean lambdas"""
+    expected = normalize_lambdas(umi.astype(np.float64), mode)
+
+    actual = normalize(umi, mode)
+
+    assert actual.dtype == np.float32
+    assert np.allclose(actual, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize("mode", [1, 2, 3])
+def test_in_place(umi, mode):
+    x = umi.astype(np.float32)
+
+    actual = normalize(x, mode, out=x)
+
+    assert actual is x
+    assert np.array_equal(actual, normalize(umi, mode))
+
+
+def test_unknown_mode(umi):
+    with pytest.raises(ValueError):
+        normalize(umi, 4)
@@ -0,0 +1,116 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+
+from two_means import (
+    cluster_size,
+    label_patterns,
+    pack_labels,
+    two_means_rows,
+    within_cluster_ss,
+)
+
+
+def random_rows(num_rows, num_htos, seed=0):
+    """
+    CLR-like rows: a background with one or two high HTOs.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.poisson(5, size=(num_rows, num_htos)).astype(np.float32)
+    x[np.arange(num_rows), rng.integers(0, num_htos, num_rows)] += rng.poisson(
+        100, num_rows
+    )
+    x[: num_rows // 4, 0] += rng.poisson(100, num_rows // 4)
+    return np.log1p(x)
+
+
+def best_split_brute_force(row):
+    """
+    Minimum within-cluster sum of squares over all 2-partitions of a row.
+    """
+    best = np.inf
+    for labels in itertools.product([0, 1], repeat=len(row)):
+        if 0 < sum(labels) < len(row):
+            best = min(best, within_cluster_ss(row[None, :], [labels])[0])
+    return best
+
+
+@pytest.mark.parametrize("num_htos", [2, 4, 7])
+def test_optimal(num_htos):
+    """Test the split is optimal over all 2-partitions of each row"""
+    x = random_rows(200, num_htos)
+
+    ss = within_cluster_ss(x, two_means_rows(x))
+
+    expected = [best_split_brute_force(row) for row in x]
+    assert np.allclose(ss, expected)
+
+
+def test_labels():
+    """Test the larger values get label 1 and ties stay together"""
+    x = np.array(
+        [
+            [0.1, 3.0, 0.2, 0.1],
+            [2.0, 2.0, 0.0, 2.0],
+            [1.0, 1.0, 1.0, 1.0],
+            [0.0, 0.0, 0.0, 5.0],
+        ]
+    )
+
+    labels = two_means_rows(x)
+
+    assert labels.dtype == np.uint8
+    assert labels.tolist() == [
+        [0, 1, 0, 0],
+        [1, 1, 0, 1],
+        [0, 0, 0, 0],
+        [0, 0, 0, 1],
+    ]
+
+
+def test_edge_cases():
+    assert two_means_rows(np.zeros((0, 4))).shape == (0, 4)
+    assert two_means_rows(np.ones((3, 1))).tolist() == [[0], [0], [0]]
+
+    with pytest.raises(ValueError):
+        two_means_rows(np.ones(4))
+
+
+def test_matches_sklearn():
+    """Test against fitting sklearn KMeans on each row"""
+    KMeans = pytest.importorskip("sklearn.cluster").KMeans
+
+    x = random_rows(500, 4, seed=1)
+    labels = two_means_rows(x)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for row, label in zip(x, labels):
+            expected = KMeans(n_clusters=2, random_state=0).fit_predict(
+                row.reshape(-1, 1)
+            )
+            ss = within_cluster_ss(row[None, :], [label])[0]
+            ss_expected = within_cluster_ss(row[None, :], [expected])[0]
+            # same clusters unless sklearn stopped at a worse local optimum
+            if ss_expected <= ss + 1e-9:
+                assert (label == expected).all() or (label != expected).all()
+            else:
+                assert ss < ss_expected
+
+
+def test_cluster_size():
+    labels = np.array([[0, 1, 0, 0], [1, 1, 0, 1], [0, 0, 0, 0]], dtype=np.uint8)
+
+    assert cluster_size(labels, [1, 0, 2]).tolist() == [1, 3, 4]
+    assert cluster_size(labels, [0, 2, 2]).tolist() == [3, 1, 4]
+
+
+def test_label_patterns():
+    labels = np.array([[0, 1, 1, 0], [0, 0, 0, 1], [0, 1, 1, 0]], dtype=np.uint8)
+
+    assert pack_labels(labels).tolist() == [0b0110, 0b0001, 0b0110]
+
+    patterns, codes = label_patterns(labels)
+    assert patterns[codes].tolist() == ["0110", "0001", "0110"]
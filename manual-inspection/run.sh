@@ -62,7 +62,7 @@ rm -rf ${workflow_id}.sample_name.txt
 path_out="${path_base_data}/${sample_name}/${workflow_id}"
 
 # copy dependency to make the final notebook standalone
-cp dna3bit.py ${path_out}/
+cp ../dockers/sharp-utils/src/dna3bit.py ${path_out}/
 
 # asapseq and cellplex share the same hashtag inspection notebook
 if [ "$type" == "asapseq" ] || [ "$type" == "cellplex" ]